@@ -0,0 +1,113 @@
+'''
+This module writes a whole output tree (e.g. clean/ or transformed/) as a
+few large shard files instead of one small file per transcript.
+
+An archive is a directory with:
+- shard-00000.bin, shard-00001.bin, ... : records back to back, each being
+      uint32 key size, key (utf-8), uint64 data size, data (utf-8)
+      (little-endian), so that a shard can also be read without the index
+- index.json : {key: [shard number, data offset, data size]} in the order
+      the records were written
+The key of a record is the path of the original .cha file (e.g.
+Data/Sachs/020126.cha), and the data is the content of the output file.
+Reading one record is a lookup in the index and a single read.
+part2-lm-sounds/src/corpus.py can read the transformed archive directly.
+'''
+import os, json, struct
+
+RECORD_KEY = struct.Struct("<I")
+RECORD_DATA = struct.Struct("<Q")
+# A new shard is started when the current one is bigger than this
+SHARD_SIZE = 256 << 20
+
+def shard_path(directory, shard):
+    '''
+    This function returns the path of a shard of the archive.
+    '''
+    return os.path.join(directory, f"shard-{shard:05d}.bin")
+
+class ArchiveWriter:
+    '''
+    This class writes records to an archive directory. Records are added
+    one at a time, and the index is written when the archive is closed.
+    '''
+    def __init__(self, directory, shard_size=SHARD_SIZE):
+        print("Writing archive: " + directory)
+        self.directory = directory
+        self.shard_size = shard_size
+        os.makedirs(directory, exist_ok=True)
+        # Shards of a previous archive would not be in the new index
+        for file in os.listdir(directory):
+            if file.startswith("shard-") or file == "index.json":
+                os.remove(os.path.join(directory, file))
+        self.index = dict()
+        self.shard = 0
+        self.file = open(shard_path(directory, self.shard), 'wb')
+
+    def add(self, key, text):
+        '''
+        This method adds a record with the given key and text.
+        '''
+        if self.file.tell() >= self.shard_size:
+            self.file.close()
+            self.shard += 1
+            self.file = open(shard_path(self.directory, self.shard), 'wb')
+
+        key_bytes, data = key.encode("utf-8"), text.encode("utf-8")
+        self.file.write(RECORD_KEY.pack(len(key_bytes)) + key_bytes + RECORD_DATA.pack(len(data)))
+        self.index[key] = [self.shard, self.file.tell(), len(data)]
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        with open(os.path.join(self.directory, "index.json"), 'w', encoding='utf-8') as file:
+            json.dump(self.index, file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ArchiveReader:
+    '''
+    This class reads an archive directory written by ArchiveWriter.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json"), 'r', encoding='utf-8') as file:
+            self.index = json.load(file)
+        self.files = dict()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def read(self, key):
+        '''
+        This method returns the text of the record with the given key.
+        '''
+        shard, offset, size = self.index[key]
+        if shard not in self.files:
+            self.files[shard] = open(shard_path(self.directory, shard), 'rb')
+        file = self.files[shard]
+        file.seek(offset)
+        return file.read(size).decode("utf-8")
+
+    def __iter__(self):
+        '''
+        This method yields (key, text) for every record, in the order they
+        were written, reading the shards sequentially.
+        '''
+        for key in self.index:
+            yield key, self.read(key)
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        self.files = dict()
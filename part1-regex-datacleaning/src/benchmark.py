@@ -0,0 +1,318 @@
+'''
+This module benchmarks the cleaning and transformation of src/main.py, so
+that a change to the cleaning rules, the transformation or cmu_dict can be
+checked for speed regressions. Run it from the part1-regex-datacleaning
+directory:
+    python3 src/benchmark.py --scale 1 10 --dict path/to/cmudict-0.7b
+It generates a synthetic CHAT corpus for every scale (see generate_corpus()),
+times every stage separately and writes the results to benchmark.json.
+
+The stages are timed file by file, in this order:
+- read      : reading the .cha file
+- filter    : removing the header, filtering the conversation lines and
+              removing the speaker tags
+- clean     : removing the extraneous information (remove_extraneous_info())
+- transform : transforming the cleaned lines (transform_lines())
+- write     : writing the clean and transformed files
+The loading of the dictionary is timed once (see time_dictionary()), and so
+are the fuzzy queries of dict_index.py on the words of unk.txt (see
+time_fuzzy()).
+'''
+import os, json, time, random, shutil, hashlib, platform, argparse, statistics
+import cmu_dict as cmu
+import dict_index
+import main
+
+BENCHMARK_DIR = "benchmark"
+BENCHMARK_VERSION = 2
+STAGES = ["read", "filter", "clean", "transform", "write"]
+
+'''
+Synthetic corpus
+'''
+def split_blocks(lines):
+    '''
+    This function splits the lines of a .cha file into the header (the lines
+    before the first utterance), the utterance blocks (an utterance line,
+    starting with *, with its dependent tiers and continuation lines) and
+    the trailer (the lines starting with @ after the last utterance, e.g.
+    @End).
+    '''
+    header, blocks, trailer = list(), list(), list()
+    for line in lines:
+        if line.startswith("*"):
+            blocks.append([line])
+        elif not blocks:
+            header.append(line)
+        elif line.startswith("@"):
+            trailer.append(line)
+        elif trailer:
+            trailer.append(line)
+        else:
+            blocks[-1].append(line)
+    return header, blocks, trailer
+
+def generate_corpus(source, destination, scale, seed=0):
+    '''
+    This function writes a synthetic CHAT corpus scale times the size of the
+    corpus in source to destination. The first copy (copy-000) is the
+    corpus itself, and every other copy has the same files with their
+    utterance blocks (see split_blocks()) shuffled, so the corpus has the
+    same words, lines and markup as the real one but different contexts.
+    The corpus only depends on source, scale and seed, and it is not
+    generated again if it already exists.
+    '''
+    marker = os.path.join(destination, "corpus.json")
+    description = {"source": os.path.abspath(source), "scale": scale, "seed": seed}
+    if os.path.exists(marker):
+        with open(marker, 'r', encoding='utf-8') as file:
+            if json.load(file) == description:
+                return
+    shutil.rmtree(destination, ignore_errors=True)
+
+    print(f"Generating {scale}x corpus: {destination}")
+    file_paths = main.find_files(source, ".cha")
+    for copy in range(scale):
+        rng = random.Random(f"{seed}-{copy}")
+        for file_path in file_paths:
+            with open(file_path, 'r', encoding='utf-8', newline='') as file:
+                lines = file.readlines()
+            if copy > 0:
+                header, blocks, trailer = split_blocks(lines)
+                rng.shuffle(blocks)
+                lines = header + [line for block in blocks for line in block] + trailer
+
+            output_path = os.path.join(destination, f"copy-{copy:03d}", os.path.relpath(file_path, source))
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, 'w', encoding='utf-8', newline='') as file:
+                file.writelines(lines)
+
+    with open(marker, 'w', encoding='utf-8') as file:
+        json.dump(description, file)
+
+'''
+Timing
+'''
+def time_dictionary(source, cache_dir):
+    '''
+    This function times the steps of cmu_dict.cmu_dictionary() separately:
+    reading the source, tokenizing it (tokenize_dict()), building the cache
+    and loading the cache, which is what every run after the first does.
+    It returns (the dictionary, the timings in seconds).
+    '''
+    timings = dict()
+    start = time.perf_counter()
+    raw = cmu.read_source(source)
+    timings["read"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dictionary = cmu.tokenize_dict(cmu.relevant_lines(raw))
+    timings["tokenize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    digest = cmu.checksum(raw)
+    cmu.save_cache(dictionary, digest, source, cache_dir)
+    timings["cache_build"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dictionary = cmu.load_cache(digest, cache_dir)
+    timings["cache_load"] = time.perf_counter() - start
+    timings["words"] = len(dictionary)
+    return dictionary, timings
+
+def time_fuzzy(dictionary, words, max_distance=dict_index.MAX_DISTANCE):
+    '''
+    This function times the building of the delete index of
+    dict_index.DictionaryIndex.fuzzy() and the fuzzy query of every word
+    (e.g. the unknown words of unk.txt) within max_distance edits. It
+    returns the timings in seconds.
+    '''
+    index = dict_index.DictionaryIndex(dictionary)
+    start = time.perf_counter()
+    index.build_delete_index()
+    build = time.perf_counter() - start
+
+    latencies = list()
+    for word in words:
+        start = time.perf_counter()
+        index.fuzzy(word, max_distance)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "build": build,
+        "max_distance": max_distance,
+        "queries": len(latencies),
+        "query": {
+            "median": statistics.median(latencies),
+            "p90": latencies[len(latencies) * 9 // 10],
+            "max": latencies[-1],
+        },
+    }
+
+def time_stages(file_paths, source, output_dir, dictionary):
+    '''
+    This function cleans and transforms every file of file_paths (in
+    source) with the stages of src/main.py, writing the outputs to
+    output_dir, and returns the seconds spent in every stage (see STAGES).
+    Every stage is run to the end on a file before the next one starts, so
+    that it can be timed on its own. The token cache starts empty.
+    '''
+    main.TOKEN_CACHE = None
+    timings = dict.fromkeys(STAGES, 0.0)
+    totals = main.Statistics()
+    clock = time.perf_counter
+    for file_path in file_paths:
+        start = clock()
+        lines = main.read_file(file_path)
+        read = clock()
+        lines = list(main.remove_speaker_tag(main.filter_conversation(main.remove_header(lines))))
+        filtered = clock()
+        cleaned = list(main.remove_extraneous_info(lines, totals))
+        clean = clock()
+        transformed = list(main.transform_lines(main.join_lines(cleaned), dictionary, totals))
+        transform = clock()
+        relative_path = os.path.splitext(os.path.relpath(file_path, source))[0] + ".txt"
+        for tree, content in (("clean", cleaned), ("transformed", transformed)):
+            output_path = os.path.join(output_dir, tree, relative_path)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            main.write_file(output_path, content)
+        write = clock()
+
+        timings["read"] += read - start
+        timings["filter"] += filtered - read
+        timings["clean"] += clean - filtered
+        timings["transform"] += transform - clean
+        timings["write"] += write - transform
+        totals.transformed_lines = list()
+    return timings
+
+def corpus_size(file_paths):
+    '''
+    This function returns the number of lines and bytes of the files.
+    '''
+    line_count, byte_count = 0, 0
+    for file_path in file_paths:
+        with open(file_path, 'rb') as file:
+            content = file.read()
+        line_count += content.count(b"\n")
+        byte_count += len(content)
+    return line_count, byte_count
+
+def summarize(samples):
+    '''
+    This function returns the minimum and median of a list of timings,
+    with the timings themselves.
+    '''
+    return {"min": min(samples), "median": statistics.median(samples), "samples": samples}
+
+def benchmark_scale(scale, source, work_dir, dictionary, repeat=3, seed=0):
+    '''
+    This function generates the corpus of the given scale and times the
+    stages repeat times on it. It returns the results of the scale.
+    '''
+    corpus_dir = os.path.join(work_dir, f"corpus-{scale}x")
+    generate_corpus(source, corpus_dir, scale, seed)
+    file_paths = main.find_files(corpus_dir, ".cha")
+    line_count, byte_count = corpus_size(file_paths)
+
+    runs = list()
+    for i in range(repeat):
+        output_dir = os.path.join(work_dir, "output")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        timings = time_stages(file_paths, corpus_dir, output_dir, dictionary)
+        runs.append(timings)
+        print(f"{scale}x run {i + 1}/{repeat}: " + ", ".join(f"{stage} {timings[stage]:.3f}s" for stage in STAGES))
+    shutil.rmtree(os.path.join(work_dir, "output"), ignore_errors=True)
+
+    stages = {stage: summarize([run[stage] for run in runs]) for stage in STAGES}
+    totals = [sum(run.values()) for run in runs]
+    return {
+        "scale": scale,
+        "files": len(file_paths),
+        "lines": line_count,
+        "bytes": byte_count,
+        "stages": stages,
+        "total": summarize(totals),
+        "lines_per_second": round(line_count / max(min(totals), 1e-9)),
+    }
+
+def environment():
+    '''
+    This function returns what the results depend on besides the code of
+    the stages, so that results of different versions can be compared.
+    '''
+    try:
+        with open(os.path.join(os.path.dirname(__file__), "main.py"), 'rb') as file:
+            source_checksum = hashlib.sha256(file.read()).hexdigest()
+    except OSError:
+        source_checksum = None
+    return {
+        "benchmark_version": BENCHMARK_VERSION,
+        "cleaning_version": main.CLEANING_VERSION,
+        "transform_version": main.TRANSFORM_VERSION,
+        "main_checksum": source_checksum,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def run_benchmark(scales=(1,), dictionary_source=cmu.URL, source="Data", work_dir=BENCHMARK_DIR,
+                  repeat=3, seed=0, fuzzy_words="unk.txt"):
+    '''
+    This function runs the benchmark for every scale and returns the results
+    (a json serializable dict). The fuzzy queries are timed on the words of
+    fuzzy_words if the file exists.
+    '''
+    os.makedirs(work_dir, exist_ok=True)
+    dictionary_timings = list()
+    for i in range(repeat):
+        cache_dir = os.path.join(work_dir, "cache")
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        dictionary, timings = time_dictionary(dictionary_source, cache_dir)
+        dictionary_timings.append(timings)
+    print("Dictionary: " + ", ".join(f"{step} {dictionary_timings[-1][step]:.3f}s"
+                                     for step in ("read", "tokenize", "cache_build", "cache_load")))
+    fuzzy = None
+    if fuzzy_words is not None and os.path.exists(fuzzy_words):
+        fuzzy = time_fuzzy(dictionary, dict_index.read_words(fuzzy_words))
+        print(f"Fuzzy queries: index {fuzzy['build']:.3f}s, "
+              f"{fuzzy['queries']} queries, median {fuzzy['query']['median'] * 1000:.3f}ms, "
+              f"p90 {fuzzy['query']['p90'] * 1000:.3f}ms")
+
+    return {
+        "environment": environment(),
+        "dictionary": {
+            "source": dictionary_source,
+            "words": dictionary_timings[-1]["words"],
+            "steps": {step: summarize([timings[step] for timings in dictionary_timings])
+                      for step in ("read", "tokenize", "cache_build", "cache_load")},
+        },
+        "fuzzy": fuzzy,
+        "scales": [benchmark_scale(scale, source, work_dir, dictionary, repeat, seed) for scale in scales],
+    }
+
+def parse_arguments():
+    '''
+    This function reads in the optional command line arguments.
+    '''
+    parser = argparse.ArgumentParser(description="Benchmark the cleaning and transformation of src/main.py")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1],
+                        help="sizes of the synthetic corpora, in copies of Data/ (default: 1)")
+    parser.add_argument("--dict", default=cmu.URL, dest="dictionary_source",
+                        help="url or local path of the CMU's Pronunciation Dictionary")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of timed runs of every scale (default: 3)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the synthetic corpora (default: 0)")
+    parser.add_argument("--work-dir", default=BENCHMARK_DIR,
+                        help="directory of the synthetic corpora and outputs (default: benchmark)")
+    parser.add_argument("--output", default="benchmark.json",
+                        help="json file of the results (default: benchmark.json)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    results = run_benchmark(args.scale, args.dictionary_source, "Data", args.work_dir, args.repeat, args.seed)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    print("Results are in " + args.output)
@@ -0,0 +1,133 @@
+'''
+This module writes the transformed lines kept for the n-gram models (the
+content of all_transformed_lines.txt) as a binary corpus, which part2 reads
+without parsing any text. A binary corpus is a directory with:
+- vocab.txt   : one phone per line, the id of a phone is its line number
+- tokens.npy  : the phone ids of all utterances back to back (uint8, or
+                uint16 for more than 256 phones)
+- offsets.npy : uint64[utterances + 1], start of each utterance in tokens.npy
+The .npy files are standard NumPy arrays, written without NumPy. This is the
+same format as part2-lm-sounds/src/corpus.py, which reads it.
+'''
+import os, sys, array
+
+NPY_MAGIC = b"\x93NUMPY"
+# array typecode -> NumPy dtype (little-endian)
+NPY_DTYPES = {"B": "|u1", "H": "<u2", "Q": "<u8"}
+# Room left for the header, the data starts right after it
+NPY_HEADER_SIZE = 128
+# Number of values buffered before they are written
+BUFFER_SIZE = 1 << 16
+# Most distinct phones of a corpus (uint16 phone ids)
+MAX_PHONES = 1 << 16
+
+class NpyWriter:
+    '''
+    This class writes a one dimensional .npy file of the type given by
+    typecode, a few values at a time. The header, which holds the number
+    of values, is written when the file is closed.
+    '''
+    def __init__(self, path, typecode):
+        self.typecode = typecode
+        self.count = 0
+        self.buffer = array.array(typecode)
+        self.file = open(path, 'wb')
+        self.file.seek(NPY_HEADER_SIZE)
+
+    def append(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= BUFFER_SIZE:
+            self.flush()
+
+    def extend(self, values):
+        self.buffer.extend(values)
+        if len(self.buffer) >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if sys.byteorder != "little":
+            self.buffer.byteswap()
+        self.file.write(self.buffer.tobytes())
+        self.count += len(self.buffer)
+        self.buffer = array.array(self.typecode)
+
+    def close(self):
+        self.flush()
+        header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (NPY_DTYPES[self.typecode], self.count)
+        header = header.ljust(NPY_HEADER_SIZE - len(NPY_MAGIC) - 5) + "\n"
+        self.file.seek(0)
+        self.file.write(NPY_MAGIC + b"\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin-1"))
+        self.file.close()
+
+class CorpusWriter:
+    '''
+    This class writes transformed lines to a binary corpus directory as
+    they are produced, so that only the phone ids waiting to be written
+    are kept in memory. Phone ids are given in order of first use.
+    '''
+    def __init__(self, directory):
+        print("Writing binary corpus: " + directory)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.phone_ids = dict()
+        # Phone ids are written as uint16 until the vocabulary is known
+        self.tokens = NpyWriter(os.path.join(directory, "tokens.u2.tmp"), "H")
+        self.offsets = NpyWriter(os.path.join(directory, "offsets.npy"), "Q")
+        self.offsets.append(0)
+        self.token_count = 0
+        self.line_count = 0
+
+    def write(self, lines):
+        '''
+        This method takes in transformed lines (an iterable) and adds them
+        to the corpus.
+        '''
+        phone_ids = self.phone_ids
+        for line in lines:
+            for phone in line.rstrip("\n").split(" "):
+                if not phone:
+                    continue
+                if phone not in phone_ids:
+                    if len(phone_ids) >= MAX_PHONES:
+                        raise ValueError("Too many distinct phones for a uint16 phone id: more than " + str(MAX_PHONES))
+                    phone_ids[phone] = len(phone_ids)
+                self.tokens.append(phone_ids[phone])
+                self.token_count += 1
+            self.offsets.append(self.token_count)
+            self.line_count += 1
+
+    def close(self):
+        '''
+        This method writes the vocabulary and completes the arrays.
+        '''
+        with open(os.path.join(self.directory, "vocab.txt"), 'w', encoding='utf-8') as file:
+            file.writelines(phone + "\n" for phone in self.phone_ids)
+        self.offsets.close()
+        self.tokens.close()
+
+        # Copy the phone ids into tokens.npy, as uint8 if they fit
+        temp_path = os.path.join(self.directory, "tokens.u2.tmp")
+        tokens = NpyWriter(os.path.join(self.directory, "tokens.npy"), "B" if len(self.phone_ids) <= 256 else "H")
+        with open(temp_path, 'rb') as file:
+            file.seek(NPY_HEADER_SIZE)
+            for block in iter(lambda: file.read(2 * BUFFER_SIZE), b""):
+                values = array.array("H", block)
+                if sys.byteorder != "little":
+                    values.byteswap()
+                tokens.extend(values.tolist())
+        tokens.close()
+        os.remove(temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_corpus(directory, lines):
+    '''
+    This function takes in the transformed lines (an iterable) and writes
+    them to a binary corpus directory.
+    '''
+    with CorpusWriter(directory) as writer:
+        writer.write(lines)
@@ -1,32 +1,65 @@
 '''
 This python script can be ran alone using the command: python3 src/cmu_dict.py
 User can search ApraBET pronounciation with it.
+
+The parsed dictionary is cached on disk in a compact, memory-mapped form
+(see cmu_dictionary() and compact_dict.py), so only the first run needs network
+access or has to parse the raw file.
 '''
-import requests, re
+import requests, re, os, sys, json, hashlib
+import compact_dict
 
 URL = "https://raw.githubusercontent.com/Alexir/CMUdict/master/cmudict-0.7b"
 
-def download_dict(url):
+# Parsed dictionaries are cached here, one file per source checksum
+CACHE_DIR = "cache"
+# Bump this whenever the cached format or tokenize_dict() output changes
+CACHE_VERSION = 2
+
+def is_url(source):
     '''
-    This function takes the url of the CMU's Pronunciation Dictionary and returns
-    the relevant lines
+    This function returns True if the given source is a url rather than
+    a local file path.
+    '''
+    return source.startswith("http://") or source.startswith("https://")
+
+def read_source(source):
+    '''
+    This function takes a url or a local file path of the CMU's Pronunciation
+    Dictionary and returns its raw content as bytes.
     '''
+    if not is_url(source):
+        with open(source, 'rb') as file:
+            return file.read()
+
     print("Downloading CMUdict v0.07...")
-    response = requests.get(url)
-    if response.status_code == 200:
-        contents = response.text
-    else:
-        print("Failed to download the file.")
-    lines = contents.split("\n")
+    response = requests.get(source)
+    if response.status_code != 200:
+        raise ConnectionError("Failed to download the file: " + source)
+    return response.content
+
+def relevant_lines(raw):
+    '''
+    This function takes the raw content of the dictionary and returns the
+    relevant lines.
+    '''
+    lines = raw.decode("latin-1").split("\n")
 
     # Dictionary starts from line 126 and the last 6 lines are irrelevant
     return lines[126: -6]
 
+def download_dict(url):
+    '''
+    This function takes the url of the CMU's Pronunciation Dictionary and returns
+    the relevant lines
+    '''
+    return relevant_lines(read_source(url))
+
 def tokenize_dict(lines):
     '''
     This function takes the relevant lines from the raw file and tokenize
     words and their respective pronounciations. Note that some words have
-    more than one pronouncation. It then returns a dictionary with key-value 
+    more than one pronouncation. It then returns a dictionary with key-value
     pairs as follows:
     {word: [pronounciation1, pronounciation2]}
     '''
@@ -43,35 +76,137 @@ def tokenize_dict(lines):
 
     return cmu_dict
 
-def cmu_dictionary():
+'''
+Cache: compact dictionaries keyed by the checksum of their source
+'''
+def checksum(raw):
+    '''
+    This function returns the sha256 checksum (hex) of the raw dictionary.
+    '''
+    return hashlib.sha256(raw).hexdigest()
+
+def cache_path(digest, cache_dir=CACHE_DIR):
+    '''
+    This function returns the path of the cached dictionary built from a
+    source with the given checksum.
+    '''
+    return os.path.join(cache_dir, f"cmudict-{digest[:16]}.v{CACHE_VERSION}.bin")
+
+def read_index(cache_dir=CACHE_DIR):
+    '''
+    This function returns the cache index, which maps each source (url or
+    path) to the checksum of its content when it was last parsed. The index
+    lets a url be resolved to its cache without network access.
+    '''
+    try:
+        with open(os.path.join(cache_dir, "index.json"), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return dict()
+
+def write_atomic(path, data):
+    '''
+    This function writes bytes to path through a temporary file, so that
+    concurrent readers never see a partially written file.
+    '''
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+def save_cache(dictionary, digest, source, cache_dir=CACHE_DIR):
+    '''
+    This function writes a parsed dictionary to the cache in the compact
+    format and records its source in the cache index.
+    '''
+    write_atomic(cache_path(digest, cache_dir), compact_dict.build(dictionary, digest))
+
+    index = read_index(cache_dir)
+    index[source] = digest
+    write_atomic(os.path.join(cache_dir, "index.json"), json.dumps(index, indent=2).encode("utf-8"))
+
+def load_cache(digest, cache_dir=CACHE_DIR):
+    '''
+    This function returns the cached dictionary built from a source with
+    the given checksum, or None if there is no valid cache for it.
+    '''
+    try:
+        dictionary = compact_dict.CompactDictionary(cache_path(digest, cache_dir))
+    except (OSError, ValueError):
+        return None
+    if dictionary.checksum != digest:
+        return None
+    return dictionary
+
+def cmu_dictionary(source=URL, cache_dir=CACHE_DIR, refresh=False):
     '''
     This function calls the above functions and returns a "pythonized"
     CMU's Pronunciation Dictionary. See tokenize_dict() for more info.
+    The dictionary is a compact_dict.CompactDictionary: it is read-only
+    and memory-mapped from the cache, but it is searched like the dict
+    returned by tokenize_dict().
+    The source can be a url or a local file. The parsed dictionary is
+    cached and reused as long as the source is unchanged:
+    - a local file is checksummed and looked up in the cache
+    - a url is resolved through the cache index and is only downloaded
+      on the first run (or when refresh is True)
     Note: this function is called by src/main.py to transform utterances.
     '''
-    dictionary = download_dict(URL)
-    dictionary = tokenize_dict(dictionary)
+    if is_url(source) and not refresh:
+        digest = read_index(cache_dir).get(source)
+        if digest is not None:
+            dictionary = load_cache(digest, cache_dir)
+            if dictionary is not None:
+                return dictionary
 
-    return dictionary
+    raw = read_source(source)
+    digest = checksum(raw)
+    if not refresh:
+        dictionary = load_cache(digest, cache_dir)
+        if dictionary is not None:
+            return dictionary
+
+    dictionary = tokenize_dict(relevant_lines(raw))
+    save_cache(dictionary, digest, source, cache_dir)
+
+    return load_cache(digest, cache_dir)
 
 def search(cmu_dict, word):
     '''
-    This function takes a dictionary and a word and return a list of 
+    This function takes a dictionary and a word and return a list of
     possible pronounciation of the word.
     '''
     return cmu_dict[word.upper()]
 
-def search_loop():
+def search_loop(source=URL):
     '''
-    This function loops the search().
+    This function loops the search(). Besides a word, a query can be:
+    - CHR*       : the words starting with CHR
+    - /K AE1 T/  : the words pronounced K AE1 T (the stress is optional)
+    - ~DOGY      : the words within two edits of DOGY
+    (see dict_index.py)
     '''
-    dictionary = cmu_dictionary()
+    # dict_index uses this module, so it is imported here
+    import dict_index
+    dictionary = cmu_dictionary(source)
+    index = dict_index.DictionaryIndex(dictionary)
     while True:
-        word = input("Search for the word: ")
-        if word.upper() in dictionary:
+        word = input("Search for the word: ").strip()
+        if word.endswith("*"):
+            print(index.prefix(word[:-1]))
+        elif word.startswith("/") and word.endswith("/") and len(word) > 1:
+            print(index.phones(word[1:-1]))
+        elif word.startswith("~"):
+            print(index.fuzzy(word[1:]))
+        elif word.upper() in dictionary:
             print(search(dictionary, word))
         else:
             print(word + " not found")
 
 if __name__ == "__main__":
-    search_loop()
\ No newline at end of file
+    # An optional argument is a url or path to the dictionary file
+    if len(sys.argv) > 1:
+        search_loop(sys.argv[1])
+    else:
+        search_loop()
@@ -0,0 +1,188 @@
+'''
+A compact, read-only, memory-mapped form of the CMU's Pronunciation Dictionary.
+
+The file is built once from the {word: [pronounciation1, ...]} dictionary
+returned by cmu_dict.tokenize_dict() and has the following layout:
+- a header (see HEADER below)
+- word_offsets  : uint32[words + 1], start of each word in the word table
+- pron_index    : uint32[words + 1], first pronounciation of each word
+- pron_offsets  : uint32[prons + 1], start of each pronounciation in the phone buffer
+- word table    : the sorted words (latin-1), back to back
+- phone buffer  : one uint8 phone id per phone, back to back
+- phone names   : the phone names separated by spaces (phone id = position)
+
+Every worker process that opens the same file shares its pages, and looking
+up a word is a binary search over the sorted word table.
+'''
+import mmap, struct, bisect, array, sys
+
+MAGIC = b"CMUD"
+FORMAT_VERSION = 1
+BYTEORDER = b"L" if sys.byteorder == "little" else b"B"
+
+# magic, format version, byte order, number of words, number of
+# pronounciations, size of the phone names, checksum of the source
+HEADER = struct.Struct("=4sIc3xIII32s")
+
+def build(dictionary, digest):
+    '''
+    This function takes a dictionary ({word: [pronounciation1, ...]}) and
+    the sha256 checksum (hex) of its source, and returns the bytes of the
+    compact dictionary file.
+    '''
+    words = sorted(dictionary, key=lambda word: word.encode("latin-1"))
+    phone_ids = dict()
+    word_offsets, pron_index, pron_offsets = array.array("I", [0]), array.array("I", [0]), array.array("I", [0])
+    word_table, phone_buffer = bytearray(), bytearray()
+
+    for word in words:
+        word_table += word.encode("latin-1")
+        word_offsets.append(len(word_table))
+        for pronounciation in dictionary[word]:
+            for phone in pronounciation.split(" "):
+                if phone not in phone_ids:
+                    phone_ids[phone] = len(phone_ids)
+                phone_buffer.append(phone_ids[phone])
+            pron_offsets.append(len(phone_buffer))
+        pron_index.append(len(pron_offsets) - 1)
+
+    if len(phone_ids) > 256:
+        raise ValueError("Too many distinct phones for a uint8 phone id: " + str(len(phone_ids)))
+
+    phone_names = " ".join(phone_ids).encode("ascii")
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, BYTEORDER, len(words), len(pron_offsets) - 1,
+                         len(phone_names), bytes.fromhex(digest))
+
+    return b"".join([header, word_offsets.tobytes(), pron_index.tobytes(), pron_offsets.tobytes(),
+                     bytes(word_table), bytes(phone_buffer), phone_names])
+
+class _WordTable:
+    '''
+    This class presents the sorted word table as a sequence of bytes, so
+    that it can be binary searched with the bisect module.
+    '''
+    def __init__(self, word_offsets, word_table):
+        self.word_offsets = word_offsets
+        self.word_table = word_table
+
+    def __len__(self):
+        return len(self.word_offsets) - 1
+
+    def __getitem__(self, i):
+        return self.word_table[self.word_offsets[i]: self.word_offsets[i + 1]].tobytes()
+
+class CompactDictionary:
+    '''
+    This class opens a compact dictionary file (see build()) and supports the
+    read-only dictionary operations used by cmu_dict.search() and src/main.py:
+    word in dictionary, dictionary[word], dictionary.get(word), len() and
+    iteration over the words.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self._mmap)
+        if len(view) < HEADER.size:
+            raise ValueError("Not a compact dictionary file: " + path)
+        magic, version, byteorder, n_words, n_prons, names_size, digest = HEADER.unpack_from(view)
+        if magic != MAGIC or version != FORMAT_VERSION or byteorder != BYTEORDER:
+            raise ValueError("Not a compact dictionary file of version " + str(FORMAT_VERSION) + ": " + path)
+        self.checksum = digest.hex()
+
+        # All sections are zero-copy views into the mapped file
+        position = HEADER.size
+        sections = list()
+        for count in (n_words + 1, n_words + 1, n_prons + 1):
+            sections.append(view[position: position + 4 * count].cast("I"))
+            position += 4 * count
+        self._word_offsets, self._pron_index, self._pron_offsets = sections
+        self._word_table = view[position: position + self._word_offsets[-1]]
+        position += self._word_offsets[-1]
+        self._phone_buffer = view[position: position + self._pron_offsets[-1]]
+        position += self._pron_offsets[-1]
+        self.phones = view[position: position + names_size].tobytes().decode("ascii").split(" ")
+
+        self._words = _WordTable(self._word_offsets, self._word_table)
+        # Results of previous lookups (None for words that are not found)
+        self._found = dict()
+
+    def __reduce__(self):
+        # Worker processes reopen (and share) the mapped file instead of copying it
+        return (CompactDictionary, (self.path,))
+
+    def __len__(self):
+        return len(self._words)
+
+    def __iter__(self):
+        for i in range(len(self._words)):
+            yield self._words[i].decode("latin-1")
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for i, word in enumerate(self):
+            yield word, self.pronounciations(i)
+
+    def find(self, word: str) -> int:
+        '''
+        This method returns the position of the word in the word table, or
+        -1 if the word is not in the dictionary.
+        '''
+        try:
+            key = word.encode("latin-1")
+        except UnicodeEncodeError:
+            return -1
+        i = bisect.bisect_left(self._words, key)
+        if i < len(self._words) and self._words[i] == key:
+            return i
+        return -1
+
+    def prefix_range(self, prefix: str) -> range:
+        '''
+        This method returns the positions in the word table of the words
+        starting with prefix (the word table is sorted, so they are next
+        to each other).
+        '''
+        try:
+            key = prefix.encode("latin-1")
+        except UnicodeEncodeError:
+            return range(0)
+        start = bisect.bisect_left(self._words, key)
+        end = bisect.bisect_left(self._words, key + b"\xff", start)
+        return range(start, end)
+
+    def word(self, i: int) -> str:
+        '''
+        This method returns the i-th word of the word table.
+        '''
+        return self._words[i].decode("latin-1")
+
+    def pronounciations(self, i: int) -> list:
+        '''
+        This method returns the pronounciations of the i-th word as a list of
+        space separated phone strings.
+        '''
+        phones, buffer, offsets = self.phones, self._phone_buffer, self._pron_offsets
+        return [
+            " ".join([phones[phone] for phone in buffer[offsets[p]: offsets[p + 1]]])
+            for p in range(self._pron_index[i], self._pron_index[i + 1])
+        ]
+
+    def get(self, word: str, default=None):
+        if word not in self._found:
+            i = self.find(word)
+            self._found[word] = self.pronounciations(i) if i >= 0 else None
+        found = self._found[word]
+        return default if found is None else found
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __getitem__(self, word):
+        found = self.get(word)
+        if found is None:
+            raise KeyError(word)
+        return found
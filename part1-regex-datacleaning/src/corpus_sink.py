@@ -0,0 +1,61 @@
+'''
+This module writes the transformed lines kept for the n-gram models to
+all_transformed_lines.txt as they are produced, instead of collecting them
+in memory first. The file can be compressed with gzip or zstd (the zstd
+compression needs the zstandard package).
+'''
+import io, gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+BUFFER_SIZE = 1 << 20
+
+def open_output(path, compression=None):
+    '''
+    This function opens path (with the extension of the compression added)
+    for writing text through a large buffer, and returns the file.
+    '''
+    path = path + COMPRESSIONS[compression]
+    if compression is None:
+        return open(path, 'w', encoding='utf-8', buffering=BUFFER_SIZE)
+    if compression == "gzip":
+        raw = gzip.GzipFile(path, 'wb', compresslevel=6)
+    else:
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+        raw = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd=True)
+    return io.TextIOWrapper(io.BufferedWriter(raw, BUFFER_SIZE), encoding='utf-8')
+
+class CorpusSink:
+    '''
+    This class writes transformed lines to all_transformed_lines.txt (or
+    another path) as they are produced. Only the number of lines and
+    characters written are kept in memory.
+    '''
+    def __init__(self, path="all_transformed_lines.txt", compression=None):
+        self.path = path + COMPRESSIONS[compression]
+        self.file = open_output(path, compression)
+        self.line_count = 0
+        self.char_count = 0
+
+    def write(self, lines):
+        '''
+        This method takes in transformed lines (an iterable) and writes them.
+        '''
+        for line in lines:
+            self.file.write(line)
+            self.line_count += 1
+            self.char_count += len(line)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,314 @@
+'''
+This module answers queries over the CMU's Pronunciation Dictionary that
+an exact lookup cannot:
+- prefix     : the words starting with a prefix (e.g. CHR), a range of the
+               sorted word table of the compact dictionary
+- phones     : the words pronounced with a phone sequence (e.g. K AE1 T),
+               with or without the stress marks, through an inverted index
+               from pronounciations to words
+- containing : the words whose pronounciation contains a phone sequence,
+               through an inverted index from phone pairs to pronounciations
+- fuzzy      : the words within a small edit distance of a (misspelled)
+               word, through an index of the words with up to two letters
+               deleted (symmetric delete)
+- triage     : all of the above for a list of unknown words (e.g. unk.txt)
+
+The indexes are built from the dictionary the first time they are needed.
+It can be ran alone to triage unk.txt:
+    python3 src/dict_index.py unk.txt --dict path/to/cmudict-0.7b
+'''
+import re, json, argparse
+import cmu_dict as cmu
+
+# Maximum number of results of a query (None for all)
+MAX_RESULTS = 50
+# Maximum edit distance of a fuzzy search (letters deleted in the delete index)
+MAX_DISTANCE = 2
+STRESS_PATTERN = re.compile(r'[0-9]')
+
+def strip_stress(pronounciation):
+    '''
+    This function removes the stress marks (0, 1, 2) of a pronounciation.
+    '''
+    return STRESS_PATTERN.sub("", pronounciation)
+
+def deletes(word, max_deletes):
+    '''
+    This function returns word and the strings obtained by deleting at most
+    max_deletes (0, 1 or 2) letters of it.
+    '''
+    strings = {word}
+    if max_deletes >= 1:
+        strings.update(word[:i] + word[i + 1:] for i in range(len(word)))
+    if max_deletes >= 2:
+        strings.update(word[:i] + word[i + 1:j] + word[j + 1:]
+                       for i in range(len(word)) for j in range(i + 1, len(word)))
+    return strings
+
+def edit_distance(a, b, max_distance):
+    '''
+    This function returns the number of edits (insertion, deletion,
+    substitution or transposition of two adjacent letters) from a to b, or
+    max_distance + 1 as soon as it is known to be more than max_distance.
+    '''
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    # The common prefix and suffix do not change the distance
+    start, shortest = 0, min(len(a), len(b))
+    while start < shortest and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < shortest - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i]
+        for j in range(1, len(b) + 1):
+            distance = min(previous[j] + 1, row[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                distance = min(distance, before[j - 2] + 1)
+            row.append(distance)
+        if min(row) > max_distance:
+            return max_distance + 1
+        before, previous = previous, row
+    return previous[-1]
+
+class DictionaryIndex:
+    '''
+    This class indexes a dictionary returned by cmu_dict.cmu_dictionary()
+    (a compact_dict.CompactDictionary) for the queries of the module
+    docstring.
+    '''
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+        self._words = None
+        self._deletes = None
+        self._by_pronounciation = None
+        self._by_phone_pair = None
+        self._pronounciations = None
+
+    '''
+    Prefix
+    '''
+    def prefix(self, prefix, limit=MAX_RESULTS):
+        '''
+        This method returns the words starting with prefix, in order.
+        '''
+        positions = self.dictionary.prefix_range(prefix.upper())
+        if limit is not None:
+            positions = positions[:limit]
+        return [self.dictionary.word(i) for i in positions]
+
+    def count_prefix(self, prefix):
+        '''
+        This method returns the number of words starting with prefix.
+        '''
+        return len(self.dictionary.prefix_range(prefix.upper()))
+
+    '''
+    Reverse lookup
+    '''
+    def build_phone_index(self):
+        '''
+        This method builds the inverted indexes of the pronounciations: one
+        from every pronounciation (with and without the stress marks) to the
+        positions of its words, and one from every pair of consecutive
+        phones (without the stress marks) to the pronounciations holding it.
+        '''
+        by_pronounciation = dict()
+        by_phone_pair = dict()
+        pronounciations = list()
+        for i in range(len(self.dictionary)):
+            for pronounciation in self.dictionary.pronounciations(i):
+                stressless = strip_stress(pronounciation)
+                by_pronounciation.setdefault(pronounciation, list()).append(i)
+                if stressless != pronounciation:
+                    by_pronounciation.setdefault(stressless, list()).append(i)
+
+                p = len(pronounciations)
+                pronounciations.append((" " + stressless + " ", i))
+                phones = stressless.split(" ")
+                for pair in set(zip(phones, phones[1:])):
+                    by_phone_pair.setdefault(pair, list()).append(p)
+        self._by_pronounciation = by_pronounciation
+        self._by_phone_pair = by_phone_pair
+        self._pronounciations = pronounciations
+
+    def phones(self, pronounciation, limit=MAX_RESULTS):
+        '''
+        This method returns the words pronounced with the given phones
+        (space separated). Without stress marks, the stress is ignored.
+        '''
+        if self._by_pronounciation is None:
+            self.build_phone_index()
+        positions = self._by_pronounciation.get(" ".join(pronounciation.upper().split()), [])
+        words = sorted(set(positions))
+        if limit is not None:
+            words = words[:limit]
+        return [self.dictionary.word(i) for i in words]
+
+    def containing(self, pronounciation, limit=MAX_RESULTS):
+        '''
+        This method returns the words having a pronounciation that contains
+        the given phones (space separated, the stress is ignored). The
+        candidates are the pronounciations holding the rarest pair of
+        consecutive phones of the query.
+        '''
+        if self._by_phone_pair is None:
+            self.build_phone_index()
+        phones = strip_stress(pronounciation.upper()).split()
+        if len(phones) < 2:
+            candidates = range(len(self._pronounciations))
+        else:
+            pairs = [self._by_phone_pair.get(pair, []) for pair in zip(phones, phones[1:])]
+            candidates = min(pairs, key=len)
+
+        query = " " + " ".join(phones) + " "
+        words = list()
+        for p in candidates:
+            text, i = self._pronounciations[p]
+            if query in text and (not words or words[-1] != i):
+                words.append(i)
+                if limit is not None and len(words) >= limit:
+                    break
+        return [self.dictionary.word(i) for i in words]
+
+    '''
+    Fuzzy search
+    '''
+    def build_delete_index(self):
+        '''
+        This method builds the index of fuzzy(): every word and every string
+        obtained by deleting at most MAX_DISTANCE letters of a word, to the
+        positions of the words it comes from (an int, or a list when there
+        are several). It holds about 3 million strings for the CMU's
+        dictionary, so it takes a few seconds to build.
+        '''
+        words = list(self.dictionary)
+        index = dict()
+        for i, word in enumerate(words):
+            for key in deletes(word, MAX_DISTANCE):
+                found = index.get(key)
+                if found is None:
+                    index[key] = i
+                elif type(found) is int:
+                    index[key] = [found, i]
+                else:
+                    found.append(i)
+        self._words = words
+        self._deletes = index
+
+    def fuzzy(self, word, max_distance=MAX_DISTANCE, limit=MAX_RESULTS):
+        '''
+        This method returns the words within max_distance (at most
+        MAX_DISTANCE) edits (insertion, deletion, substitution or
+        transposition of two adjacent letters) of word, as (word, distance)
+        sorted by distance then word. Two words within d edits share a
+        string obtained by deleting at most d letters of each, so the
+        candidates are looked up in the delete index (see
+        build_delete_index()) with the strings obtained by deleting at most
+        max_distance letters of the word, and then checked with
+        edit_distance(). A query of a long word takes about 0.1 ms, and a
+        query of a short word is as slow as it has close words (hundreds
+        within 2 edits for three letters).
+        '''
+        if max_distance > MAX_DISTANCE:
+            raise ValueError(f"The maximum edit distance of a fuzzy search is {MAX_DISTANCE}")
+        if self._deletes is None:
+            self.build_delete_index()
+        query = word.upper()
+
+        candidates = set()
+        index = self._deletes
+        for key in deletes(query, max_distance):
+            found = index.get(key)
+            if found is None:
+                continue
+            if type(found) is int:
+                candidates.add(found)
+            else:
+                candidates.update(found)
+
+        results = list()
+        for i in candidates:
+            distance = edit_distance(query, self._words[i], max_distance)
+            if distance <= max_distance:
+                results.append((self._words[i], distance))
+        results.sort(key=lambda result: (result[1], result[0]))
+        return results if limit is None else results[:limit]
+
+    def split(self, word):
+        '''
+        This method returns the ways to split word into two words of the
+        dictionary (e.g. TEDDYBEAR -> TEDDY BEAR), as (first, second). The
+        single letters are words of the dictionary, so both words must have
+        at least two letters.
+        '''
+        word = word.upper()
+        return [
+            (word[:i], word[i:]) for i in range(2, len(word) - 1)
+            if word[:i] in self.dictionary and word[i:] in self.dictionary
+        ]
+
+    '''
+    Triage
+    '''
+    def triage(self, word, max_distance=MAX_DISTANCE, limit=5):
+        '''
+        This method returns what the index knows about an unknown word: the
+        closest words (fuzzy()), the splits into two words (split()) and the
+        number of words it is a prefix of.
+        '''
+        return {
+            "word": word,
+            "closest": [
+                {"word": candidate, "distance": distance, "pronounciation": self.dictionary[candidate][0]}
+                for candidate, distance in self.fuzzy(word, max_distance, limit)
+            ],
+            "splits": [" ".join(split) for split in self.split(word)],
+            "prefix_of": self.count_prefix(word),
+        }
+
+def read_words(path):
+    '''
+    This function returns the words of a file (one word per line), e.g.
+    unk.txt.
+    '''
+    with open(path, 'r', encoding='utf-8') as file:
+        return [line.strip() for line in file if line.strip()]
+
+def triage_file(path, dictionary_source=cmu.URL, max_distance=MAX_DISTANCE, output="unk_triage.json"):
+    '''
+    This function triages every word of a file (see DictionaryIndex.triage())
+    and writes the results to output as json. It prints out how many words
+    have a close word or a split.
+    '''
+    index = DictionaryIndex(cmu.cmu_dictionary(dictionary_source))
+    results = [index.triage(word, max_distance) for word in read_words(path)]
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+
+    print("Words triaged             : " + str(len(results)))
+    print("Words with a close word   : " + str(sum(1 for result in results if result["closest"])))
+    print("Words with a split        : " + str(sum(1 for result in results if result["splits"])))
+    print("Triage is in " + output)
+
+def parse_arguments():
+    '''
+    This function reads in the optional command line arguments.
+    '''
+    parser = argparse.ArgumentParser(description="Triage unknown words with the CMU's Pronunciation Dictionary")
+    parser.add_argument("words", nargs="?", default="unk.txt",
+                        help="file of words, one per line (default: unk.txt)")
+    parser.add_argument("--dict", default=cmu.URL, dest="dictionary_source",
+                        help="url or local path of the CMU's Pronunciation Dictionary")
+    parser.add_argument("--max-distance", type=int, default=2,
+                        help="maximum edit distance of the close words (default: 2)")
+    parser.add_argument("--output", default="unk_triage.json",
+                        help="json file of the triage (default: unk_triage.json)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    triage_file(args.words, args.dictionary_source, args.max_distance, args.output)
@@ -1,13 +1,162 @@
-import re, os
+import re, os, sys, time, argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import cmu_dict as cmu
+import manifest as mf
+import binary_corpus
+import corpus_sink
+import archive
+import profiler
+
+# Bump these whenever the cleaning rules or the transformation change, so
+# that the incremental build (see manifest.py) rebuilds every output
+CLEANING_VERSION = 1
+TRANSFORM_VERSION = 1
+
+class Statistics:
+    '''
+    This class collects the statistics of the processed files. Each file
+    gets its own Statistics, and they are merged at the end, so that the
+    summary is the same whether the files are processed serially or in
+    parallel.
+    '''
+    def __init__(self):
+        self.cleaned_files = 0
+        self.transformed_files = 0
+        self.line_count = 0             # number of lines read during cleaning
+        self.word_count = 0             # number of words in the cleaned lines
+        self.all_words = set()
+        self.not_in_dict = set()
+        self.kept_line_count = 0        # number of lines kept for the n-gram models
+        # The kept lines of a single file, they are written to the sinks (see
+        # transform_cha_files()) and are not merged
+        self.transformed_lines = list()
+        # The outputs of a single file with --archive ("clean" or 
+        # "transformed" -> content), they are written to the archives (see 
+        # clean_and_transform_cha_files()) and are not merged
+        self.outputs = dict()
+        self.token_cache_hits = 0       # see TokenCache
+        self.token_cache_misses = 0
+
+    def merge(self, other):
+        '''
+        This method adds the statistics of other to this one and returns it.
+        The transformed lines are not merged, only their number.
+        '''
+        self.cleaned_files += other.cleaned_files
+        self.transformed_files += other.transformed_files
+        self.line_count += other.line_count
+        self.word_count += other.word_count
+        self.all_words |= other.all_words
+        self.not_in_dict |= other.not_in_dict
+        self.kept_line_count += other.kept_line_count
+        self.token_cache_hits += other.token_cache_hits
+        self.token_cache_misses += other.token_cache_misses
+        return self
+
+    def to_json(self):
+        '''
+        This method returns the statistics as a json serializable dict, for
+        the manifest. The transformed lines are not included: they are read
+        back from the transformed file (see kept_lines()).
+        '''
+        return {
+            "cleaned_files": self.cleaned_files,
+            "transformed_files": self.transformed_files,
+            "line_count": self.line_count,
+            "word_count": self.word_count,
+            "all_words": sorted(self.all_words),
+            "not_in_dict": sorted(self.not_in_dict),
+        }
+
+    @staticmethod
+    def from_json(data):
+        '''
+        This method returns the Statistics saved by to_json().
+        '''
+        statistics = Statistics()
+        statistics.cleaned_files = data["cleaned_files"]
+        statistics.transformed_files = data["transformed_files"]
+        statistics.line_count = data["line_count"]
+        statistics.word_count = data["word_count"]
+        statistics.all_words = set(data["all_words"])
+        statistics.not_in_dict = set(data["not_in_dict"])
+        return statistics
+
+def find_files(directory, extension):
+    '''
+    This function recursively walk through the directory and returns the
+    paths of the files with the given extension, in a fixed order.
+    '''
+    file_paths = list()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(extension):
+                file_paths.append(os.path.join(root, file))
+    return file_paths
+
+def map_files(function, file_paths, jobs=1):
+    '''
+    This function calls function on every file path and yields the results
+    in the order of file_paths. With more than one job, the files are
+    processed by a pool of jobs worker processes.
+    '''
+    if jobs <= 1:
+        yield from map(function, file_paths)
+        return
 
-NOT_IN_DICT = set()
-ALL_WORDS = set()
-TOTAL_WORD_COUNT = 0
-FILE_NUM = int()
-
+    # A few chunks per worker keeps the workers busy with little overhead
+    chunksize = max(1, len(file_paths) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(function, file_paths, chunksize=chunksize)
 
-ALL_TRANSFORMED_LINES = list()
+def update_files(function, file_paths, output_path, versions, jobs=1, manifest=None, section=None,
+                 other_paths=None):
+    '''
+    This function calls function (which returns the Statistics of a file) 
+    on the file paths whose output (given by output_path) is stale and
+    yields (file path, statistics, up to date) for every file path, in
+    order. With a manifest, an output is stale if its input or versions
+    changed since it was built, or if it or one of the other files written
+    with it (given by other_paths, if any) is missing or changed (see 
+    manifest.py). The statistics of the outputs that are up to date come
+    from the manifest, and the section of the manifest is updated. Without
+    a manifest, every output is stale.
+    '''
+    if manifest is None:
+        for file_path, statistics in zip(file_paths, map_files(function, file_paths, jobs)):
+            yield file_path, statistics, False
+        return
+
+    if other_paths is None:
+        other_paths = lambda file_path: []
+    entries = manifest.get(section, dict())
+    checksums = {file_path: mf.file_checksum(file_path) for file_path in file_paths}
+    stale = [
+        file_path for file_path in file_paths
+        if not mf.is_up_to_date(entries.get(output_path(file_path)), output_path(file_path),
+                                checksums[file_path], versions, other_paths(file_path))
+    ]
+    results = map_files(function, stale, jobs)
+    stale = set(stale)
+
+    # Entries of inputs that no longer exist are dropped
+    updated_entries = dict()
+    for file_path in file_paths:
+        output = output_path(file_path)
+        if file_path in stale:
+            statistics = next(results)
+            output_checksum = mf.file_checksum(output) if os.path.exists(output) else None
+            other_checksums = {path: mf.file_checksum(path) for path in other_paths(file_path) if os.path.exists(path)}
+            updated_entries[output] = mf.make_entry(checksums[file_path], versions, statistics.to_json(),
+                                                    output_checksum, other_checksums)
+            yield file_path, statistics, False
+        else:
+            updated_entries[output] = entries[output]
+            yield file_path, Statistics.from_json(entries[output]["statistics"]), True
+    manifest[section] = updated_entries
 
 
 '''
@@ -23,56 +172,143 @@ def read_file(filename):
         raw_content = file.readlines()
     return raw_content
 
+def read_lines(filename, statistics=None):
+    '''
+    This function takes a filename and yields its lines one at a time, so
+    that only the current line is kept in memory. The number of lines read
+    is recorded into statistics (if given).
+    '''
+    with open(filename, 'r', encoding='utf-8') as file:
+        for line in file:
+            if statistics is not None:
+                statistics.line_count += 1
+            yield line
+
 def write_file(filename, content):
     '''
-    This function takes in a filename and write cleaned content to it
+    This function takes in a filename and write cleaned content to it.
+    The content can be any iterable of lines (e.g. a pipeline of stages),
+    which is written as it is produced.
     '''
     with open(filename, 'w', encoding='utf-8') as output_file:
         output_file.writelines(content)
 
+'''
+Compiled cleaning rules. They are applied in this order by clean_line(),
+see remove_extraneous_info() for what each of them does.
+'''
+HEADER_PATTERN = re.compile(r'^@.*')
+CONVERSATION_PATTERN = re.compile(r'^\*.*')
+SPEAKER_TAG_PATTERN = re.compile(r'\*[A-Z]+:\s*')
+
+PARENTHESES_PATTERN = re.compile(r'\(([^)]+)\)')
+EXPLANATION_PATTERN = re.compile(r'(\w+) \[: (\w+)]')
+SQUARE_BRACKETS_PATTERN = re.compile(r'\[.*?\]')
+ANGLE_BRACKETS_PATTERN = re.compile(r'\<.*?\>')
+AMPERSAND_PATTERN = re.compile(r'&\S+\s*')
+PLUS_PATTERN = re.compile(r'\+[^\s]*')
+NAK_PATTERN = re.compile('\x15[^\x15]*\x15')
+PLACEHOLDER_PATTERN = re.compile(r'\b(?:xxx|yyy)\b')
+# Remove all : and replace all - and _ with a spacebar
+PUNCTUATION_TABLE = str.maketrans({":": None, "-": " ", "_": " "})
+AT_SIGN_PATTERN = re.compile(r'\S*@\S*')
+LEADING_DOTS_PATTERN = re.compile(r'^[.\s]*')
+SPACES_PATTERN = re.compile(r'[ \t]+')
+ALPHABET_PATTERN = re.compile(r'[a-zA-Z]')
+
 def remove_header(content):
     '''
-    This function takes in content (a list of lines) and return a list 
-    of lines without header.
+    This function takes in content (an iterable of lines) and return an
+    iterator of lines without header.
     '''
-    header_pattern = r'^@.*'
-    cleaned_content = list()
-    for line in content:
-        if not re.match(header_pattern, line):
-            cleaned_content.append(line)
-    return cleaned_content
+    return (line for line in content if not HEADER_PATTERN.match(line))
 
 def filter_conversation(content):
     '''
-    This function takes in content (a list of lines) and return a list 
-    of conversation lines (lines start with *)
+    This function takes in content (an iterable of lines) and return an
+    iterator of conversation lines (lines start with *)
     '''
-    conversation_pattern = r'^\*.*'
-    cleaned_content = list()
-    for line in content:
-        if re.match(conversation_pattern, line):
-            cleaned_content.append(line)
-    return cleaned_content
+    return (line for line in content if CONVERSATION_PATTERN.match(line))
 
 def remove_speaker_tag(content):
     '''
-    This function takes in content (a list of lines) and return a list
-    of conversation lines without the speaker tag
+    This function takes in content (an iterable of lines) and return an
+    iterator of conversation lines without the speaker tag
+    '''
+    return (SPEAKER_TAG_PATTERN.sub("", line) for line in content)
+
+def clean_line(line):
+    '''
+    This function applies all the cleaning rules of remove_extraneous_info()
+    to a single line without speaker tag. It returns the cleaned line, or
+    None if the line is to be removed. Each rule is skipped when the line
+    does not contain the character the rule starts with, which gives the
+    same result without running the regex.
+    '''
+    # Remove ()
+    if "(" in line:
+        line = PARENTHESES_PATTERN.sub(r'\1', line)
+    if "[" in line:
+        # Substitute text with explaination text
+        line = EXPLANATION_PATTERN.sub(r'\2', line)
+        # Remove [] including contents within
+        line = SQUARE_BRACKETS_PATTERN.sub('', line)
+    # Remove <> including contents within
+    if "<" in line:
+        line = ANGLE_BRACKETS_PATTERN.sub('', line)
+    # Remove tokens starting with &
+    if "&" in line:
+        line = AMPERSAND_PATTERN.sub('', line)
+    # Remove +...
+    if "+" in line:
+        line = PLUS_PATTERN.sub('', line)
+    # Remove NAK tag and content within
+    if "\x15" in line:
+        line = NAK_PATTERN.sub('', line)
+    # Remove xxx and yyy placeholders
+    if "xxx" in line or "yyy" in line:
+        line = PLACEHOLDER_PATTERN.sub('', line)
+    # Remove all :, - and _
+    line = line.translate(PUNCTUATION_TABLE)
+    # Remove all tokens with @
+    if "@" in line:
+        line = AT_SIGN_PATTERN.sub('', line)
+
+    # Remove leading ". . ." (appear due to the above cleaning)
+    line = LEADING_DOTS_PATTERN.sub('', line, count=1)
+    # Replace sequence of spacebars into one single spacebar
+    line = SPACES_PATTERN.sub(' ', line)
+    # Remove empty lines and lines with "0"
+    if "0" in line or not ALPHABET_PATTERN.search(line):
+        return None
+
+    return line
+
+def record_words(line, statistics):
+    '''
+    This function records all tokens in a cleaned line into statistics
+    and prep for transformation.
+    '''
+    words = line.split(" ")
+    statistics.word_count += len(words)
+    statistics.all_words.update(words)
+
+def record_lines(content, statistics):
+    '''
+    This function takes in content (an iterable of cleaned lines), records
+    the words of every line into statistics and yields the lines unchanged.
     '''
-    speaker_tag_pattern = r'\*[A-Z]+:\s*'
-    cleaned_content = list()
     for line in content:
-        cleaned_line = re.sub(speaker_tag_pattern, "", line)
-        cleaned_content.append(cleaned_line)
-    return cleaned_content
+        record_words(line, statistics)
+        yield line
 
-def remove_extraneous_info(content):
+def remove_extraneous_info(content, statistics=None):
     '''
     This function removes extraneous information and noises that is 
     irrelevant to the downstream task. The justification of choices
-    is documentated in the justification.txt file. While some regex
-    expression could be combined into a single one, I decided to 
-    separate them for easier and more dynamically test and debugging.
+    is documentated in the justification.txt file. Every rule is a
+    separate compiled regex (see clean_line()) for easier and more 
+    dynamically test and debugging.
     Here is a summary of what this function does:
     - remove ()
     - substitute text with explanation text dey [: they] -> they
@@ -92,55 +328,31 @@ def remove_extraneous_info(content):
     - remove lines with 0 
     - remove leading ". . ." (appear due to the above cleaning)
     - replace sequence of spacebars into one single spacebar
+    It takes in content (an iterable of lines) and return an iterator of
+    the cleaned lines. The words of the cleaned lines are recorded into
+    statistics (if given).
+    '''
+    if statistics is None:
+        statistics = Statistics()
+    cleaned_content = (clean_line(line) for line in content)
+    return record_lines((line for line in cleaned_content if line is not None), statistics)
+
+def clean_lines(content):
+    '''
+    This function runs the whole cleaning (steps (2) to (5) of clean_file())
+    in a single pass: each line goes through all the steps before the next
+    line is read. Conversation lines start with * so header lines (which
+    start with @) are removed by the same check. It takes in content (an 
+    iterable of lines) and yields the cleaned lines.
     '''
-    cleaned_content = list()
     for line in content:
-        # Remove ()
-        line = re.sub(r'\(([^)]+)\)', r'\1', line)
-        # Substitute text with explaination text
-        line = re.sub(r'(\w+) \[: (\w+)]', lambda x: x.group(2), line)
-        # Remove [] including contents within
-        line = re.sub(r'\[.*?\]', '', line)
-        # Remove <> including contents within
-        line = re.sub(r'\<.*?\>', '', line)
-        # Remove tokens starting with &
-        line = re.sub(r'&\S+\s*', '', line)
-        # Remove +...
-        line = re.sub(r'\+[^\s]*', '', line)
-        # Remove NAK tag and content within
-        line = re.sub(r'[^]*', '', line)
-        # Remove xxx and yyy placeholders
-        line = re.sub(r'\b(?:xxx|yyy)\b', '', line)
-        # Remove all :
-        line = re.sub(r':', '', line)
-        # Remove all - and _
-        line = re.sub(r'[-_]', ' ', line)
-        # Remove all tokens with @ 
-        line = re.sub(r'\S*@\S*', '', line)
-
-        # Remove leading ". . ." (appear due to the above cleaning)
-        line = re.sub(r'^[.\s]*', '', line)
-        # Replace sequence of spacebars into one single spacebar
-        line = re.sub(r'[ \t]+', ' ', line)
-        # Remove empty lines and lines with "0"
-        if re.search(r'0', line) or not re.search(r'[a-zA-Z]', line):
+        if not CONVERSATION_PATTERN.match(line):
             continue
+        line = clean_line(SPEAKER_TAG_PATTERN.sub("", line))
+        if line is not None:
+            yield line
 
-        '''
-        Record all tokens in lines and prep for transformation
-        '''
-        words = line.split(" ")
-        for word in words:
-            global TOTAL_WORD_COUNT
-            TOTAL_WORD_COUNT += 1
-            ALL_WORDS.add(word)
-
-        # Add cleaned line to cleaned_content
-        cleaned_content.append(line)
-
-    return cleaned_content
-
-def clean_file(filename):
+def clean_file(filename, statistics=None, extra_stages=()):
     '''
     This function is where the data pipelining happens. The flow
     as follows:
@@ -149,51 +361,125 @@ def clean_file(filename):
     (3) Filter out conversation lines
     (4) Remove speaker tags
     (5) Remove extraneous information
-    It then returns the cleaned content (as a list of lines)
+    (6) Extra stages (if any)
+    Steps (2) to (5) are done in one pass by clean_lines(). Every step is
+    an iterator over the lines of the previous one, so nothing is read
+    until the cleaned content is consumed, and then only one line at a
+    time is kept in memory. An extra stage is a function that takes in an
+    iterable of cleaned lines and returns an iterable of lines.
+    It then returns the cleaned content (as an iterator of lines). The 
+    number of lines read and the words of the cleaned lines (after the
+    extra stages) are recorded into statistics (if given) as the content
+    is consumed.
     '''
-    content = read_file(filename)
-    content = remove_header(content)
-    content = filter_conversation(content)
-    content = remove_speaker_tag(content)
-    content = remove_extraneous_info(content)
+    if statistics is None:
+        statistics = Statistics()
+    content = clean_lines(read_lines(filename, statistics))
+    for stage in extra_stages:
+        content = stage(content)
 
-    return content
+    return record_lines(content, statistics)
 
-def clean_cha_file(file_path):
+def clean_path(file_path):
     '''
-    This function takes a file path (from Data) and calls clean_file() to 
-    process the .cha file. It then writes the clean data into a .txt file
-    in the required path (same structure as the Data folder)
+    This function returns the path in the clean directory (same structure 
+    as the Data folder) of a .cha file in the Data directory.
     '''
     source_dir = "Data"
     clean_dir = "clean"
+    return file_path.replace(source_dir, clean_dir).replace(".cha", ".txt")
+
+def clean_cha_file(file_path, extra_stages=()):
+    '''
+    This function takes a file path (from Data) and calls clean_file() to 
+    process the .cha file (see clean_file() for extra_stages). It then 
+    writes the clean data into a .txt file in the required path (same 
+    structure as the Data folder) as it is cleaned. It returns the 
+    statistics of the file.
+    '''
+    statistics = Statistics()
+    statistics.cleaned_files = 1
 
     # Generate the destination file path in the clean directory
-    clean_file_path = file_path.replace(source_dir, clean_dir).replace(".cha", ".txt")
+    clean_file_path = clean_path(file_path)
     os.makedirs(os.path.dirname(clean_file_path), exist_ok=True)
 
     # Clean .cha files and write file to the designated folder
-    cleaned_content = clean_file(file_path)
-    print("Processing: " + str(clean_file_path))
+    cleaned_content = clean_file(file_path, statistics, extra_stages)
     write_file(clean_file_path, cleaned_content)
 
-def clean_cha_files():
+    return statistics
+
+def cleaning_versions(extra_stages=()):
+    '''
+    This function returns what the cleaned files depend on besides their
+    input, for the manifest.
+    '''
+    return {"rules": CLEANING_VERSION, "extra_stages": [stage.__qualname__ for stage in extra_stages]}
+
+def clean_cha_files(jobs=1, extra_stages=(), manifest=None):
     '''
     This function recursively walk through the Data directory and calls
-    clean_cha_file to clean the data file whenever it detects one. It 
-    then prints out the total number of .cha files processed.
+    clean_cha_file to clean the data file whenever it detects one, using
+    jobs worker processes. Extra stages are added to the cleaning of each
+    file (see clean_file(), they must be module level functions when jobs
+    is more than 1). With a manifest, only the files that are not up to
+    date are cleaned (see update_files()). It then prints out the total
+    number of .cha files processed and the throughput, and returns the
+    merged statistics.
     '''
     print("Task: Data Cleaning")
-    count = 0
+    statistics = Statistics()
+    start = time.perf_counter()
+    line_count = 0
     # Recursively process .cha files
-    for root, _, files in os.walk("Data"):
-        for file in files:
-            if file.endswith(".cha"):
-                file_path = os.path.join(root, file)
-                clean_cha_file(file_path)
-                count += 1
-                
-    print(f"Total .cha files cleaned: {count}")
+    file_paths = find_files("Data", ".cha")
+    clean = partial(clean_cha_file, extra_stages=extra_stages)
+    for file_path, file_statistics, up_to_date in update_files(
+        clean, file_paths, clean_path, cleaning_versions(extra_stages), jobs, manifest, "clean"
+    ):
+        if up_to_date:
+            print("Up to date: " + str(clean_path(file_path)))
+        else:
+            print("Processing: " + str(clean_path(file_path)))
+            line_count += file_statistics.line_count
+        statistics.merge(file_statistics)
+
+    print(f"Total .cha files cleaned: {statistics.cleaned_files}")
+    print_throughput(line_count, time.perf_counter() - start)
+    return statistics
+
+def print_throughput(line_count, seconds):
+    '''
+    This function prints out the number of lines processed per second.
+    '''
+    print(f"Lines processed: {line_count} ({round(line_count / max(seconds, 1e-9))} lines/s)")
+
+def verify_clean_files():
+    '''
+    This function cleans every .cha file in the Data directory without 
+    writing anything and compares the result with the existing file in
+    the clean directory, which is used as a golden corpus. It prints out
+    the files that differ and the throughput, and returns the number of
+    files that differ.
+    '''
+    print("Task: Verify Data Cleaning against clean/")
+    statistics = Statistics()
+    mismatches = 0
+    start = time.perf_counter()
+    for file_path in find_files("Data", ".cha"):
+        cleaned_content = clean_file(file_path, statistics)
+        statistics.cleaned_files += 1
+        golden_path = clean_path(file_path)
+        with open(golden_path, 'r', encoding='utf-8', newline='') as golden_file:
+            if golden_file.read() != "".join(cleaned_content):
+                print("Mismatch: " + golden_path)
+                mismatches += 1
+    seconds = time.perf_counter() - start
+
+    print(f"Total .cha files verified: {statistics.cleaned_files}, mismatches: {mismatches}")
+    print_throughput(statistics.line_count, seconds)
+    return mismatches
 
 '''
 Task: Transformation
@@ -204,7 +490,14 @@ def contains_number(string):
 def contains_alphabet(string):
     return any(char.isalpha() for char in string)
 
-def transform_token(token, dictionary):
+NON_ALPHABET_PATTERN = re.compile(r'^[^a-zA-Z]$')
+PUNCTUATION_PATTERN = re.compile(r"^[^a-zA-Z]+|[^a-zA-Z]+$")
+APOSTROPHE_S_PATTERN = re.compile(r"'s$", flags=re.IGNORECASE)
+
+# Maximum number of distinct tokens remembered by a TokenCache
+TOKEN_CACHE_SIZE = 1 << 16
+
+def pronounce(token, dictionary):
     '''
     This function transform a single token into pronunciation using
     the CMU's Pronunciation Dictionary and return the ApraBET
@@ -213,123 +506,447 @@ def transform_token(token, dictionary):
     the token ends with apostrophe s ('s) (please see justification.txt
     for more info). [UNK] tokens will be added to be a placeholder 
     for words that are not present in the dictionary.
+    It returns the representation and the unknown word (or None), and
+    has no side effect, so that its result can be cached.
     '''
     if contains_number(token):
-        return ""
+        return "", None
 
     # Preserves single character punctuation
-    if (len(token) == 1) and (bool(re.match(r'^[^a-zA-Z]$', token))):
-        return ""
+    if (len(token) == 1) and NON_ALPHABET_PATTERN.match(token):
+        return "", None
 
     # Remove leading and trailing puncuation
-    token = re.sub(r"^[^a-zA-Z]+|[^a-zA-Z]+$", "", token)
+    token = PUNCTUATION_PATTERN.sub("", token)
 
     # Check if the token ends with apostrophe s
     apostrophe = False
-    if re.search(r"'s$", token, flags=re.IGNORECASE):
+    if APOSTROPHE_S_PATTERN.search(token):
         apostrophe = True
-        token = re.sub(r"\'s$", '', token, flags=re.IGNORECASE)
-    if token.upper() not in dictionary:
-        NOT_IN_DICT.add(token.upper())
-        return "<UNK> "
-    elif (token.upper() in dictionary) and (apostrophe == False):
-        return dictionary[token.upper()][0] + " "
-    elif (token.upper() in dictionary) and (apostrophe == True):
-        return dictionary[token.upper()][0] + " Z "
+        token = APOSTROPHE_S_PATTERN.sub('', token)
+    word = token.upper()
+    pronounciations = dictionary.get(word)
+    if pronounciations is None:
+        return "<UNK> ", word
+    elif apostrophe == False:
+        return pronounciations[0] + " ", None
+    else:
+        return pronounciations[0] + " Z ", None
+
+class TokenCache:
+    '''
+    This class remembers the result of pronounce() for the most recently
+    used raw tokens (a bounded LRU), so that a token that was seen before
+    costs one lookup. It counts the cache hits and misses.
+    '''
+    def __init__(self, dictionary, max_size=TOKEN_CACHE_SIZE):
+        self.dictionary = dictionary
+        self.max_size = max_size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def pronounce(self, token):
+        '''
+        This method returns pronounce(token, dictionary), from the cache
+        when possible.
+        '''
+        result = self.results.get(token)
+        if result is not None:
+            self.hits += 1
+            self.results.move_to_end(token)
+            return result
+
+        self.misses += 1
+        result = pronounce(token, self.dictionary)
+        self.results[token] = result
+        if len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+        return result
+
+# The TokenCache of the dictionary in use by this process
+TOKEN_CACHE = None
+
+def token_cache(dictionary):
+    '''
+    This function returns the TokenCache of the dictionary, which is kept
+    between files (and replaced when another dictionary is used).
+    '''
+    global TOKEN_CACHE
+    if TOKEN_CACHE is None or TOKEN_CACHE.dictionary is not dictionary:
+        TOKEN_CACHE = TokenCache(dictionary)
+    return TOKEN_CACHE
+
+def transform_token(token, dictionary, statistics):
+    '''
+    This function transform a single token into pronunciation (see
+    pronounce()) through the TokenCache of the dictionary, and records the
+    word into statistics if it is not in the dictionary.
+    '''
+    transformed, unknown_word = token_cache(dictionary).pronounce(token)
+    if unknown_word is not None:
+        statistics.not_in_dict.add(unknown_word)
+    return transformed
+
+def transform_lines(content, dictionary, statistics):
+    '''
+    This function takes in cleaned content (an iterable of lines) and 
+    dictionary and yields the transformed lines, one line at a time. It
+    records the unknown words and the lines kept for the n-gram models 
+    into statistics.
+    '''
+    cache = token_cache(dictionary)
+    hits, misses = cache.hits, cache.misses
+
+    # Transform line by line
+    for line in content:
+        # Tokenize the line
+        tokens = filter(None, line[:-1].split(" "))
+        transformed_line = "".join([transform_token(token, dictionary, statistics) for token in tokens]) + "\n"
+        if is_kept(transformed_line):
+            statistics.transformed_lines.append(transformed_line)
+            statistics.kept_line_count += 1
+        yield transformed_line
+
+    statistics.token_cache_hits += cache.hits - hits
+    statistics.token_cache_misses += cache.misses - misses
 
-def transform_file(file_path, dictionary):
+def transform_file(file_path, dictionary, statistics):
     '''
     This function takes in a file path name and dictionary and transform
     the file line by line. It returns the transformed content (as a list 
-    of lines).
+    of lines), and records the unknown words and the lines kept for the
+    n-gram models into statistics.
     '''
     # Read cleaned content
     with open(file_path, 'r', encoding='utf-8') as file:
         raw_content = file.readlines()
 
-    global ALL_TRANSFORMED_LINES
-    transformed_content = list()
+    return list(transform_lines(raw_content, dictionary, statistics))
 
-    # Transform line by line
-    for line in raw_content:
-        transformed_line = str()
-        # Tokenize the line
-        tokens = list(filter(None, line[:-1].split(" ")))
-        for token in tokens:
-            transformed_line += transform_token(token, dictionary)
-        transformed_line = transformed_line + "\n"
-        transformed_content.append(transformed_line)
-        if contains_alphabet(transformed_line) and "<s> <s> </s>" not in transformed_line:
-            ALL_TRANSFORMED_LINES.append(transformed_line)
+def is_kept(transformed_line):
+    '''
+    This function returns True if a transformed line is kept for the
+    n-gram models (all_transformed_lines.txt).
+    '''
+    return contains_alphabet(transformed_line) and "<s> <s> </s>" not in transformed_line
 
-        #print(line[:-1])
-        #print(tokens)
-        #print(transformed_line)
+def kept_lines(transform_file_path):
+    '''
+    This function returns the lines of a transformed file that are kept 
+    for the n-gram models, without transforming the file again.
+    '''
+    with open(transform_file_path, 'r', encoding='utf-8') as file:
+        return [line for line in file if is_kept(line)]
 
-    return transformed_content
+def transform_path(file_path):
+    '''
+    This function returns the path in the transformed directory (same 
+    structure as the Data folder) of a .txt file in the clean directory.
+    '''
+    source_dir = "clean"
+    clean_dir = "transformed"
+    return file_path.replace(source_dir, clean_dir)
 
 def transform_cha_file(file_path, dictionary):
     '''
     This function takes a file path (from clean) and calls transform_file() to 
     process the .txt file. It then writes the transformed data into a .txt file
-    in the required path (same structure as the Data folder)
+    in the required path (same structure as the Data folder). It returns the
+    statistics of the file.
     '''
-    source_dir = "clean"
-    clean_dir = "transformed"
+    statistics = Statistics()
+    statistics.transformed_files = 1
 
     # Generate the destination file path in the transform directory
-    transform_file_path = file_path.replace(source_dir, clean_dir)
+    transform_file_path = transform_path(file_path)
     os.makedirs(os.path.dirname(transform_file_path), exist_ok=True)
 
     # Clean .txt files and write file to the designated folder
-    transformed_content = transform_file(file_path, dictionary)
-    print("Processing: " + str(transform_file_path))
+    transformed_content = transform_file(file_path, dictionary, statistics)
     write_file(transform_file_path, transformed_content)
 
-def transform_cha_files():
+    return statistics
+
+def transform_cha_files(dictionary_source=cmu.URL, jobs=1, manifest=None, sinks=()):
     '''
     This function recursively walk through the clean directory and calls
-    transform_cha_file to transform the data file whenever it detects one. 
-    It then prints out the total number of .txt files processed.
+    transform_cha_file to transform the data file whenever it detects one,
+    using jobs worker processes. With a manifest, only the files that are
+    not up to date (including all of them when the dictionary changed) are
+    transformed (see update_files()). The lines kept for the n-gram models
+    are written to every sink (e.g. a corpus_sink.CorpusSink) one file at a
+    time, in the order of the files, so the sinks get the same lines at any
+    number of jobs. It then prints out the total number of .txt files 
+    processed and returns the merged statistics.
+    The dictionary is loaded from dictionary_source (a url or a local
+    file) through the on-disk cache of cmu_dict. It is memory-mapped, so
+    the worker processes share it instead of copying it.
     '''
     print("Task: Transformation")
-    count = 0
-    dictionary = cmu.cmu_dictionary()
+    dictionary = cmu.cmu_dictionary(dictionary_source)
     # Recursively process .txt files
-    for root, _, files in os.walk("clean"):
-        for file in files:
-            if file.endswith(".txt"):
-                file_path = os.path.join(root, file)
-                transform_cha_file(file_path, dictionary)
-                count += 1
-    
-    global FILE_NUM
-    FILE_NUM = count
-    print(f"Total .txt files transformed: {count}")
+    file_paths = find_files("clean", ".txt")
+    transform = partial(transform_cha_file, dictionary=dictionary)
+    versions = {"rules": TRANSFORM_VERSION, "dictionary": dictionary.checksum}
+    results = update_files(transform, file_paths, transform_path, versions, jobs, manifest, "transformed")
+    statistics = collect_transformed(results, transform_path, sinks)
+
+    print(f"Total .txt files transformed: {statistics.transformed_files}")
+    print(f"Token cache: {statistics.token_cache_hits} hits, {statistics.token_cache_misses} misses")
+    return statistics
+
+def collect_transformed(results, output_path, sinks=()):
+    '''
+    This function takes in the results of update_files() for transformed
+    files (whose path is given by output_path) and writes the lines kept 
+    for the n-gram models to every sink, reading them back from the files
+    that are up to date. It returns the merged statistics.
+    '''
+    statistics = Statistics()
+    for file_path, file_statistics, up_to_date in results:
+        if up_to_date:
+            print("Up to date: " + str(output_path(file_path)))
+            file_statistics.transformed_lines = kept_lines(output_path(file_path))
+            file_statistics.kept_line_count = len(file_statistics.transformed_lines)
+        else:
+            print("Processing: " + str(output_path(file_path)))
+        for sink in sinks:
+            sink.write(file_statistics.transformed_lines)
+        statistics.merge(file_statistics)
+    return statistics
+
+'''
+Task: Data Cleaning and Transformation in one pass
+'''
+def write_lines(content, filename):
+    '''
+    This function takes in content (an iterable of lines) and yields its 
+    lines, writing each of them to filename on the way.
+    '''
+    with open(filename, 'w', encoding='utf-8') as output_file:
+        for line in content:
+            output_file.write(line)
+            yield line
+
+def collect_lines(content, lines):
+    '''
+    This function takes in content (an iterable of lines) and yields its
+    lines, appending each of them to the list lines on the way.
+    '''
+    for line in content:
+        lines.append(line)
+        yield line
 
-def summary():
+def join_lines(content):
+    '''
+    This function takes in cleaned content (an iterable of lines) and 
+    yields the lines that reading it back from a file would give. A
+    cleaning rule can remove the end of line (e.g. "&~trail,\\n" is
+    removed with its end of line), and then the cleaned line is joined
+    with the next one in the clean file.
     '''
-    This function prints out the summary and also output the unknown 
-    words to unk.txt.
+    pending = list()
+    for line in content:
+        pending.append(line)
+        if line.endswith("\n"):
+            yield "".join(pending)
+            pending = list()
+    if pending:
+        yield "".join(pending)
+
+def fused_path(file_path):
+    '''
+    This function returns the path in the transformed directory of a .cha
+    file in the Data directory.
+    '''
+    return transform_path(clean_path(file_path))
+
+def clean_and_transform_cha_file(file_path, dictionary, write_clean=True, extra_stages=(), to_archive=False):
     '''
-    print("\nNumber of files processed  : " + str(FILE_NUM))
-    print("Total number of words        : " + str(TOTAL_WORD_COUNT))
-    print("Total number of unique words : " + str(len(ALL_WORDS)))
-    print("Total number of unknown words: " + str(len(NOT_IN_DICT)))
-    percentage = 100 * len(NOT_IN_DICT)/TOTAL_WORD_COUNT
+    This function takes a file path (from Data) and streams the .cha file 
+    through clean_file() (see it for extra_stages) and join_lines() straight
+    into transform_lines(), so the file is read once and the cleaned content
+    is never read back. The transformed data is written to the same path as
+    transform_cha_file() would, and the clean data is also written to the 
+    clean directory if write_clean is True. If to_archive is True, nothing
+    is written: the contents are returned in statistics.outputs instead.
+    It returns the statistics of the file.
+    '''
+    statistics = Statistics()
+    statistics.cleaned_files = 1
+    statistics.transformed_files = 1
+
+    content = clean_file(file_path, statistics, extra_stages)
+    if to_archive:
+        clean_content = list()
+        if write_clean:
+            content = collect_lines(content, clean_content)
+        statistics.outputs["transformed"] = "".join(transform_lines(join_lines(content), dictionary, statistics))
+        if write_clean:
+            statistics.outputs["clean"] = "".join(clean_content)
+        return statistics
+
+    if write_clean:
+        clean_file_path = clean_path(file_path)
+        os.makedirs(os.path.dirname(clean_file_path), exist_ok=True)
+        content = write_lines(content, clean_file_path)
+
+    transform_file_path = fused_path(file_path)
+    os.makedirs(os.path.dirname(transform_file_path), exist_ok=True)
+    write_file(transform_file_path, transform_lines(join_lines(content), dictionary, statistics))
+
+    return statistics
+
+def clean_and_transform_cha_files(dictionary_source=cmu.URL, jobs=1, manifest=None, sinks=(),
+                                  write_clean=True, extra_stages=(), archive_directory=None):
+    '''
+    This function does the work of clean_cha_files() and then 
+    transform_cha_files() (see them for the arguments), but each .cha file
+    in the Data directory goes through clean_and_transform_cha_file(), so
+    the clean directory is not walked nor read. The transformed directory
+    is the same as with the two tasks. With a manifest, the transformed
+    files are tracked in their own section, which depends on both the 
+    cleaning and the transformation versions and on write_clean, with the
+    checksums of the clean files written with them. It then prints out the total
+    number of .cha files processed and the throughput, and returns the
+    merged statistics.
+    With archive_directory, the transformed (and clean) trees are written
+    as the archives archive_directory/transformed and archive_directory/clean
+    (see archive.py) instead of one file per .cha file. The archives are
+    written again as a whole, so the manifest is not used.
+    '''
+    print("Task: Data Cleaning and Transformation")
+    start = time.perf_counter()
+    archives = dict()
+    if archive_directory is not None:
+        manifest = None
+        archives["transformed"] = archive.ArchiveWriter(os.path.join(archive_directory, "transformed"))
+        if write_clean:
+            archives["clean"] = archive.ArchiveWriter(os.path.join(archive_directory, "clean"))
+    dictionary = cmu.cmu_dictionary(dictionary_source)
+    # Recursively process .cha files
+    file_paths = find_files("Data", ".cha")
+    process = partial(clean_and_transform_cha_file, dictionary=dictionary,
+                      write_clean=write_clean, extra_stages=extra_stages,
+                      to_archive=archive_directory is not None)
+    versions = {
+        "cleaning": cleaning_versions(extra_stages),
+        "rules": TRANSFORM_VERSION,
+        "dictionary": dictionary.checksum,
+        "write_clean": write_clean,
+    }
+    # The clean files are written with the transformed files, so a missing or changed one makes them stale
+    other_paths = (lambda file_path: [clean_path(file_path)]) if write_clean else None
+    results = update_files(process, file_paths, fused_path, versions, jobs, manifest, "fused", other_paths)
+    if archives:
+        results = write_archives(results, archives)
+    statistics = collect_transformed(results, fused_path, sinks)
+    for writer in archives.values():
+        writer.close()
+
+    print(f"Total .cha files cleaned and transformed: {statistics.transformed_files}")
+    print_throughput(statistics.line_count, time.perf_counter() - start)
+    print(f"Token cache: {statistics.token_cache_hits} hits, {statistics.token_cache_misses} misses")
+    return statistics
+
+def write_archives(results, archives):
+    '''
+    This function takes in the results of update_files() for files processed
+    with to_archive (see clean_and_transform_cha_file()) and yields them
+    after adding their outputs to the archives (tree name -> 
+    archive.ArchiveWriter), keyed by the path of the .cha file, in order.
+    '''
+    for file_path, file_statistics, up_to_date in results:
+        for tree, writer in archives.items():
+            writer.add(file_path, file_statistics.outputs[tree])
+        file_statistics.outputs = dict()
+        yield file_path, file_statistics, up_to_date
+
+def summary(statistics):
+    '''
+    This function prints out the summary of the merged statistics and also
+    output the unknown words to unk.txt (sorted, so that the file is the
+    same at any number of jobs).
+    '''
+    print("\nNumber of files processed  : " + str(statistics.transformed_files))
+    print("Total number of words        : " + str(statistics.word_count))
+    print("Total number of unique words : " + str(len(statistics.all_words)))
+    print("Total number of unknown words: " + str(len(statistics.not_in_dict)))
+    percentage = 100 * len(statistics.not_in_dict)/statistics.word_count
     print("Percentage of unknown words  : " + str(round(percentage, 4)) + "%")
     
     with open('unk.txt', 'w') as f:
-        for line in NOT_IN_DICT:
+        for line in sorted(statistics.not_in_dict):
             f.write(f"{line}\n")
     print("Unknown words are in unk.txt")
 
+def parse_arguments():
+    '''
+    This function reads in the optional command line arguments.
+    '''
+    parser = argparse.ArgumentParser(description="Clean and transform CHILDES .cha files")
+    parser.add_argument("--dict", default=cmu.URL, dest="dictionary_source",
+                        help="url or local path of the CMU's Pronunciation Dictionary")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes (default: 1)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="clean and transform every file, even if it is up to date")
+    parser.add_argument("--binary-corpus", metavar="DIRECTORY",
+                        help="also write all_transformed_lines.txt as a binary corpus for part2")
+    parser.add_argument("--compress", choices=["gzip", "zstd"],
+                        help="compress all_transformed_lines.txt (zstd needs the zstandard package)")
+    parser.add_argument("--fused", action="store_true",
+                        help="clean and transform each file in one pass, without reading clean/ back")
+    parser.add_argument("--no-clean-output", action="store_true",
+                        help="with --fused, do not write the clean/ directory")
+    parser.add_argument("--archive", metavar="DIRECTORY",
+                        help="write the clean and transformed trees as sharded archives in DIRECTORY (implies --fused)")
+    parser.add_argument("--profile", nargs="?", const="profile.json", metavar="REPORT",
+                        help="time every stage and cleaning rule and write a json report (default: profile.json), runs with one job")
+    parser.add_argument("--profile-cprofile", metavar="FILE",
+                        help="with --profile, also write cProfile statistics to FILE")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="with --profile, also record the peak memory and top allocations (tracemalloc)")
+    parser.add_argument("--verify-clean", action="store_true",
+                        help="compare the cleaning of Data/ with clean/ without writing anything")
+    args = parser.parse_args()
+    if args.no_clean_output and not (args.fused or args.archive):
+        parser.error("--no-clean-output needs --fused or --archive")
+    return args
+
 if __name__ == "__main__":
-    clean_cha_files()
-    transform_cha_files()
-    summary()
-    print(ALL_TRANSFORMED_LINES)
-    print(len(ALL_TRANSFORMED_LINES))
-    with open("all_transformed_lines.txt", "w") as file:
-        for line in ALL_TRANSFORMED_LINES:
-            file.write(line)
\ No newline at end of file
+    args = parse_arguments()
+    run_profiler = None
+    if args.profile:
+        # The stages are timed in this process, so the files are not sent to workers
+        args.jobs = 1
+        run_profiler = profiler.Profiler(sys.modules[__name__], args.profile_cprofile, args.profile_memory)
+        run_profiler.install()
+    if args.verify_clean:
+        mismatches = verify_clean_files()
+        if run_profiler is not None:
+            run_profiler.uninstall()
+            run_profiler.save(args.profile)
+        sys.exit(1 if mismatches else 0)
+    manifest = mf.load_manifest() if not args.rebuild else {"version": mf.MANIFEST_VERSION}
+    # The kept lines are written as they are transformed
+    sinks = [corpus_sink.CorpusSink("all_transformed_lines.txt", args.compress)]
+    if args.binary_corpus:
+        sinks.append(binary_corpus.CorpusWriter(args.binary_corpus))
+    if args.fused or args.archive:
+        statistics = clean_and_transform_cha_files(args.dictionary_source, args.jobs, manifest, sinks,
+                                                   write_clean=not args.no_clean_output,
+                                                   archive_directory=args.archive)
+    else:
+        statistics = clean_cha_files(args.jobs, manifest=manifest)
+        statistics.merge(transform_cha_files(args.dictionary_source, args.jobs, manifest, sinks))
+    for sink in sinks:
+        sink.close()
+
+    mf.save_manifest(manifest)
+    summary(statistics)
+    print(f"Lines written to {sinks[0].path}: {statistics.kept_line_count}")
+    if run_profiler is not None:
+        run_profiler.uninstall()
+        run_profiler.save(args.profile)
@@ -0,0 +1,75 @@
+'''
+The manifest records how every file in the clean and transformed directories
+was built, so that src/main.py only rebuilds the outputs that are stale.
+
+It is a json file with one section per task ("clean" and "transformed"),
+each mapping an output path to an entry like:
+{"input": sha256 of the input file, "versions": {...}, "output": sha256 of
+the output file, "others": {path: sha256}, "statistics": {...}}
+where versions holds what else the output depends on (the version of the
+cleaning rules, the checksum of the dictionary, ...), others holds the
+checksums of the other files written with the output (the clean files of the
+fused task, "fused") and statistics holds the statistics of the file (see
+Statistics in src/main.py), so that the summary can be computed without
+processing the file again. The checksum of the output makes an output written
+by another task (such as transformed/ by the fused task) stale for the tasks
+that did not write it.
+'''
+import os, json, hashlib
+import cmu_dict as cmu
+
+MANIFEST_PATH = "manifest.json"
+MANIFEST_VERSION = 2
+
+def file_checksum(path):
+    '''
+    This function returns the sha256 checksum (hex) of a file.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(path=MANIFEST_PATH):
+    '''
+    This function returns the manifest, or an empty one if the file does
+    not exist or was written by another version.
+    '''
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {"version": MANIFEST_VERSION}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION}
+    return manifest
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    '''
+    This function writes the manifest.
+    '''
+    cmu.write_atomic(path, json.dumps(manifest, sort_keys=True).encode("utf-8"))
+
+def is_up_to_date(entry, output_path, input_checksum, versions, other_paths=()):
+    '''
+    This function returns True if the manifest entry of output_path shows
+    that it was built from the same input with the same versions, and the
+    output and the other paths written with it still exist as they were
+    built.
+    '''
+    if entry is None or entry.get("input") != input_checksum or entry.get("versions") != versions:
+        return False
+    checksums = dict(entry.get("others", dict()))
+    checksums[output_path] = entry.get("output")
+    return all(
+        os.path.exists(path) and checksums.get(path) == file_checksum(path)
+        for path in [output_path, *other_paths]
+    )
+
+def make_entry(input_checksum, versions, statistics, output_checksum=None, other_checksums=None):
+    '''
+    This function returns the manifest entry of an output.
+    '''
+    return {"input": input_checksum, "versions": versions, "output": output_checksum,
+            "others": other_checksums or dict(), "statistics": statistics}
@@ -0,0 +1,271 @@
+'''
+This module profiles a run of src/main.py (python3 src/main.py --profile).
+
+Profiler.install() replaces the functions of the pipeline (the module of
+main.py, including every compiled regex *_PATTERN) by timed wrappers, and
+uninstall() puts the originals back, so nothing is timed and nothing is
+slower when the option is off. For every stage and every regex rule it records:
+- seconds : wall time spent in it, without the time of the timed stages
+            it calls (e.g. "write" does not include the cleaning of the
+            lines it writes, which is in "clean_lines" and the rules)
+- calls   : number of calls (or of lines for the stages that are
+            iterators of lines)
+- bytes   : size of its input (characters for text)
+It also records the slowest input files. The timed wrappers add their own
+overhead, so the seconds are an upper bound of the real ones.
+The report is written as json, optionally with a cProfile dump and the
+top memory allocations (tracemalloc).
+'''
+import os, sys, json, time, heapq, cProfile, tracemalloc
+import manifest as mf
+import cmu_dict as cmu
+import compact_dict
+import corpus_sink
+import binary_corpus
+
+# Number of slowest files and of memory allocations in the report
+SLOWEST_FILES = 20
+TOP_ALLOCATIONS = 20
+
+class Profiler:
+    '''
+    This class records the time, calls and bytes of the timed stages (see
+    the module docstring). The timed stages can call each other: a stack
+    of the time spent in the callees of the running stages is kept, so
+    that every stage only gets its own time.
+    '''
+    def __init__(self, pipeline, cprofile_path=None, trace_memory=False):
+        self.pipeline = pipeline
+        self.records = {"stages": dict(), "rules": dict()}
+        self.stack = list()
+        self.slowest = list()
+        self.patches = list()
+        self.cprofile_path = cprofile_path
+        self.cprofile = None
+        self.trace_memory = trace_memory
+        self.start_time = None
+        self.seconds = 0.0
+
+    def start(self):
+        '''
+        This method starts timing a stage and returns its start time.
+        '''
+        self.stack.append(0.0)
+        return time.perf_counter()
+
+    def stop(self, category, name, start, size=0):
+        '''
+        This method stops timing the stage started at start and records
+        it. It returns the time spent in the stage with its callees.
+        '''
+        elapsed = time.perf_counter() - start
+        callees = self.stack.pop()
+        if self.stack:
+            self.stack[-1] += elapsed
+        record = self.records[category].get(name)
+        if record is None:
+            record = self.records[category][name] = [0.0, 0, 0]
+        record[0] += elapsed - callees
+        record[1] += 1
+        record[2] += size
+        return elapsed
+
+    def timed(self, name, function, size=None, category="stages"):
+        '''
+        This method returns function timed as the stage name. size (if
+        given) returns the size of the input from the arguments.
+        '''
+        def wrapper(*args, **kwargs):
+            start = self.start()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.stop(category, name, start, size(*args, **kwargs) if size else 0)
+        return wrapper
+
+    def timed_iterator(self, name, function):
+        '''
+        This method returns function (which returns an iterator of lines)
+        with every line of its iterator timed as the stage name.
+        '''
+        def next_lines(iterator):
+            while True:
+                start = self.start()
+                try:
+                    line = next(iterator)
+                except StopIteration:
+                    self.stop("stages", name, start)
+                    return
+                self.stop("stages", name, start, len(line))
+                yield line
+
+        def wrapper(*args, **kwargs):
+            return next_lines(iter(function(*args, **kwargs)))
+        return wrapper
+
+    def timed_file(self, function):
+        '''
+        This method returns function (which processes the file given by its
+        first argument) timed as the stage of its name, and keeps the time
+        of the file if it is one of the slowest.
+        '''
+        def wrapper(file_path, *args, **kwargs):
+            start = self.start()
+            try:
+                return function(file_path, *args, **kwargs)
+            finally:
+                elapsed = self.stop("stages", function.__name__, start, os.path.getsize(file_path))
+                entry = (elapsed, file_path, function.__name__)
+                if len(self.slowest) < SLOWEST_FILES:
+                    heapq.heappush(self.slowest, entry)
+                else:
+                    heapq.heappushpop(self.slowest, entry)
+        return wrapper
+
+    def patch(self, owner, attribute, replacement):
+        '''
+        This method replaces an attribute of a module or a class until
+        uninstall() is called.
+        '''
+        self.patches.append((owner, attribute, getattr(owner, attribute)))
+        setattr(owner, attribute, replacement)
+
+    def install(self):
+        '''
+        This method replaces the stages of the pipeline by timed ones and
+        starts the run (and cProfile and tracemalloc if requested).
+        '''
+        main = self.pipeline
+        size_of_first = lambda text, *args, **kwargs: len(text)
+        self.patch(main, "find_files", self.timed("walk", main.find_files))
+        self.patch(mf, "file_checksum", self.timed("manifest_checksum", mf.file_checksum,
+                                                     lambda path: os.path.getsize(path)))
+        self.patch(cmu, "cmu_dictionary", self.timed("dictionary_load", cmu.cmu_dictionary))
+        self.patch(compact_dict.CompactDictionary, "get",
+                   self.timed("dictionary_lookup", compact_dict.CompactDictionary.get,
+                              lambda dictionary, word, *args: len(word)))
+        # Cleaning
+        self.patch(main, "read_lines", self.timed_iterator("read", main.read_lines))
+        self.patch(main, "clean_lines", self.timed_iterator("clean_lines", main.clean_lines))
+        self.patch(main, "clean_line", self.timed("punctuation_and_checks", main.clean_line, size_of_first, "rules"))
+        self.patch(main, "record_lines", self.timed_iterator("record_words", main.record_lines))
+        # Transformation
+        self.patch(main, "transform_file", self.timed("read_clean", main.transform_file))
+        self.patch(main, "join_lines", self.timed_iterator("join_lines", main.join_lines))
+        self.patch(main, "transform_lines", self.timed_iterator("transform_lines", main.transform_lines))
+        self.patch(main, "transform_token", self.timed("transform_token", main.transform_token, size_of_first))
+        self.patch(main, "pronounce", self.timed("pronounce", main.pronounce, size_of_first))
+        self.patch(main, "kept_lines", self.timed("read_kept", main.kept_lines))
+        # Writing
+        self.patch(main, "write_file", self.timed("write", main.write_file))
+        self.patch(main, "write_lines", self.timed_iterator("write_clean", main.write_lines))
+        self.patch(corpus_sink.CorpusSink, "write", self.timed("sink_write", corpus_sink.CorpusSink.write))
+        self.patch(binary_corpus.CorpusWriter, "write",
+                   self.timed("binary_corpus_write", binary_corpus.CorpusWriter.write))
+        # Files
+        for name in ("clean_cha_file", "transform_cha_file", "clean_and_transform_cha_file"):
+            self.patch(main, name, self.timed_file(getattr(main, name)))
+        # Regex rules
+        for name in dir(main):
+            if name.endswith("_PATTERN"):
+                self.patch(main, name, TimedPattern(self, name[:-len("_PATTERN")].lower(), getattr(main, name)))
+
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.cprofile_path is not None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        self.start_time = time.perf_counter()
+
+    def uninstall(self):
+        '''
+        This method stops the run and puts the original stages back.
+        '''
+        self.seconds = time.perf_counter() - self.start_time
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_path)
+            print("cProfile statistics are in " + self.cprofile_path)
+        for owner, attribute, original in reversed(self.patches):
+            setattr(owner, attribute, original)
+        self.patches = list()
+
+    def report(self):
+        '''
+        This method returns the report of the run (json serializable),
+        with the stages and rules sorted from the slowest.
+        '''
+        def records(category):
+            items = sorted(self.records[category].items(), key=lambda item: -item[1][0])
+            return {name: {"seconds": seconds, "calls": calls, "bytes": size}
+                    for name, (seconds, calls, size) in items}
+
+        stages, rules = records("stages"), records("rules")
+        accounted = sum(record["seconds"] for record in stages.values())
+        accounted += sum(record["seconds"] for record in rules.values())
+        report = {
+            "command": sys.argv,
+            "seconds": self.seconds,
+            "unaccounted_seconds": self.seconds - accounted,
+            "stages": stages,
+            "rules": rules,
+            "slowest_files": [
+                {"path": file_path, "task": task, "seconds": seconds}
+                for seconds, file_path, task in sorted(self.slowest, reverse=True)
+            ],
+        }
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            report["memory"] = {
+                "current_bytes": current,
+                "peak_bytes": peak,
+                "top_allocations": [
+                    {"location": str(statistic.traceback[0]), "bytes": statistic.size, "count": statistic.count}
+                    for statistic in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+                ],
+            }
+            tracemalloc.stop()
+        return report
+
+    def save(self, path):
+        '''
+        This method writes the report to path and prints the slowest stages.
+        '''
+        report = self.report()
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print(f"\nProfile ({report['seconds']:.2f}s):")
+        for name, record in list(report["stages"].items())[:5] + list(report["rules"].items())[:5]:
+            print(f"  {name:<20} {record['seconds']:8.3f}s {record['calls']:>10} calls")
+        print("Profile report is in " + path)
+
+class TimedPattern:
+    '''
+    This class wraps a compiled regex, timing its searches as the rule name.
+    '''
+    def __init__(self, profiler, name, pattern):
+        self.profiler = profiler
+        self.name = name
+        self.pattern = pattern
+
+    def sub(self, repl, string, count=0):
+        start = self.profiler.start()
+        try:
+            return self.pattern.sub(repl, string, count)
+        finally:
+            self.profiler.stop("rules", self.name, start, len(string))
+
+    def match(self, string, *args):
+        start = self.profiler.start()
+        try:
+            return self.pattern.match(string, *args)
+        finally:
+            self.profiler.stop("rules", self.name, start, len(string))
+
+    def search(self, string, *args):
+        start = self.profiler.start()
+        try:
+            return self.pattern.search(string, *args)
+        finally:
+            self.profiler.stop("rules", self.name, start, len(string))
@@ -0,0 +1,239 @@
+'''
+This module reads and writes language models in the ARPA format, such as the
+KenLM models of lms/ (bigram.arpa, trigram.arpa):
+
+\data\
+ngram 1=72
+ngram 2=2550
+
+\1-grams:
+log10 probability   token   [log10 backoff weight]
+...
+
+\2-grams:
+log10 probability   token1 token2   [log10 backoff weight]
+...
+
+\end\
+
+read_arpa() reads a file one line at a time into an ArpaModel, which stores
+every order as the sorted arrays of a count trie (see ngram.CountTrie) with
+the probabilities and backoff weights instead of the counts. ArpaModel scores
+utterances with the same methods as NgramModel (score(), evaluate()).
+write_arpa() writes a trained NgramModel as an ARPA file with the same
+probabilities.
+'''
+import array, math
+import ngram
+
+# log10 of a probability of 0 in an ARPA file
+LOG10_ZERO = -99.0
+
+class ArpaModel(ngram.LanguageModel):
+    '''
+    This class is a backoff language model read from an ARPA file (see read_arpa()). The
+    probability of a token given a history is the one of the longest n-gram of the file made of
+    the end of the history and the token, multiplied by the backoff weights of the longer
+    histories that are in the file.
+    '''
+    def __init__(self, vocabulary: list, trie: ngram.CountTrie, log_probs: list, backoffs: list):
+        self.order = trie.order
+        self.vocabulary = vocabulary
+        self.ids = {token: i for i, token in enumerate(vocabulary)}
+        unk = self.ids.get("<unk>", self.ids.get("<UNK>"))
+        if unk is None:
+            raise ValueError("The ARPA file has no unknown token (<unk> or <UNK>)")
+        self.unk = unk
+        self.trie = trie
+        self.log_probs = log_probs
+        self.backoffs = backoffs
+
+        # Utterances start with one <s> (as in KenLM), or order - 1 if the models of ngram.py
+        # wrote the file (its n-grams then have <s> <s>)
+        self.ends = "</s>" in self.ids
+        if "<s>" not in self.ids:
+            self.starts = 0
+        elif self.order > 2 and trie.find((self.ids["<s>"], self.ids["<s>"])) >= 0:
+            self.starts = self.order - 1
+        else:
+            self.starts = 1
+
+    def log10_prob(self, history, token: int) -> float:
+        '''
+        This method returns the log10 probability of a token id given the ids of the tokens before
+        it (at most order - 1 are used).
+        '''
+        history = tuple(history[len(history) - self.order + 1:]) if self.order > 1 else ()
+        backoff = 0.0
+        for start in range(len(history) + 1):
+            context = history[start:]
+            i = self.trie.find(context + (token,))
+            if i >= 0:
+                return self.log_probs[len(context)][i] + backoff
+            j = self.trie.find(context) if context else -1
+            if j >= 0:
+                backoff += self.backoffs[len(context) - 1][j]
+        return LOG10_ZERO + backoff
+
+    def log_prob(self, history, token: int) -> float:
+        '''
+        This method returns the natural log probability of a token id given the ids of the tokens
+        before it, -inf for a log10 probability of LOG10_ZERO or less (a probability of 0).
+        '''
+        log10_prob = self.log10_prob(history, token)
+        if log10_prob <= LOG10_ZERO:
+            return -math.inf
+        return log10_prob * math.log(10)
+
+def is_arpa(path: str) -> bool:
+    '''
+    This function returns True if path is an ARPA file (it starts with \\data\\).
+    '''
+    with open(path, "rb") as file:
+        return file.read(64).lstrip().startswith(b"\\data\\")
+
+def parse_ngram(line: str, order: int) -> (float, list, float):
+    '''
+    This function returns the log10 probability, the tokens and the log10 backoff weight (0 if
+    there is none) of a line of the n-grams of an order.
+    '''
+    fields = line.split()
+    if len(fields) not in (order + 1, order + 2):
+        raise ValueError("Not an ARPA " + str(order) + "-gram: " + line)
+    backoff = float(fields[order + 1]) if len(fields) == order + 2 else 0.0
+    return float(fields[0]), fields[1: order + 1], backoff
+
+def read_arpa(path: str) -> ArpaModel:
+    '''
+    This function reads an ARPA file one line at a time and returns its model.
+    '''
+    sizes = dict()
+    vocabulary, ids = list(), dict()
+    levels = list()
+    order = 0
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            if line == "\\data\\":
+                continue
+            if line == "\\end\\":
+                break
+            if line.startswith("ngram ") and order == 0:
+                size_order, size = line[len("ngram "):].split("=")
+                sizes[int(size_order)] = int(size)
+                continue
+            if line.startswith("\\") and line.endswith("-grams:"):
+                order = int(line[1: -len("-grams:")])
+                if order != len(levels) + 1:
+                    raise ValueError("The " + str(order) + "-grams of " + path + " are out of order")
+                levels.append(list())
+                continue
+            if order == 0:
+                raise ValueError("Not an ARPA file: " + path)
+
+            log_prob, tokens, backoff = parse_ngram(line, order)
+            if order == 1:
+                ids[tokens[0]] = len(vocabulary)
+                vocabulary.append(tokens[0])
+                levels[0].append(((ids[tokens[0]],), log_prob, backoff))
+            else:
+                levels[-1].append((tuple(ids[token] for token in tokens), log_prob, backoff))
+
+    for level_order, level in enumerate(levels, 1):
+        if sizes.get(level_order, len(level)) != len(level):
+            raise ValueError("The header of " + path + " does not match its " + str(level_order) + "-grams")
+
+    # Every order as sorted arrays (the 1-grams are already sorted by id)
+    tokens, log_probs, backoffs, children = list(), list(), list(), list()
+    previous = None
+    for k, level in enumerate(levels):
+        level.sort(key=lambda entry: entry[0])
+        ngrams = [entry[0] for entry in level]
+        tokens.append(array.array("I", (ngram_ids[-1] for ngram_ids in ngrams)))
+        log_probs.append(array.array("d", (entry[1] for entry in level)))
+        if k < len(levels) - 1:
+            backoffs.append(array.array("d", (entry[2] for entry in level)))
+        if previous is not None:
+            children.append(ngram.CountTrie.children_of(previous, ngrams))
+        previous = ngrams
+        levels[k] = None
+    return ArpaModel(vocabulary, ngram.CountTrie(tokens, [], children), log_probs, backoffs)
+
+def format_log10(value: float) -> str:
+    '''
+    This function formats a log10 probability or backoff weight of an ARPA file.
+    '''
+    return "%.10g" % max(value, LOG10_ZERO)
+
+def log10(value: float) -> float:
+    '''
+    This function returns the log10 of a probability (LOG10_ZERO for 0).
+    '''
+    return math.log10(value) if value > 0 else LOG10_ZERO
+
+def write_arpa(model: ngram.NgramModel, path: str):
+    '''
+    This function writes a trained NgramModel as an ARPA file that gives the same probabilities as
+    the model (see NgramModel.log_prob()), so it has the same perplexities. For a model of order
+    2 or more, the n-grams of the order of the model seen in the training set have their
+    probability, and every other n-gram backs off to the lower orders. There, every n-gram has the
+    probability of a cell of an unseen history (1 / |V| with smoothing, 0 without). The backoff
+    weight of a history of order - 1 tokens changes it into the probability of an unseen cell of
+    that history, k / (count of the history + k|V|). The lower orders of the file are therefore
+    only the backoff of the model, not the models of lower orders.
+    '''
+    trie = model.trie
+    size = len(model.vocabulary)
+    smoothing = model.k
+    top = model.order - 1
+    ngrams = list(trie.ngram_levels())
+    unigram_counts = dict(zip(trie.tokens[0], trie.counts[0]))
+
+    # log10 probability of the n-grams of the lower orders
+    floor = log10(1 / size) if smoothing else LOG10_ZERO
+
+    def backoff(level: int, count: int) -> float:
+        '''
+        This function returns the log10 backoff weight of an n-gram of a level seen count times.
+        '''
+        if level != top - 1 or not smoothing:
+            return 0.0
+        return math.log10(smoothing * size / (count + smoothing * size))
+
+    # Probabilities of the n-grams of the order of the model
+    if model.order == 1:
+        total = model.unigram_total + smoothing * size
+        top_log_probs = [log10((unigram_counts.get(token, 0) + smoothing) / total) for token in range(size)]
+    else:
+        children, counts = trie.children[top - 1], trie.counts[top]
+        top_log_probs = [0.0] * len(ngrams[top])
+        for i, history_count in enumerate(trie.counts[top - 1]):
+            given_count = history_count + smoothing * size
+            for j in range(children[i], children[i + 1]):
+                top_log_probs[j] = log10((counts[j] + smoothing) / given_count)
+
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("\\data\\\n")
+        file.write("ngram 1=" + str(size) + "\n")
+        for k in range(1, model.order):
+            file.write("ngram " + str(k + 1) + "=" + str(len(ngrams[k])) + "\n")
+
+        # Every token is a 1-gram
+        file.write("\n\\1-grams:\n")
+        for token in range(size):
+            line = format_log10(top_log_probs[token] if top == 0 else floor) + "\t" + model.vocabulary[token]
+            if model.order > 1:
+                line += "\t" + format_log10(backoff(0, unigram_counts.get(token, 0)))
+            file.write(line + "\n")
+
+        for k in range(1, model.order):
+            file.write("\n\\" + str(k + 1) + "-grams:\n")
+            for i, ngram_ids in enumerate(ngrams[k]):
+                line = format_log10(top_log_probs[i] if k == top else floor) + "\t"
+                line += " ".join(model.vocabulary[token] for token in ngram_ids)
+                if k < top:
+                    line += "\t" + format_log10(backoff(k, trie.counts[k][i]))
+                file.write(line + "\n")
+        file.write("\n\\end\\\n")
@@ -0,0 +1,266 @@
+'''
+This module reads and writes utterances either as text (one utterance per
+line, phones separated by spaces, as in data/all_transformed_lines.txt) or as
+a binary corpus, which is a directory with:
+- vocab.txt   : one phone per line, the id of a phone is its line number
+- tokens.npy  : the phone ids of all utterances back to back (uint8, or
+                uint16 for more than 256 phones)
+- offsets.npy : uint64[utterances + 1], start of each utterance in tokens.npy
+The .npy files are standard NumPy arrays, but NumPy is not needed: they are
+memory-mapped and read with the built-in memoryview.
+The binary corpus is written by part1 (python3 src/main.py --binary-corpus).
+Utterances can also be read from the transformed archive of part1 (python3
+src/main.py --archive), see Archive, or from a directory of text files such as
+part1's clean/ directory (one utterance of words per line).
+'''
+import os, re, sys, ast, json, mmap, array
+
+NPY_MAGIC = b"\x93NUMPY"
+# array typecode -> NumPy dtype (little-endian)
+NPY_DTYPES = {"B": "|u1", "H": "<u2", "Q": "<u8"}
+
+def write_npy(path, values, typecode):
+    '''
+    This function writes values (an iterable of non-negative integers) to
+    a one dimensional .npy file of the type given by typecode.
+    '''
+    values = array.array(typecode, values)
+    if sys.byteorder != "little":
+        values.byteswap()
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (NPY_DTYPES[typecode], len(values))
+    # The data starts at a multiple of 64 bytes, as in NumPy
+    padding = 63 - (len(NPY_MAGIC) + 4 + len(header)) % 64
+    header = (header + " " * padding + "\n").encode("latin-1")
+    with open(path, "wb") as file:
+        file.write(NPY_MAGIC + b"\x01\x00" + len(header).to_bytes(2, "little") + header)
+        file.write(values.tobytes())
+
+def read_npy(path) -> memoryview:
+    '''
+    This function memory-maps a one dimensional .npy file written by
+    write_npy() and returns its values as a memoryview.
+    '''
+    with open(path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:6] != NPY_MAGIC or mapped[6] != 1:
+        raise ValueError("Not a version 1 .npy file: " + path)
+    header_size = int.from_bytes(mapped[8:10], "little")
+    header = ast.literal_eval(mapped[10: 10 + header_size].decode("latin-1"))
+    typecodes = {dtype: typecode for typecode, dtype in NPY_DTYPES.items()}
+    if header["descr"] not in typecodes or len(header["shape"]) != 1 or sys.byteorder != "little":
+        raise ValueError("Unsupported .npy file: " + path)
+    return memoryview(mapped)[10 + header_size:].cast(typecodes[header["descr"]])
+
+def is_binary_corpus(path) -> bool:
+    '''
+    This function returns True if path is a binary corpus directory.
+    '''
+    return os.path.isfile(os.path.join(path, "vocab.txt"))
+
+def tokenize(line: str) -> list:
+    '''
+    This function returns the phones of a line of text.
+    '''
+    return [token for token in line.rstrip("\n").split(" ") if token]
+
+class BinaryCorpus:
+    '''
+    This class opens a binary corpus directory (see the module docstring).
+    The arrays are memory-mapped, so opening a corpus does not read it.
+    '''
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "vocab.txt"), "r", encoding="utf-8") as file:
+            self.vocab = file.read().split("\n")[:-1]
+        self.tokens = read_npy(os.path.join(directory, "tokens.npy"))
+        self.offsets = read_npy(os.path.join(directory, "offsets.npy"))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def ids(self, i: int) -> memoryview:
+        '''
+        This method returns the phone ids of the i-th utterance.
+        '''
+        return self.tokens[self.offsets[i]: self.offsets[i + 1]]
+
+    def utterance(self, i: int) -> list:
+        '''
+        This method returns the phones of the i-th utterance.
+        '''
+        vocab = self.vocab
+        return [vocab[phone] for phone in self.ids(i)]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.utterance(i)
+
+def write_corpus(directory: str, utterances, vocab=None):
+    '''
+    This function writes utterances (an iterable of lists of phones) to a
+    binary corpus directory. Phone ids are given in order of first use.
+    If vocab (a list of phones) is given, the utterances are lists of phone
+    ids in vocab instead, and they are written as they are.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    phone_ids = dict()
+    tokens = array.array("H")
+    offsets = array.array("Q", [0])
+    for utterance in utterances:
+        if vocab is not None:
+            tokens.extend(utterance)
+        else:
+            for phone in utterance:
+                if phone not in phone_ids:
+                    phone_ids[phone] = len(phone_ids)
+                tokens.append(phone_ids[phone])
+        offsets.append(len(tokens))
+    if vocab is not None:
+        phone_ids = {phone: i for i, phone in enumerate(vocab)}
+
+    if len(phone_ids) > 65536:
+        raise ValueError("Too many distinct phones for a uint16 phone id: " + str(len(phone_ids)))
+    with open(os.path.join(directory, "vocab.txt"), "w", encoding="utf-8") as file:
+        file.writelines(phone + "\n" for phone in phone_ids)
+    write_npy(os.path.join(directory, "tokens.npy"), tokens, "B" if len(phone_ids) <= 256 else "H")
+    write_npy(os.path.join(directory, "offsets.npy"), offsets, "Q")
+
+def is_archive(path) -> bool:
+    '''
+    This function returns True if path is an archive directory of part1.
+    '''
+    return os.path.isfile(os.path.join(path, "index.json"))
+
+class Archive:
+    '''
+    This class opens an archive directory written by part1 (see 
+    part1-regex-datacleaning/src/archive.py): shard files of records and
+    an index.json mapping the path of each .cha file to [shard, offset,
+    size] of its output. Only the index is read when it is opened.
+    '''
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json"), "r", encoding="utf-8") as file:
+            self.index = json.load(file)
+        self.shards = dict()
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def read(self, key: str) -> str:
+        '''
+        This method returns the output of the .cha file key.
+        '''
+        shard, offset, size = self.index[key]
+        if shard not in self.shards:
+            with open(os.path.join(self.directory, f"shard-{shard:05d}.bin"), "rb") as file:
+                self.shards[shard] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.shards[shard][offset: offset + size].decode("utf-8")
+
+    def lines(self):
+        '''
+        This method yields the lines kept for the n-gram models (the same
+        lines as all_transformed_lines.txt) of every .cha file, in order.
+        '''
+        for key in self.index:
+            for line in self.read(key).splitlines(keepends=True):
+                if re.search(r"[a-zA-Z]", line) and "<s> <s> </s>" not in line:
+                    yield line
+
+def text_files(directory: str) -> list:
+    '''
+    This function returns the paths of the .txt files of a directory and its
+    subdirectories, in a fixed order.
+    '''
+    paths = list()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, file) for file in sorted(files) if file.endswith(".txt"))
+    return paths
+
+def read_lines(path: str):
+    '''
+    This function yields the lines of a text file, the kept lines of a
+    transformed archive of part1, or the lines of every .txt file of a
+    directory (e.g. part1's clean/ directory, for word-level models).
+    '''
+    if is_archive(path):
+        yield from Archive(path).lines()
+        return
+
+    for text_file in text_files(path) if os.path.isdir(path) else [path]:
+        with open(text_file, "r", encoding="utf-8") as file:
+            yield from file
+
+def byte_ranges(path: str, shards: int) -> list:
+    '''
+    This function splits a text file into (at most) shards byte ranges [start, end) of about the
+    same size. A line belongs to the range its first byte is in (see read_range()).
+    '''
+    size = os.path.getsize(path)
+    shards = max(1, min(shards, size))
+    bounds = [size * i // shards for i in range(shards + 1)]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+def read_range(path: str, start: int, end: int):
+    '''
+    This function yields the lines of a text file that start in the byte range [start, end), so
+    that the ranges of byte_ranges() read every line exactly once.
+    '''
+    with open(path, "rb") as file:
+        if start > 0:
+            # Skip the line started before the range (unless the range starts a line)
+            file.seek(start - 1)
+            file.readline()
+        position = file.tell()
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode("utf-8").replace("\r\n", "\n")
+
+def shards(path: str, count: int) -> list:
+    '''
+    This function splits a dataset into (at most) count shards that can be read separately with
+    read_shard(): byte ranges of a text file, or ranges of utterances of a binary corpus. Other
+    datasets (archives, directories) are one shard.
+    '''
+    if is_binary_corpus(path):
+        utterances = len(BinaryCorpus(path))
+        count = max(1, min(count, utterances))
+        bounds = [utterances * i // count for i in range(count + 1)]
+        return [(path, "utterances", start, end) for start, end in zip(bounds, bounds[1:])]
+    if os.path.isfile(path) and not is_archive(path):
+        return [(path, "bytes", start, end) for start, end in byte_ranges(path, count)]
+    return [(path, "all", 0, 0)]
+
+def read_shard(shard: tuple):
+    '''
+    This function yields the utterances of a shard of shards().
+    '''
+    path, kind, start, end = shard
+    if kind == "utterances":
+        binary = BinaryCorpus(path)
+        for i in range(start, end):
+            yield binary.utterance(i)
+    elif kind == "bytes":
+        for line in read_range(path, start, end):
+            yield tokenize(line)
+    else:
+        yield from read_utterances(path)
+
+def read_utterances(path: str):
+    '''
+    This function yields the utterances (as lists of phones, or words) of a
+    text file, a binary corpus directory, a transformed archive of part1 or a
+    directory of text files.
+    '''
+    if is_binary_corpus(path):
+        yield from BinaryCorpus(path)
+        return
+
+    for line in read_lines(path):
+        yield tokenize(line)
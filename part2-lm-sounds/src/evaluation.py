@@ -0,0 +1,112 @@
+'''
+This module evaluates the n-gram models of every requested order and
+smoothing at once, and writes the table of their perplexities (the Evaluation
+of README.md) as CSV or JSON:
+    python3 src/main.py table data/training.txt data/dev.txt --orders 1 2 3 \
+        --smoothing none laplace add-0.5 --output evaluation.csv
+
+The training set is read once: the n-grams of every order up to the highest
+one are counted in one pass (see ngram.NgramCounts), and the model of every
+order is built from these counts. The dev set is also read once. For every
+model, the table has the perplexity of the training set and of the dev set
+as in main.py (see NgramModel.table_perplexity()), and the perplexity of the
+dev set scored one utterance at a time (see NgramModel.evaluate()).
+'''
+from collections import Counter
+import csv, copy, json, math, time, argparse
+import corpus
+import ngram
+
+MODEL_NAMES = {1: "unigram", 2: "bigram", 3: "trigram"}
+COLUMNS = ["model", "order", "smoothing", "training_ppl", "dev_ppl", "dev_ppl_streamed"]
+
+def evaluation_table(training_set: str, dev_set: str, orders=(1, 2, 3), smoothings=(False, True), oov_threshold=None,
+                     jobs=1) -> list:
+    '''
+    This function trains the models of every order and smoothing (see ngram.smoothing_constant())
+    from one pass over the training set (by jobs processes) and returns a row (a dict of COLUMNS)
+    for each of them.
+    '''
+    counts = ngram.NgramCounts.from_dataset(training_set, max(orders), jobs)
+    dev_utterances = list(corpus.read_utterances(dev_set))
+    dev_counts = Counter()
+    for tokens in dev_utterances:
+        dev_counts.update(tokens)
+
+    rows = list()
+    for order in orders:
+        # The models of the smoothings only differ by the count added to the cells of the tables
+        model = ngram.NgramModel(None, order, False, oov_threshold, counts=counts)
+        for smoothing in smoothings:
+            smoothed = copy.copy(model)
+            smoothed.smoothing = smoothing
+            rows.append({
+                "model": MODEL_NAMES.get(order, str(order) + "gram"),
+                "order": order,
+                "smoothing": ngram.smoothing_name(smoothing),
+                "training_ppl": smoothed.table_perplexity(),
+                "dev_ppl": smoothed.table_perplexity(dev_counts),
+                "dev_ppl_streamed": smoothed.evaluate(dev_utterances)["perplexity"],
+            })
+    return rows
+
+def write_table(rows: list, path: str):
+    '''
+    This function writes the rows of evaluation_table() to path, as JSON if it ends with .json and
+    as CSV otherwise.
+    '''
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        if path.endswith(".json"):
+            # An infinite perplexity (a token of probability 0 without smoothing) is null in JSON
+            rows = [{column: None if value == math.inf else value for column, value in row.items()} for row in rows]
+            json.dump(rows, file, indent=2)
+        else:
+            writer = csv.DictWriter(file, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+def print_table(rows: list):
+    '''
+    This function prints out the rows of evaluation_table() as the table of README.md.
+    '''
+    print("|Model           | Smoothing  | Training set PPL | Dev set PPL | Dev set PPL (streamed) |")
+    print("|----------------|----------- | ---------------- | ----------- | ---------------------- |")
+    for row in rows:
+        print(f"|{row['model']:<16}| {row['smoothing']:<11}| {row['training_ppl']:>16.5f} | "
+              f"{row['dev_ppl']:>11.5f} | {row['dev_ppl_streamed']:>22.5f} |")
+
+def parse_arguments(arguments=None):
+    '''
+    This function reads in the command line arguments of the table mode.
+    '''
+    parser = argparse.ArgumentParser(prog="main.py table",
+                                     description="Evaluate every n-gram model and smoothing from one counting pass")
+    parser.add_argument("training_set", help="path to the training set")
+    parser.add_argument("dev_set", help="path to the dev set")
+    parser.add_argument("--orders", type=int, nargs="+", default=[1, 2, 3],
+                        help="orders of the models (default: 1 2 3)")
+    parser.add_argument("--smoothing", nargs="+", default=["none", "laplace"],
+                        help="smoothings: none, laplace or add-k such as add-0.5 (default: none laplace)")
+    parser.add_argument("--oov-threshold", type=int, default=None,
+                        help="threshold of the OOV handling (default: OOV_THRESHHOLD of ngram.py)")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of processes counting the training set (default: 1)")
+    parser.add_argument("--output", default="evaluation.csv",
+                        help="CSV file of the table, or JSON if it ends with .json (default: evaluation.csv)")
+    return parser.parse_args(arguments)
+
+def main(arguments=None):
+    '''
+    Evaluates the requested models and writes their table.
+    '''
+    args = parse_arguments(arguments)
+    try:
+        smoothings = [ngram.parse_smoothing(name) for name in args.smoothing]
+    except ValueError as error:
+        raise SystemExit(str(error))
+    start = time.time()
+    rows = evaluation_table(args.training_set, args.dev_set, sorted(set(args.orders)), smoothings, args.oov_threshold,
+                            args.jobs)
+    write_table(rows, args.output)
+    print_table(rows)
+    print(f"\n{len(rows)} models evaluated in {time.time() - start:.1f}s, table is in {args.output}")
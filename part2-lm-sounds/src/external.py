@@ -0,0 +1,224 @@
+'''
+This module trains an n-gram model (see ngram.py) within a memory budget,
+whatever the size of the training set (python3 src/main.py train ...
+--memory-budget 256M, or NgramModel(..., memory_budget="256M")).
+
+The training set is read twice:
+1. the tokens are counted, which gives the vocabulary (OOV handling)
+2. the n-grams (tuples of token ids) of every order are counted in memory
+   until the estimated size of the counts reaches the budget. The counts of
+   every order are then written (sorted) to a run file and forgotten.
+The runs of every order are then merged (k-way merge, adding up the counts
+of the same n-gram) into one sorted file per order, and the model file (see
+NgramModel.save()) is written from these files, one record at a time.
+
+A run file is a sequence of records of uint64: the token ids of an n-gram
+followed by its count.
+'''
+from collections import Counter
+import os, re, heapq, array, tempfile, shutil
+import corpus
+import ngram
+
+# Estimated size in memory of an n-gram and its count in a Counter (bytes)
+ENTRY_BYTES = 200
+# Maximum number of runs merged at once (open files)
+MAX_FAN_IN = 64
+# Number of values written at once
+BLOCK_SIZE = 1 << 16
+# Bytes read at once from every run (MAX_FAN_IN runs are read at once when merging)
+READ_SIZE = 1 << 16
+
+def parse_size(size) -> int:
+    '''
+    This function returns the number of bytes of a size such as 512M, 2G, 100K or 1000000.
+    '''
+    match = re.fullmatch(r"\s*([0-9]+(?:\.[0-9]+)?)\s*([KMG]?)B?\s*", str(size).upper())
+    if match is None:
+        raise ValueError("Not a memory size: " + str(size))
+    return int(float(match.group(1)) * 1024 ** " KMG".index(match.group(2) or " "))
+
+def write_values(file, typecode: str, values):
+    '''
+    This function writes an iterable of integers to a binary file as an array of typecode, one
+    block at a time, and returns the number of values written.
+    '''
+    block = array.array(typecode)
+    written = 0
+    for value in values:
+        block.append(value)
+        if len(block) >= BLOCK_SIZE:
+            file.write(block.tobytes())
+            written += len(block)
+            block = array.array(typecode)
+    file.write(block.tobytes())
+    return written + len(block)
+
+def write_run(path: str, items):
+    '''
+    This function writes sorted (n-gram, count) items to a run file.
+    '''
+    with open(path, "wb") as file:
+        write_values(file, "Q", (value for ngram_ids, count in items for value in ngram_ids + (count,)))
+
+def read_run(path: str, order: int):
+    '''
+    This function yields the (n-gram, count) items of a run file of n-grams of an order.
+    '''
+    width = order + 1
+    with open(path, "rb") as file:
+        while True:
+            data = file.read(READ_SIZE - READ_SIZE % (8 * width))
+            if not data:
+                break
+            block = array.array("Q")
+            block.frombytes(data)
+            for i in range(0, len(block), width):
+                yield tuple(block[i: i + order]), block[i + order]
+
+def merge_items(streams):
+    '''
+    This function merges sorted streams of (n-gram, count) items into one, adding up the counts of
+    the same n-gram.
+    '''
+    current, total = None, 0
+    for ngram_ids, count in heapq.merge(*streams):
+        if ngram_ids == current:
+            total += count
+            continue
+        if current is not None:
+            yield current, total
+        current, total = ngram_ids, count
+    if current is not None:
+        yield current, total
+
+def merge_runs(paths: list, order: int, directory: str) -> str:
+    '''
+    This function merges the run files of the n-grams of an order into one run file (at most
+    MAX_FAN_IN at once) and returns its path. The merged runs are deleted.
+    '''
+    generation = 0
+    while len(paths) > 1 or generation == 0:
+        merged_paths = list()
+        for start in range(0, max(len(paths), 1), MAX_FAN_IN):
+            batch = paths[start: start + MAX_FAN_IN]
+            merged_path = os.path.join(directory, f"merged-{order}-{generation}-{start}.bin")
+            write_run(merged_path, merge_items([read_run(path, order) for path in batch]))
+            for path in batch:
+                os.remove(path)
+            merged_paths.append(merged_path)
+        paths = merged_paths
+        generation += 1
+    return paths[0]
+
+class SpillingCounts:
+    '''
+    This class counts the n-grams of token ids of every order up to order, and writes the counts
+    to sorted run files in directory whenever their estimated size reaches memory_budget bytes.
+    '''
+    def __init__(self, order: int, memory_budget: int, directory: str):
+        self.order = order
+        self.max_entries = max(1, memory_budget // ENTRY_BYTES)
+        self.directory = directory
+        self.levels = [Counter() for _ in range(order)]
+        self.runs = [list() for _ in range(order)]
+
+    def update(self, tokens: list):
+        '''
+        This method counts the n-grams of an utterance (a list of token ids, with the
+        begin-of-utterance and end-of-utterance tokens).
+        '''
+        for k, level in enumerate(self.levels):
+            level.update(zip(*(tokens[i:] for i in range(k + 1))))
+        if sum(len(level) for level in self.levels) >= self.max_entries:
+            self.spill()
+
+    def spill(self):
+        '''
+        This method writes the counts of every order to a new run file and clears them.
+        '''
+        for k, level in enumerate(self.levels):
+            if level:
+                path = os.path.join(self.directory, f"run-{k + 1}-{len(self.runs[k])}.bin")
+                write_run(path, sorted(level.items()))
+                self.runs[k].append(path)
+                level.clear()
+
+    def merged(self) -> list:
+        '''
+        This method spills the remaining counts and returns the merged run file of every order.
+        '''
+        self.spill()
+        return [merge_runs(runs, k + 1, self.directory) for k, runs in enumerate(self.runs)]
+
+def children_starts(prefixes_path: str, ngrams_path: str, order: int):
+    '''
+    This function yields the children array of the count trie (see ngram.CountTrie) from the
+    merged run files of the n-grams of an order and of the next order.
+    '''
+    ngrams = read_run(ngrams_path, order + 1)
+    following = next(ngrams, None)
+    j = 0
+    for prefix, _ in read_run(prefixes_path, order):
+        yield j
+        while following is not None and following[0][:-1] == prefix:
+            j += 1
+            following = next(ngrams, None)
+    yield j
+
+def write_model_file(path: str, order: int, smoothing, threshold: int, vocabulary: list, level_paths: list):
+    '''
+    This function writes a model file (see ngram.py) from the merged run file of every order.
+    '''
+    sizes = array.array("Q", (os.path.getsize(level_path) // (8 * (k + 2)) for k, level_path in enumerate(level_paths)))
+    encoded_vocabulary = "\n".join(vocabulary).encode("utf-8")
+    header = ngram.HEADER.pack(ngram.MAGIC, ngram.FORMAT_VERSION, ngram.BYTEORDER, order,
+                               ngram.smoothing_constant(smoothing), threshold, len(encoded_vocabulary))
+
+    def padding(size):
+        return b"\0" * (-size % 8)
+
+    with open(path, "wb") as file:
+        for section in [header + sizes.tobytes(), encoded_vocabulary]:
+            file.write(section + padding(len(section)))
+        for k, level_path in enumerate(level_paths):
+            written = write_values(file, "I", (ngram_ids[-1] for ngram_ids, _ in read_run(level_path, k + 1)))
+            file.write(padding(4 * written))
+            write_values(file, "Q", (count for _, count in read_run(level_path, k + 1)))
+            if k < order - 1:
+                write_values(file, "Q", children_starts(level_path, level_paths[k + 1], k + 1))
+
+def train(training_set: str, model_path: str, order: int = 3, smoothing=False, oov_threshold=None,
+          memory_budget="512M", directory=None):
+    '''
+    This function trains an n-gram model of the given order (see NgramModel) within a memory budget
+    (bytes, or a size such as 512M) and writes it to model_path. The run files are written to a
+    temporary directory in directory (default: the directory of model_path).
+    '''
+    threshold = ngram.OOV_THRESHHOLD if oov_threshold is None else oov_threshold
+    budget = parse_size(memory_budget)
+
+    # 1. Vocabulary
+    token_counts = Counter()
+    for tokens in corpus.read_utterances(training_set):
+        token_counts.update(tokens)
+    vocabulary = sorted(ngram.kept_tokens(token_counts, threshold) | ({"<s>", "</s>"} if order > 1 else set()))
+    del token_counts
+    ids = {token: i for i, token in enumerate(vocabulary)}
+    unk = ids["<UNK>"]
+    starts = [ids["<s>"]] * (order - 1) if order > 1 else []
+    ends = [ids["</s>"]] if order > 1 else []
+
+    # 2. Counts, spilled to run files
+    directory = tempfile.mkdtemp(prefix="ngram-runs-", dir=directory or os.path.dirname(os.path.abspath(model_path)))
+    try:
+        counts = SpillingCounts(order, budget, directory)
+        for tokens in corpus.read_utterances(training_set):
+            counts.update(starts + [ids.get(token, unk) for token in tokens] + ends)
+        level_paths = counts.merged()
+        spills = len(counts.runs[0])
+        del counts
+        write_model_file(model_path, order, smoothing, threshold, vocabulary, level_paths)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return spills
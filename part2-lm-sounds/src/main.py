@@ -2,12 +2,17 @@
 # assign perplexity with each language model,
 # and produce the output as described in the assignment description.
 from collections import Counter
-import math, sys
-
-OOV_THRESHHOLD = 30
+import math, sys, re
+import corpus
+import ngram
+# The OOV threshold and log_prob_term() are shared with the models of ngram.py
+from ngram import OOV_THRESHHOLD, log_prob_term
 
 TRAINING_SET = "data/training.txt"
 DEV_SET = "data/dev.txt"
+
+# Orders of the n-gram types of the command line (an order can also be given as 4gram, 5gram, ...)
+ORDERS = {"unigram": 1, "bigram": 2, "trigram": 3}
     
 class Unigram:
     '''
@@ -21,18 +26,13 @@ class Unigram:
 
     def process_dataset(self, dataset: str) -> (Counter, int, dict):
         '''
-        This method takes in the path to the dataset, process it and return a count table,
-        total count and a probability table.
+        This method takes in the path to the dataset (a text file or a binary corpus, see
+        corpus.py), process it and return a count table, total count and a probability table.
         '''
         # Read in file
-        with open(dataset, "r") as file:
-            data = file.readlines()
         all_tokens = list()
-        for line in data:
-            tokens = line.split(" ")
-            for token in tokens:
-                if token != "\n":
-                    all_tokens.append(token)
+        for tokens in corpus.read_utterances(dataset):
+            all_tokens.extend(tokens)
     
         # OOV Handling (see README.md)
         global OOV_THRESHHOLD
@@ -97,111 +97,107 @@ class Unigram:
             
         return perplexity
 
+def oov_process(dataset, threshold=None):
+    '''
+    This function determines which tokens are to be changed into <UNK> with a given oov threshhold
+    (default is OOV_THRESHHOLD), and return (1) a set of tokens that are kept unchanged (with <UNK>)
+    and (2) a set of tokens that has been changed to <UNK>
+    '''
+    if threshold is None:
+        threshold = OOV_THRESHHOLD
+
+    # Count tokens and seperate into two sets: tokens with count > threshold or otherwise
+    counts = Counter()
+    for tokens in corpus.read_utterances(dataset):
+        counts.update(tokens)
+    tokens_changed_to_unk = set(token for token, count in counts.items() if count <= threshold)
+    needed_tokens = set(token for token, count in counts.items() if count > threshold)
+    needed_tokens.add("<UNK>")
+
+    return needed_tokens, tokens_changed_to_unk
+
+def add_laplace(count, smoothing):
+    '''
+    This function returns a count of the table with laplace smoothing (1 is added to every cell of
+    the table) if smoothing is True. Unseen n-grams are not stored, their count is 0.
+    '''
+    return count + 1 if smoothing else count
+
+def group_by_history(model):
+    '''
+    This function takes in a sparse count table {(..., given, interest): count} and returns
+    {(..., given): [(interest, count), ...]}.
+    '''
+    successors = dict()
+    for ngram, count in model.items():
+        successors.setdefault(ngram[:-1], list()).append((ngram[-1], count))
+    return successors
+
 class Bigram:
     '''
     This class trains a bigram with the given training set.
+    The count table is sparse: only the bigrams seen in the training set are stored, and laplace
+    smoothing (adding 1 to every cell of the vocabulary x vocabulary table) is computed when a count
+    is read instead of being stored, so the vocabulary can be as large as the words of part1's clean/.
     '''
-    def __init__(self, training_set, smoothing=False):
-        # model is the count table
+    def __init__(self, training_set, smoothing=False, oov_threshold=None):
+        # model is the count table {(given, interest): count} of the seen bigrams
+        # vocabulary is the tokens of the rows and columns of the table (with <UNK>, <s> and </s>)
         # total_count is the total count of the whole table
         # all_tokens stores a list of all tokens in the dataset
         self.smoothing = smoothing
-        self.model, self.total_count, self.all_tokens = self.process_dataset(training_set, smoothing)
+        self.oov_threshold = oov_threshold
+        self.model, self.vocabulary, self.total_count, self.all_tokens = self.process_dataset(training_set, smoothing)
         self.unigram = Counter(self.all_tokens) # Create a unigram for perplexity calculations
         
     def oov_process(self, dataset):
         '''
-        This function determines which tokens are to be changed into <UNK> with a given oov threshhold,
-        and return (1) a set of tokens that are kept unchanged and (2) a set of tokens that has been
-        changed to <UNK>
+        This function determines which tokens are to be changed into <UNK> (see oov_process()).
         '''
-        with open(dataset, "r") as file:
-            data = file.readlines()
-        
-        # Creates a list of all tokens
-        all_tokens = list()
-        for line in data:
-            tokens = line.split(" ")
-            for token in tokens:
-                if token != "\n":
-                    all_tokens.append(token)
-        
-        # OOV handling
-        global OOV_THRESHHOLD
-        counts = Counter(all_tokens)
-
-        # Count tokens and seperate into two lists: tokens with count >= 30 or otherwise
-        tokens_changed_to_unk = set([token for token in all_tokens if counts[token] <= OOV_THRESHHOLD])
-        needed_tokens = set([token for token in all_tokens if counts[token] > OOV_THRESHHOLD])
-        needed_tokens.add("<UNK>")
-        counts = ['<UNK>' if counts[token] <= OOV_THRESHHOLD else token for token in all_tokens] 
-        counts = Counter(counts)
-
-        return needed_tokens, tokens_changed_to_unk
+        return oov_process(dataset, self.oov_threshold)
 
     def process_dataset(self, training_set, smoothing):
         '''
-        This method takes in the path to the dataset, process it and return model (a count table),
-        total_count and a list of all tokens.
+        This method takes in the path to the dataset, process it and return model (a sparse count
+        table), the vocabulary of the table, total_count and a list of all tokens.
         '''
         # Calls self.oov_process() to handle OOV
         needed_tokens, changed_tokens = self.oov_process(dataset=training_set)
-
-        # rows is the given event, columns is the event of interest
-        rows = list(needed_tokens).copy()
-        rows.append("<s>")
-        rows.append("</s>")
-        columns = list(needed_tokens).copy()
-        columns.append("<s>")
-        columns.append("</s>")
-
-        # Initialize model
-        if smoothing:
-            model = {row: {col: 1 for col in columns} for row in rows}
-        else:
-            model = {row: {col: 0 for col in columns} for row in rows}
+        vocabulary = needed_tokens | {"<s>", "</s>"}
 
         # Read in training set and count 
-        with open(TRAINING_SET, "r") as file:
-            data = file.readlines()
-        
         # Insert begin-of-utterance and end-of-utterance tokens
+        model = Counter()
         all_tokens = list()
-        for line in data:
-            tokens = line.split(" ")[:-1]
+        for tokens in corpus.read_utterances(training_set):
             tokens.insert(0, "<s>")
             tokens.append("</s>")
             tokens = ["<UNK>" if item in changed_tokens else item for item in tokens]
 
             # Save all tokens
-            for token in tokens:
-                all_tokens.append(token)
+            all_tokens.extend(tokens)
 
             # Logging count
-            for i in range(len(tokens) - 1):
-                given = tokens[i]
-                interest = tokens[i + 1]
-                model[given][interest] += 1
+            model.update(zip(tokens, tokens[1:]))
         
-        # Calculates total count of the whole table
-        total_count = 0
-        for row in rows:
-            for col in columns:
-                total_count += model[row][col]
+        # Calculates total count of the whole table, with 1 for every cell if smoothing
+        total_count = sum(model.values())
+        if smoothing:
+            total_count += len(vocabulary) ** 2
 
-        return model, total_count, all_tokens
+        return dict(model), vocabulary, total_count, all_tokens
 
     def token_count(self, interest, given) -> int:
         '''
         This method returns the count of the word of interest given its previous word.
         '''
         # Treat unseen tokens as <UNK>
-        if given not in self.model:
+        if given not in self.vocabulary:
             given = "<UNK>"
-        if interest not in self.model[given]:
+        if interest not in self.vocabulary:
             interest = "<UNK>"
 
-        return self.model[given][interest]
+        return add_laplace(self.model.get((given, interest), 0), self.smoothing)
     
     def unigram_count(self, interest) -> int:
         '''
@@ -213,21 +209,43 @@ class Bigram:
 
         return self.unigram[interest]
 
+    def table_log_prob(self, rows, columns):
+        '''
+        This method sums up the log probabilities (weighted by their count) of the cells of the count
+        table with a given token in rows and a token of interest in columns, where tokens that are
+        not in the vocabulary are treated as <UNK>. Only the seen bigrams are visited: every other
+        cell has a count of 1 with smoothing (0 without), which is added once per row.
+        '''
+        successors = group_by_history(self.model)
+        known_columns = columns & self.vocabulary
+        unknown_columns = len(columns) - len(known_columns)
+        log_prob_sum = 0
+        for given in rows:
+            count_w = self.unigram_count(given)
+            seen = successors.get((given if given in self.vocabulary else "<UNK>",), [])
+            seen_columns = 0
+            for interest, count in seen:
+                if interest in known_columns:
+                    log_prob_sum += log_prob_term(add_laplace(count, self.smoothing), count_w)
+                    seen_columns += 1
+            if self.smoothing:
+                log_prob_sum += (len(known_columns) - seen_columns) * log_prob_term(1, count_w)
+            if unknown_columns:
+                unknown_count = self.token_count("<UNK>", given)
+                log_prob_sum += unknown_columns * log_prob_term(unknown_count, count_w)
+        return log_prob_sum
+
     def perplexity(self, dataset: str = "training") -> float:
         '''
         This method calculates and return the perplexity of the model or dev set, 
         indicated in the parameter dataset.
+        The perplexity of the dev set sums up the training counts of the cells of a table over the
+        vocabulary of the dev set, divided by the total count of the training bigrams (with 1 for
+        every cell of that table if smoothing).
         '''
         if dataset == "training":
             # Sum up log probabilities
-            log_prob_sum = 0
-            for given in self.model:
-                for interest in self.model[given]:
-                    count_wiMinus1_wi = self.token_count(interest, given)
-                    count_w = self.unigram[given]
-                    if count_wiMinus1_wi != 0 and count_w != 0:
-                        probability_wi_give_wiMinus1 = count_wiMinus1_wi / count_w
-                        log_prob_sum += math.log(probability_wi_give_wiMinus1) * count_wiMinus1_wi
+            log_prob_sum = self.table_log_prob(self.vocabulary, self.vocabulary)
 
             # Calculate perplexity
             perplexity = math.exp((-1 / self.total_count) * log_prob_sum)
@@ -235,16 +253,13 @@ class Bigram:
             return perplexity
                              
         else:
-            dev_model, dev_count, _ = self.process_dataset(dataset, self.smoothing)
+            needed_tokens, _ = self.oov_process(dataset)
+            dev_vocabulary = needed_tokens | {"<s>", "</s>"}
+            dev_count = sum(self.model.values())
+            if self.smoothing:
+                dev_count += len(dev_vocabulary) ** 2
             # Sum up log probabilities
-            log_prob_sum = 0
-            for given in dev_model:
-                for interest in dev_model[given]:      
-                    count_wiMinus1_wi = self.token_count(interest, given)
-                    count_w = self.unigram_count(given)
-                    if count_wiMinus1_wi != 0 and count_w != 0:
-                        probability_wi_give_wiMinus1 = count_wiMinus1_wi / count_w
-                        log_prob_sum += math.log(probability_wi_give_wiMinus1) * count_wiMinus1_wi
+            log_prob_sum = self.table_log_prob(dev_vocabulary, dev_vocabulary)
             # Calculate perplexity        
             perplexity = math.exp((-1 / dev_count) * log_prob_sum)
 
@@ -253,15 +268,19 @@ class Bigram:
 class Trigram:
     '''
     This class trains a trigram with the given training set.
+    The count tables are sparse, as in Bigram.
     '''
-    def __init__(self, training_set, smoothing=False):
+    def __init__(self, training_set, smoothing=False, oov_threshold=None):
         self.smoothing = smoothing
-        # Bigram model and Trigram model and their respective total counts
+        self.oov_threshold = oov_threshold
+        # Bigram model and Trigram model (sparse count tables), the vocabulary of their rows and
+        # columns and their respective total counts
         (
             self.bigram_model, 
             self.bigram_total_count, 
             self.trigram_model, 
             self.trigram_total_count, 
+            self.vocabulary,
             self.all_tokens
         ) = self.process_dataset(training_set, smoothing)
         # Unigram of this dataset
@@ -269,34 +288,9 @@ class Trigram:
 
     def oov_process(self, dataset):
         '''
-        This function determines which tokens are to be changed into <UNK> with a given oov threshhold,
-        and return (1) a set of tokens that are kept unchanged and (2) a set of tokens that has been
-        changed to <UNK>
+        This function determines which tokens are to be changed into <UNK> (see oov_process()).
         '''
-        # Read in file
-        with open(dataset, "r") as file:
-            data = file.readlines()
-
-        # Store all tokens
-        all_tokens = list()
-        for line in data:
-            tokens = line.split(" ")
-            for token in tokens:
-                if token != "\n":
-                    all_tokens.append(token)
-
-        # OOV handling
-        global OOV_THRESHHOLD
-        counts = Counter(all_tokens)
-
-        # Split tokens into two lists: tokens with count >= 30 and otherwise
-        tokens_changed_to_unk = set([token for token in all_tokens if counts[token] <= OOV_THRESHHOLD])
-        needed_tokens = set([token for token in all_tokens if counts[token] > OOV_THRESHHOLD])
-        needed_tokens.add("<UNK>")
-        counts = ['<UNK>' if counts[token] <= OOV_THRESHHOLD else token for token in all_tokens] 
-        counts = Counter(counts)
-
-        return needed_tokens, tokens_changed_to_unk
+        return oov_process(dataset, self.oov_threshold)
 
     def process_dataset(self, dataset, smoothing):
         '''
@@ -305,92 +299,44 @@ class Trigram:
         (2) total count of the bigram model
         (3) trigram model 
         (4) total count of the trigram model
-        (5) all tokens in the given dataset
+        (5) the vocabulary of the models
+        (6) all tokens in the given dataset
         '''
         needed_tokens, changed_tokens = self.oov_process(dataset)
+        vocabulary = needed_tokens | {"<s>", "</s>"}
 
-        # Bigram Model
-        dimension = list(needed_tokens).copy()
-        dimension.append("<s>")
-        dimension.append("</s>")
-        rows = dimension.copy()
-        columns = dimension.copy()
-        depth = dimension.copy()
-
-        # Initialize bigram model
-        if smoothing:
-            bigram_model = {row: {col: 1 for col in columns} for row in rows}
-        else:
-            bigram_model = {row: {col: 0 for col in columns} for row in rows}
-
-        with open(TRAINING_SET, "r") as file:
-            data = file.readlines()
-        
+        bigram_model = Counter()
+        trigram_model = Counter()
         # Use these tokens to train unigram
         all_tokens = list()
 
-        # Insert 1 begin-of-utterance tokens and 1 end-of-utterance
-        for line in data:
-            tokens = line.split(" ")[:-1]
+        # Insert 2 begin-of-utterance tokens and 1 end-of-utterance, and log counts into tables
+        for tokens in corpus.read_utterances(dataset):
             tokens.insert(0, "<s>")
             tokens.insert(0, "<s>")
             tokens.append("</s>")
             tokens = ["<UNK>" if item in changed_tokens else item for item in tokens]
 
             # Store all tokens
-            for token in tokens:
-                all_tokens.append(token)
-
-            # Log counts into table
-            for i in range(len(tokens) - 1):
-                given = tokens[i]
-                interest = tokens[i + 1]
-                bigram_model[given][interest] += 1
-        
-        # Calculates bigram total count
-        bigram_total_count = 0
-        for row in rows:
-            for col in columns:
-                bigram_total_count += bigram_model[row][col]
+            all_tokens.extend(tokens)
 
-        # Initialize trigram model
+            bigram_model.update(zip(tokens, tokens[1:]))
+            trigram_model.update(zip(tokens, tokens[1:], tokens[2:]))
+        
+        # Calculates total counts, with 1 for every cell if smoothing
+        bigram_total_count = sum(bigram_model.values())
+        trigram_total_count = sum(trigram_model.values())
         if smoothing:
-            trigram_model = {row: {col: {dep: 1 for dep in depth} for col in columns} for row in rows}
-        else:
-            trigram_model = {row: {col: {dep: 0 for dep in depth} for col in columns} for row in rows}
-
-        with open(TRAINING_SET, "r") as file:
-            data = file.readlines()
-
-        # Insert 2 begin-of-utterance tokens and 1 end-of-utterance
-        for line in data:
-            tokens = line.split(" ")[:-1]
-            tokens.insert(0, "<s>")
-            tokens.insert(0, "<s>")
-            tokens.append("</s>")
-            tokens = ["<UNK>" if item in changed_tokens else item for item in tokens]
-
-            # Log counts into table
-            for i in range(len(tokens) - 2):
-                given = tokens[i]
-                given2 = tokens[i + 1]
-                interest = tokens[i + 2]
-                trigram_model[given][given2][interest] += 1
-
-        # Calculates trigram total count
-        trigram_total_count = 0
-        for row in rows:
-            for col in columns:
-                for dep in depth:
-                    trigram_total_count += trigram_model[row][col][dep]
+            bigram_total_count += len(vocabulary) ** 2
+            trigram_total_count += len(vocabulary) ** 3
  
-        return bigram_model, bigram_total_count, trigram_model, trigram_total_count, all_tokens
+        return dict(bigram_model), bigram_total_count, dict(trigram_model), trigram_total_count, vocabulary, all_tokens
         
     def bigram_token_count(self, interest, given):
         '''
         This method returns the bigram count of the word of interest given its previous word.
         '''
-        return self.bigram_model[given][interest]
+        return add_laplace(self.bigram_model.get((given, interest), 0), self.smoothing)
     
     def trigram_token_count(self, interest, given1, given2):
         '''
@@ -398,24 +344,41 @@ class Trigram:
         Example: eat an apple
         given1 = "eat", given2 = "an", word of interest = "apple"
         '''
-        return self.trigram_model[given1][given2][interest]
+        return add_laplace(self.trigram_model.get((given1, given2, interest), 0), self.smoothing)
+
+    def table_log_prob(self, vocabulary):
+        '''
+        This method sums up the log probabilities (weighted by their count) of the cells of the
+        trigram count table with all three tokens in vocabulary. A cell whose two given tokens were
+        never seen together has a bigram count of 0 (or 1 with smoothing, so a probability of 1), so
+        only the seen bigrams are visited, and the cells of the unseen trigrams are added at once.
+        '''
+        successors = group_by_history(self.trigram_model)
+        log_prob_sum = 0
+        for (given1, given2), count in self.bigram_model.items():
+            if given1 not in vocabulary or given2 not in vocabulary:
+                continue
+            bigram_count = add_laplace(count, self.smoothing)
+            seen_columns = 0
+            for interest, trigram_count in successors.get((given1, given2), []):
+                if interest in vocabulary:
+                    log_prob_sum += log_prob_term(add_laplace(trigram_count, self.smoothing), bigram_count)
+                    seen_columns += 1
+            if self.smoothing:
+                log_prob_sum += (len(vocabulary) - seen_columns) * log_prob_term(1, bigram_count)
+        return log_prob_sum
     
     def perplexity(self, dataset: str = "training"):
         '''
         This method calculates and return the perplexity of the model or dev set, 
         indicated in the parameter dataset.
+        The perplexity of the dev set sums up the training counts of the cells of a table over the
+        vocabulary of the dev set, divided by the total count of the training trigrams (with 1 for
+        every cell of that table if smoothing).
         '''
         if dataset == "training":
             # Sum up log probabilities
-            log_prob_sum = 0
-            for given1 in self.trigram_model:
-                for given2 in self.trigram_model[given1]:
-                    for interest in self.trigram_model[given1][given2]:
-                        trigram_count = self.trigram_token_count(interest, given1, given2)               
-                        bigram_count = self.bigram_token_count(given2, given1)
-                        if trigram_count != 0 and bigram_count != 0:
-                            probability = trigram_count / bigram_count
-                            log_prob_sum += math.log(probability) * trigram_count
+            log_prob_sum = self.table_log_prob(self.vocabulary)
 
             # Calculate perplexity
             perplexity = math.exp((-1 / self.trigram_total_count) * log_prob_sum)
@@ -423,27 +386,135 @@ class Trigram:
             return perplexity
                         
         else:
-            _, _, dev_trigram_model, dev_trigram_total_count, _ = self.process_dataset(dataset, self.smoothing)
+            needed_tokens, _ = self.oov_process(dataset)
+            dev_vocabulary = needed_tokens | {"<s>", "</s>"}
+            dev_trigram_total_count = sum(self.trigram_model.values())
+            if self.smoothing:
+                dev_trigram_total_count += len(dev_vocabulary) ** 3
             # Sum up log probabilities
-            log_prob_sum = 0
-            for given1 in dev_trigram_model:
-                for given2 in dev_trigram_model[given1]:
-                    for interest in dev_trigram_model[given1][given2]:
-                        trigram_count = self.trigram_token_count(interest, given1, given2)               
-                        bigram_count = self.bigram_token_count(given2, given1)
-                        if trigram_count != 0 and bigram_count != 0:
-                            probability = trigram_count / bigram_count
-                            log_prob_sum += math.log(probability) * trigram_count
+            log_prob_sum = self.table_log_prob(dev_vocabulary)
 
             # Calculate perplexity
             perplexity = math.exp((-1 / dev_trigram_total_count) * log_prob_sum)
 
             return perplexity
 
+def ngram_order(n_gram_type: str) -> int:
+    '''
+    This function returns the order of an n-gram type of the command line (unigram, bigram, trigram,
+    4gram, 5gram, ...).
+    '''
+    if n_gram_type in ORDERS:
+        return ORDERS[n_gram_type]
+    if re.fullmatch(r"[1-9][0-9]*gram", n_gram_type):
+        return int(n_gram_type[:-len("gram")])
+    raise KeyError("Unknown n-gram type " + n_gram_type + ", please check README.md for example usage")
+
+def train_command(arguments: list):
+    '''
+    Trains a model and saves it to a model file (see ngram.py), or to an ARPA file if the model path
+    ends with .arpa (see arpa.py):
+    train [n-gram type] [training set path] [model path] [optional --laplace] [optional --jobs N]
+          [optional --memory-budget SIZE]
+    '''
+    if len(arguments) < 3:
+        raise KeyError("Please check README.md for example usage")
+    smoothing, jobs, memory_budget = False, 1, None
+    options = iter(arguments[3:])
+    for option in options:
+        if option == "--laplace":
+            smoothing = True
+        elif option == "--jobs":
+            jobs = int(next(options, 0))
+        elif option == "--memory-budget":
+            memory_budget = next(options, None)
+            if memory_budget is None:
+                raise KeyError("Please check README.md for example usage")
+        else:
+            raise KeyError("Please check README.md for example usage")
+    if memory_budget is not None and jobs > 1:
+        raise KeyError("--jobs and --memory-budget cannot be combined: the counting within a memory budget is done by one process")
+    import arpa
+    n_gram_type, training_set, model_path = arguments[:3]
+    if memory_budget is not None and not model_path.endswith(".arpa"):
+        # The model file is written from the counts spilled to disk (see external.py)
+        import external
+        spills = external.train(training_set, model_path, ngram_order(n_gram_type), smoothing,
+                                memory_budget=memory_budget)
+        print("Counts spilled to disk: " + str(spills) + " time(s)")
+    else:
+        model = ngram.NgramModel(training_set, ngram_order(n_gram_type), smoothing, jobs=jobs,
+                                 memory_budget=memory_budget)
+        if model_path.endswith(".arpa"):
+            arpa.write_arpa(model, model_path)
+        else:
+            model.save(model_path)
+    print("N-gram type: " + n_gram_type.title())
+    print("Smoothing: " + ("Laplace" if smoothing else "None"))
+    print("Model is in " + model_path)
+
+def evaluate_command(arguments: list):
+    '''
+    Opens a model file or an ARPA file and evaluates it on one or more dev sets, without reading the
+    training set:
+    evaluate [model path] [dev set path] [more dev set paths] [optional --stream or --scores FILE]
+    '''
+    import arpa
+    paths, stream, scores_path = list(), False, None
+    options = iter(arguments)
+    for argument in options:
+        if argument == "--stream":
+            stream = True
+        elif argument == "--scores":
+            stream = True
+            scores_path = next(options, None)
+            if scores_path is None:
+                raise KeyError("Please check README.md for example usage")
+        else:
+            paths.append(argument)
+    if len(paths) < 2:
+        raise KeyError("Please check README.md for example usage")
+
+    # ARPA files (such as lms/trigram.arpa) are only scored one utterance at a time
+    if arpa.is_arpa(paths[0]):
+        model = arpa.read_arpa(paths[0])
+        smoothing = "Backoff (ARPA)"
+        stream = True
+    else:
+        model = ngram.NgramModel.open(paths[0])
+        smoothing = ngram.smoothing_name(model.smoothing).title()
+    print("N-gram order: " + str(model.order))
+    print("Smoothing: " + smoothing)
+    scores_file = open(scores_path, 'w', encoding='utf-8') if scores_path is not None else None
+    try:
+        for dev_set in paths[1:]:
+            if stream:
+                perplexity = model.evaluate(dev_set, scores_file)["perplexity"]
+            else:
+                perplexity = model.perplexity(dev_set)
+            print("Perplexity of " + dev_set + ": " + str(round(perplexity, 5)))
+    finally:
+        if scores_file is not None:
+            scores_file.close()
+
 def main():
     '''
     Reads in arguments passed into main.py and train and evaluate the required model.
     '''
+    # Model files: train once, evaluate many times
+    if len(sys.argv) >= 2 and sys.argv[1] == "train":
+        return train_command(sys.argv[2:])
+    if len(sys.argv) >= 2 and sys.argv[1] == "evaluate":
+        return evaluate_command(sys.argv[2:])
+    # All models and smoothings at once (see evaluation.py)
+    if len(sys.argv) >= 2 and sys.argv[1] == "table":
+        import evaluation
+        return evaluation.main(sys.argv[2:])
+    # A trained model served to other programs (see server.py)
+    if len(sys.argv) >= 2 and sys.argv[1] == "serve":
+        import server
+        return server.main(sys.argv[2:])
+
     try:
         if len(sys.argv) >= 4: 
             global TRAINING_SET
@@ -453,27 +524,64 @@ def main():
             TRAINING_SET = sys.argv[2]     # path to the training set
             DEV_SET = sys.argv[3]          # path to the dev set (the set to be calculate PPL on)
             smoothing = False              # default = False if no --laplace is passed in
+            backend = "python"             # default = python if no --numpy is passed in
+            stream = False                 # default = False if no --stream is passed in
+            scores_path = None             # file of the score of every utterance (--scores)
+            jobs = 1                       # number of processes counting the training set (--jobs)
+            memory_budget = None           # memory for the counts, spilled to disk beyond (--memory-budget)
         
-        if len(sys.argv) == 5:
-            if sys.argv[4] == "--laplace": # set smoothing True if --laplace is passed in
+        options = iter(sys.argv[4:])
+        for option in options:
+            if option == "--laplace":      # set smoothing True if --laplace is passed in
                 smoothing = True
+            elif option == "--numpy":      # use the NumPy backend (see vectorized.py)
+                backend = "numpy"
+            elif option == "--stream":     # score the dev set one utterance at a time (see ngram.py)
+                stream = True
+            elif option == "--scores":     # write the score of every utterance (implies --stream)
+                stream = True
+                scores_path = next(options)
+            elif option == "--jobs":       # count the training set with a pool of processes
+                jobs = int(next(options))
+            elif option == "--memory-budget":  # count the training set within a memory budget
+                memory_budget = next(options)
+            else:
+                raise ValueError(option)
+        if (stream or memory_budget is not None) and backend == "numpy":
+            raise ValueError("--stream")
+        if memory_budget is not None and jobs > 1:
+            raise ValueError("--jobs")
 
     except:
         error_message = "Please check README.md for example usage"
         raise KeyError(error_message)
     
+    # Order of the n gram model given its type
+    order = ngram_order(n_gram_type)
+
     # Train n gram model given its type
-    if n_gram_type == "unigram":
-        model = Unigram(TRAINING_SET)
-    
-    elif n_gram_type == "bigram":
-        model = Bigram(TRAINING_SET, smoothing)
-    
-    elif n_gram_type == "trigram":
-        model = Trigram(TRAINING_SET, smoothing)
+    if backend == "numpy":
+        # The NumPy backend is only imported when it is used, so NumPy stays optional
+        import vectorized
+        if order == 1:
+            model = vectorized.Unigram(TRAINING_SET)
+        elif order == 2:
+            model = vectorized.Bigram(TRAINING_SET, smoothing)
+        elif order == 3:
+            model = vectorized.Trigram(TRAINING_SET, smoothing)
+        else:
+            raise KeyError("The NumPy backend only trains unigrams, bigrams and trigrams")
+    else:
+        model = ngram.NgramModel(TRAINING_SET, order, smoothing, jobs=jobs, memory_budget=memory_budget)
 
     # Evaluate model with the perplexity metric
-    dev_set_perplexity = model.perplexity(DEV_SET)
+    if not stream:
+        dev_set_perplexity = model.perplexity(DEV_SET)
+    elif scores_path is None:
+        dev_set_perplexity = model.evaluate(DEV_SET)["perplexity"]
+    else:
+        with open(scores_path, 'w', encoding='utf-8') as scores_file:
+            dev_set_perplexity = model.evaluate(DEV_SET, scores_file)["perplexity"]
     
     # Print out statistics
     print("N-gram type: " + n_gram_type.title())
@@ -0,0 +1,883 @@
+'''
+This module is a language model of any order (python3 src/main.py 4gram ...).
+
+The counts of the n-grams of every order up to the order of the model are
+stored in a count trie (see CountTrie): for every order, the ids of the last
+token of the seen n-grams and their counts, sorted, in arrays. The memory is
+proportional to the number of distinct n-grams seen, whatever the size of the
+vocabulary, and smoothing (laplace or add-k) is computed when a count is read.
+The perplexities are those of the Unigram, Bigram and Trigram classes of
+main.py, for any order (see NgramModel.perplexity()).
+
+A trained model can be saved to a model file (see NgramModel.save()) with
+the following layout, every section starting at a multiple of 8 bytes:
+- a header (see HEADER below) and the number of n-grams of every order
+- vocabulary : the tokens (utf-8) separated by new lines (token id = line)
+- for every order k: tokens[k] (uint32), counts[k] (uint64) and, but for
+  the last order, children[k] (uint64) of the count trie
+NgramModel.open() memory-maps the file, so a model is loaded without reading
+its counts, and worker processes opening the same file share its pages.
+
+A model trained with updatable=True also keeps its counts before the OOV
+handling (see RawCounts), so that utterances can be added (NgramModel.update())
+or removed (remove()) without reading the training set again, giving the model
+of a full retrain.
+'''
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import sys, os, mmap, array, struct, bisect, math, tempfile, weakref
+import corpus
+
+# Tokens seen at most this many times in a dataset are <UNK> (see main.oov_process())
+OOV_THRESHHOLD = 30
+
+MAGIC = b"NGRM"
+FORMAT_VERSION = 2
+BYTEORDER = b"L" if sys.byteorder == "little" else b"B"
+
+# Number of shards of a dataset per worker process when counting in parallel
+SHARDS_PER_JOB = 4
+
+# magic, format version, byte order, order, count added to every cell (k, 0 without smoothing),
+# oov threshold, size of the vocabulary (bytes), followed by the number of n-grams of every order
+# (uint64[order])
+HEADER = struct.Struct("=4sIc3xIdQQ")
+
+def smoothing_constant(smoothing) -> float:
+    '''
+    This function returns the count added to every cell of a table for a smoothing: False (or None)
+    for none, True for laplace (1), or a number k for add-k.
+    '''
+    if smoothing is True:
+        return 1
+    return smoothing or 0
+
+def smoothing_name(smoothing) -> str:
+    '''
+    This function returns the name of a smoothing (see smoothing_constant()): none, laplace or
+    add-k (e.g. add-0.5).
+    '''
+    k = smoothing_constant(smoothing)
+    if k == 0:
+        return "none"
+    if smoothing is True:
+        return "laplace"
+    return "add-" + format(k, "g")
+
+def parse_smoothing(name: str):
+    '''
+    This function returns the smoothing of a name of smoothing_name() (laplace is add-1).
+    '''
+    if name == "none":
+        return False
+    if name == "laplace":
+        return True
+    if name.startswith("add-"):
+        return float(name[len("add-"):])
+    raise ValueError("Unknown smoothing " + name + " (none, laplace or add-k)")
+
+def log_prob_term(count, given_count):
+    '''
+    This function returns the log probability of a cell of the table weighted by its count, or 0 if
+    either count is 0.
+    '''
+    if count == 0 or given_count == 0:
+        return 0
+    return math.log(count / given_count) * count
+
+def kept_tokens(token_counts: Counter, threshold) -> set:
+    '''
+    This function returns the tokens kept by the OOV handling (see main.oov_process()) from the
+    count of every token: the tokens seen more than threshold times, and <UNK>.
+    '''
+    return {token for token, count in token_counts.items() if count > threshold} | {"<UNK>"}
+
+class CountTrie:
+    '''
+    This class stores the counts of n-grams of token ids (all orders up to
+    order, every prefix of a stored n-gram being stored) as a trie of sorted
+    arrays. For the n-grams of order k + 1 (level k):
+    - tokens[k]   : the id of the last token of every n-gram
+    - counts[k]   : the count of every n-gram
+    - children[k] : the start of the n-grams extending every n-gram in the
+                    next level (with the end of the last one), so that the
+                    n-grams of a level are sorted and grouped by prefix
+    '''
+    def __init__(self, tokens: list, counts: list, children: list):
+        self.tokens = tokens
+        self.counts = counts
+        self.children = children
+
+    @classmethod
+    def build(cls, counts: list):
+        '''
+        This method returns the trie of a list of Counter ({ngram: count})
+        of n-grams (tuples of token ids), one for every order from 1.
+        '''
+        return cls.from_sorted([sorted(level.items()) for level in counts])
+
+    @classmethod
+    def from_sorted(cls, levels: list):
+        '''
+        This method returns the trie of a list of sorted lists of (ngram,
+        count), one for every order from 1.
+        '''
+        tokens, level_counts, level_children = list(), list(), list()
+        previous = None
+        for level in levels:
+            ngrams = [ngram for ngram, _ in level]
+            tokens.append(array.array("I", (ngram[-1] for ngram in ngrams)))
+            level_counts.append(array.array("Q", (count for _, count in level)))
+            if previous is not None:
+                level_children.append(cls.children_of(previous, ngrams))
+            previous = ngrams
+        return cls(tokens, level_counts, level_children)
+
+    @staticmethod
+    def children_of(prefixes: list, ngrams: list) -> array.array:
+        '''
+        This method returns the children array (see the class docstring)
+        from the sorted n-grams of a level (tuples) to the sorted n-grams
+        of the next level, whose prefixes are all in the first level.
+        '''
+        # The n-grams of the next level follow the order of their prefixes
+        children = array.array("Q")
+        j = 0
+        for prefix in prefixes:
+            children.append(j)
+            while j < len(ngrams) and ngrams[j][:-1] == prefix:
+                j += 1
+        children.append(j)
+        if j != len(ngrams):
+            raise ValueError("An n-gram has a prefix that is not in the trie: " + str(ngrams[j]))
+        return children
+
+    @property
+    def order(self) -> int:
+        return len(self.tokens)
+
+    def __len__(self):
+        return sum(len(tokens) for tokens in self.tokens)
+
+    def find(self, ngram) -> int:
+        '''
+        This method returns the position of an n-gram (a sequence of token
+        ids) in its level, or -1 if it was not seen.
+        '''
+        start, end = 0, len(self.tokens[0])
+        for k, token in enumerate(ngram):
+            i = bisect.bisect_left(self.tokens[k], token, start, end)
+            if i == end or self.tokens[k][i] != token:
+                return -1
+            if k + 1 < len(ngram):
+                start, end = self.children[k][i], self.children[k][i + 1]
+        return i
+
+    def count(self, ngram) -> int:
+        '''
+        This method returns the count of an n-gram (0 if it was not seen).
+        '''
+        i = self.find(ngram)
+        return self.counts[len(ngram) - 1][i] if i >= 0 else 0
+
+    def total(self, order: int) -> int:
+        '''
+        This method returns the total count of the n-grams of an order.
+        '''
+        return sum(self.counts[order - 1])
+
+    def ngram_levels(self):
+        '''
+        This method yields the sorted list of the n-grams (tuples of token
+        ids) of every level.
+        '''
+        ngrams = [(token,) for token in self.tokens[0]]
+        yield ngrams
+        for k, children in enumerate(self.children):
+            tokens = self.tokens[k + 1]
+            ngrams = [prefix + (tokens[j],) for i, prefix in enumerate(ngrams)
+                      for j in range(children[i], children[i + 1])]
+            yield ngrams
+
+    def updated(self, changes: list, vocabulary: list = None):
+        '''
+        This method returns the trie of the counts plus changes (a Counter
+        of n-grams and the count added to them, negative to remove, for
+        every order from 1), without the n-grams whose count becomes 0.
+        Every level is merged with its sorted changes in one pass. The
+        n-gram removed more times than counted, if any, is reported with
+        the tokens of vocabulary (the token of every id) if given.
+        '''
+        levels = list()
+        for k, ngrams in enumerate(self.ngram_levels()):
+            counts = self.counts[k]
+            level_changes = sorted(changes[k].items())
+            level = list()
+            i, j = 0, 0
+            while i < len(ngrams) or j < len(level_changes):
+                if j == len(level_changes) or (i < len(ngrams) and ngrams[i] < level_changes[j][0]):
+                    level.append((ngrams[i], counts[i]))
+                    i += 1
+                    continue
+                ngram, count = level_changes[j]
+                if i < len(ngrams) and ngrams[i] == ngram:
+                    count += counts[i]
+                    i += 1
+                j += 1
+                if count < 0:
+                    shown = " ".join(vocabulary[token] for token in ngram) if vocabulary else str(ngram)
+                    raise ValueError("More n-grams removed than counted: " + shown)
+                if count > 0:
+                    level.append((ngram, count))
+            levels.append(level)
+        return CountTrie.from_sorted(levels)
+
+class NgramCounts:
+    '''
+    This class counts the n-grams (tuples of tokens) of every order up to order of a training set
+    in one pass, before the OOV handling: every utterance gets order - 1 begin-of-utterance tokens
+    and one end-of-utterance token (none for order 1). The counts of the models of every lower
+    order, and of any OOV threshold, are computed from them without reading the training set
+    again (see lower() and NgramModel).
+    '''
+    def __init__(self, order: int):
+        self.order = order
+        self.levels = [Counter() for _ in range(order)]
+        self.utterances = 0
+
+    @classmethod
+    def from_dataset(cls, dataset, order: int, jobs: int = 1):
+        '''
+        This method counts the n-grams of a dataset (a path, see corpus.read_utterances(), or an
+        iterable of lists of tokens). With more than one job, the dataset is split into shards
+        (see corpus.shards()) counted by a pool of jobs worker processes, and their counts are
+        merged. The OOV handling comes after the counting, so the counts (and the models) are the
+        same at any number of jobs.
+        '''
+        if not isinstance(dataset, str):
+            counts = cls(order)
+            counts.update(dataset)
+            return counts
+
+        shards = corpus.shards(dataset, jobs * SHARDS_PER_JOB) if jobs > 1 else []
+        if len(shards) <= 1:
+            counts = cls(order)
+            counts.update(corpus.read_utterances(dataset))
+            return counts
+
+        counts = cls(order)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for shard_counts in pool.map(count_shard, shards, [order] * len(shards)):
+                counts.merge(shard_counts)
+        return counts
+
+    def update(self, utterances):
+        '''
+        This method counts the n-grams of an iterable of utterances (lists of tokens).
+        '''
+        starts = ["<s>"] * (self.order - 1)
+        ends = ["</s>"] if self.order > 1 else []
+        for tokens in utterances:
+            tokens = starts + tokens + ends
+            for k, level in enumerate(self.levels):
+                level.update(zip(*(tokens[i:] for i in range(k + 1))))
+            self.utterances += 1
+
+    def merge(self, other):
+        '''
+        This method adds the counts of another NgramCounts of the same order.
+        '''
+        for level, other_level in zip(self.levels, other.levels):
+            level.update(other_level)
+        self.utterances += other.utterances
+
+    def token_counts(self) -> Counter:
+        '''
+        This method returns the count of every token of the utterances, without the
+        begin-of-utterance and end-of-utterance tokens.
+        '''
+        counts = Counter({ngram[0]: count for ngram, count in self.levels[0].items()})
+        if self.order > 1:
+            counts["<s>"] -= (self.order - 1) * self.utterances
+            counts["</s>"] -= self.utterances
+        return +counts
+
+    def lower(self, order: int):
+        '''
+        This method returns the counts of a lower order. An utterance has fewer begin-of-utterance
+        tokens at a lower order, which only removes n-grams made of begin-of-utterance tokens.
+        '''
+        lower = NgramCounts(order)
+        lower.utterances = self.utterances
+        lower.levels = [Counter(level) for level in self.levels[:order]]
+        if order == 1:
+            # No begin-of-utterance and end-of-utterance tokens at all
+            lower.levels[0] = Counter({(token,): count for token, count in self.token_counts().items()})
+            return lower
+        for k, level in enumerate(lower.levels):
+            starts = ("<s>",) * (k + 1)
+            level[starts] -= (self.order - order) * self.utterances
+            if level[starts] <= 0:
+                del level[starts]
+        return lower
+
+def count_shard(shard: tuple, order: int) -> NgramCounts:
+    '''
+    This function counts the n-grams of a shard of a dataset (see corpus.shards()) in a worker
+    process.
+    '''
+    counts = NgramCounts(order)
+    counts.update(corpus.read_shard(shard))
+    return counts
+
+class RawCounts:
+    '''
+    This class stores the counts of n-grams before the OOV handling (see NgramCounts) as a count
+    trie over raw ids, the ids of every token seen (tokens: the token of every raw id), so that
+    they take as little memory as the trie of a model. The counts of utterances are added or
+    removed with updated(), which leaves these counts unchanged.
+    '''
+    def __init__(self, tokens: list, trie: CountTrie, utterances: int, model_file=None):
+        self.tokens = tokens
+        self.ids = {token: i for i, token in enumerate(tokens)}
+        self.trie = trie
+        self.utterances = utterances
+        # Temporary model file of the trie, if it is mapped (see NgramModel.__init__())
+        self.model_file = model_file
+
+    @classmethod
+    def from_counts(cls, counts: NgramCounts):
+        '''
+        This method returns the raw counts of an NgramCounts.
+        '''
+        tokens = sorted(ngram[0] for ngram in counts.levels[0])
+        raw_counts = cls(tokens, None, counts.utterances)
+        raw_counts.trie = CountTrie.build(raw_counts.encode(counts, 1))
+        return raw_counts
+
+    @classmethod
+    def from_model(cls, model, model_file=None):
+        '''
+        This method returns the raw counts of a model trained without OOV handling (threshold 0, so
+        its vocabulary is every token seen).
+        '''
+        end = model.ids.get("</s>")
+        utterances = model.trie.count((end,)) if model.order > 1 and end is not None else 0
+        return cls(model.vocabulary, model.trie, utterances, model_file)
+
+    @property
+    def order(self) -> int:
+        return self.trie.order
+
+    def encode(self, counts: NgramCounts, sign: int) -> list:
+        '''
+        This method returns the counts of n-grams of tokens of an NgramCounts as counts of n-grams
+        of raw ids, multiplied by sign.
+        '''
+        encoded_levels = list()
+        for level in counts.levels:
+            encoded = Counter()
+            for ngram, count in level.items():
+                if any(token not in self.ids for token in ngram):
+                    raise ValueError("More n-grams removed than counted: " + " ".join(ngram))
+                encoded[tuple(self.ids[token] for token in ngram)] += sign * count
+            encoded_levels.append(encoded)
+        return encoded_levels
+
+    def updated(self, changes: NgramCounts, sign: int):
+        '''
+        This method returns the raw counts plus (sign 1) or minus (sign -1) the counts of an
+        NgramCounts. The new tokens get the next raw ids, in sorted order.
+        '''
+        tokens = self.tokens
+        if sign > 0:
+            tokens = tokens + sorted({ngram[0] for ngram in changes.levels[0]} - self.ids.keys())
+        raw_counts = RawCounts(tokens, None, self.utterances + sign * changes.utterances)
+        raw_counts.trie = self.trie.updated(raw_counts.encode(changes, sign), tokens)
+        return raw_counts
+
+    def token_counts(self) -> Counter:
+        '''
+        This method returns the count of every token (see NgramCounts.token_counts()).
+        '''
+        counts = Counter({self.tokens[token]: count for token, count in zip(self.trie.tokens[0], self.trie.counts[0])})
+        if self.order > 1:
+            counts["<s>"] -= (self.order - 1) * self.utterances
+            counts["</s>"] -= self.utterances
+        return +counts
+
+    def encoded(self, ids: dict, unk: int) -> list:
+        '''
+        This method returns the counts of n-grams of the ids of a vocabulary (Counters), the tokens
+        not in it being unk.
+        '''
+        mapping = [ids.get(token, unk) for token in self.tokens]
+        encoded_levels = list()
+        for k, ngrams in enumerate(self.trie.ngram_levels()):
+            encoded = Counter()
+            for ngram, count in zip(ngrams, self.trie.counts[k]):
+                encoded[tuple(mapping[token] for token in ngram)] += count
+            encoded_levels.append(encoded)
+        return encoded_levels
+
+def remove_file(path: str):
+    '''
+    This function deletes a file if it still exists.
+    '''
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class TemporaryFile:
+    '''
+    This class owns a temporary file, which is deleted once no model (or copy of a model) refers
+    to it any more, or at exit.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.finalizer = weakref.finalize(self, remove_file, path)
+
+    def close(self):
+        self.finalizer()
+
+class LanguageModel:
+    '''
+    This class is the scoring of the n-gram models (NgramModel, and arpa.ArpaModel for ARPA files).
+    A model has an order, a vocabulary (ids: token -> id, unk: the id of the unknown tokens), the
+    number of begin-of-utterance tokens before every utterance (starts), whether an end-of-utterance
+    token is predicted (ends), and log_prob(history, token), the natural log probability of a token
+    id given the ids of at most order - 1 tokens before it.
+    '''
+    starts = 0
+    ends = False
+
+    def score_utterance(self, tokens: list) -> (float, int):
+        '''
+        This method returns the log probability of an utterance (a list of tokens, the tokens not in
+        the vocabulary are unknown) and the number of tokens predicted, with the end-of-utterance token.
+        '''
+        history_size = self.order - 1
+        sequence = [self.ids.get(token, self.unk) for token in tokens]
+        if self.ends:
+            sequence = [self.ids["<s>"]] * self.starts + sequence + [self.ids["</s>"]]
+        log_prob_sum = 0
+        for i in range(self.starts, len(sequence)):
+            log_prob_sum += self.log_prob(sequence[max(0, i - history_size): i], sequence[i])
+        return log_prob_sum, len(sequence) - self.starts
+
+    def score(self, utterances):
+        '''
+        This method yields (log probability, number of tokens predicted) for every utterance of a
+        dataset (a path, see corpus.read_utterances()) or of an iterable of lists of tokens. The
+        utterances are read one at a time, so only the model is kept in memory, and the cost depends
+        on the number of tokens scored, not on the size of the vocabulary.
+        '''
+        if isinstance(utterances, str):
+            utterances = corpus.read_utterances(utterances)
+        for tokens in utterances:
+            yield self.score_utterance(tokens)
+
+    def evaluate(self, utterances, scores_file=None) -> dict:
+        '''
+        This method scores a dataset or an iterable of utterances (see score()) and returns the
+        number of utterances, the number of tokens predicted, the total log probability and the
+        perplexity (exp of minus the log probability per token). The score of every utterance is
+        written to scores_file (an open text file) if given, one "log probability<TAB>tokens" line
+        per utterance.
+        '''
+        n_utterances, n_tokens, log_prob_sum = 0, 0, 0
+        for log_prob, tokens in self.score(utterances):
+            n_utterances += 1
+            n_tokens += tokens
+            log_prob_sum += log_prob
+            if scores_file is not None:
+                scores_file.write(repr(log_prob) + "\t" + str(tokens) + "\n")
+        return {
+            "utterances": n_utterances,
+            "tokens": n_tokens,
+            "log_prob": log_prob_sum,
+            "perplexity": math.exp(-log_prob_sum / n_tokens) if n_tokens else math.nan,
+        }
+
+    def perplexity(self, dataset: str = "training") -> float:
+        '''
+        This method returns the perplexity of a dataset (see evaluate()).
+        '''
+        return self.evaluate(dataset)["perplexity"]
+
+class NgramModel(LanguageModel):
+    '''
+    This class trains a language model of the given order with the given training set. Every
+    utterance gets order - 1 begin-of-utterance tokens and one end-of-utterance token (none for a
+    unigram), as in Bigram and Trigram. Orders 1, 2 and 3 are the Unigram, Bigram and Trigram
+    classes of main.py.
+    '''
+    def __init__(self, training_set, order: int = 3, smoothing=False, oov_threshold=None, counts=None, jobs=1,
+                 memory_budget=None, updatable=False):
+        if order < 1:
+            raise ValueError("The order of an n-gram model is at least 1")
+        self.order = order
+        self.smoothing = smoothing
+        self.oov_threshold = oov_threshold
+        self.set_boundaries()
+        self.vocabulary_version = 0
+        self.vocabulary_changes = list()
+
+        # Within a memory budget (bytes, or a size such as 512M), the counts are spilled to disk and
+        # merged into a temporary model file (see external.py), which is then memory-mapped. The
+        # file lives as long as the model, so worker processes can reopen it (see __reduce__())
+        if memory_budget is not None:
+            if jobs > 1 or counts is not None:
+                raise ValueError("A memory budget is only used when one process counts the training set")
+            import external
+            handle, path = tempfile.mkstemp(prefix="ngram-", suffix=".lm")
+            os.close(handle)
+            model_file = TemporaryFile(path)
+            external.train(training_set, path, order, smoothing, oov_threshold, memory_budget, os.path.dirname(path))
+            self.__dict__.update(NgramModel.open(path).__dict__)
+            self.model_file = model_file
+            self.smoothing = smoothing
+            self.oov_threshold = oov_threshold
+            self.raw_counts = None
+            if updatable:
+                # The raw counts are the trie of a model without OOV handling, spilled the same way
+                handle, raw_path = tempfile.mkstemp(prefix="ngram-raw-", suffix=".lm")
+                os.close(handle)
+                raw_file = TemporaryFile(raw_path)
+                external.train(training_set, raw_path, order, False, 0, memory_budget, os.path.dirname(raw_path))
+                self.raw_counts = RawCounts.from_model(NgramModel.open(raw_path), raw_file)
+            return
+
+        # Count the n-grams of every order up to the order of the model (in one pass), unless the
+        # counts of this or a higher order are given
+        if counts is None:
+            counts = NgramCounts.from_dataset(training_set, order, jobs)
+        elif counts.order > order:
+            counts = counts.lower(order)
+
+        self.set_vocabulary(self.training_vocabulary(counts.token_counts()))
+        self.trie = CountTrie.build(self.encode(counts.levels))
+        self.unigram_total = self.trie.total(1)
+
+        # With updatable, the counts before the OOV handling are kept (see RawCounts) for update()
+        # and remove()
+        self.raw_counts = RawCounts.from_counts(counts) if updatable else None
+
+    @property
+    def threshold(self) -> int:
+        '''
+        This property is the OOV threshold of the model (OOV_THRESHHOLD by default).
+        '''
+        return OOV_THRESHHOLD if self.oov_threshold is None else self.oov_threshold
+
+    @property
+    def k(self) -> float:
+        '''
+        This property is the count added to every cell of the tables: 0 without smoothing, 1 with
+        laplace smoothing (smoothing=True) and k with add-k smoothing (smoothing=k).
+        '''
+        return smoothing_constant(self.smoothing)
+
+    def set_boundaries(self):
+        '''
+        This method sets the begin-of-utterance and end-of-utterance tokens of an utterance: order - 1
+        and 1 (none for a unigram).
+        '''
+        self.starts = self.order - 1
+        self.ends = self.order > 1
+
+    def set_vocabulary(self, vocabulary: list):
+        '''
+        This method sets the vocabulary (the token of every token id, sorted) of the model.
+        '''
+        self.vocabulary = vocabulary
+        self.ids = {token: i for i, token in enumerate(vocabulary)}
+        self.unk = self.ids["<UNK>"]
+
+    def training_vocabulary(self, token_counts: Counter) -> list:
+        '''
+        This method returns the vocabulary of the token counts of the training set: the tokens kept
+        by the OOV handling (see main.oov_process()), with <s> and </s> but for a unigram, sorted,
+        so that the same counts always give the same token ids.
+        '''
+        needed_tokens = kept_tokens(token_counts, self.threshold)
+        return sorted(needed_tokens | ({"<s>", "</s>"} if self.order > 1 else set()))
+
+    def encode(self, levels: list, sign: int = 1) -> list:
+        '''
+        This method returns the counts of n-grams of tokens of every order (Counters) as counts of
+        n-grams of token ids, multiplied by sign. The n-grams that become the same with <UNK> are
+        added up.
+        '''
+        ids, unk = self.ids, self.unk
+        encoded_levels = list()
+        for level in levels:
+            encoded = Counter()
+            for ngram, count in level.items():
+                encoded[tuple(ids.get(token, unk) for token in ngram)] += sign * count
+            encoded_levels.append(encoded)
+        return encoded_levels
+
+    def history_count(self, level: int, i: int) -> float:
+        '''
+        This method returns the count of the i-th n-gram of a level of the trie as the history of a
+        longer n-gram: smoothing is added to the tables of bigrams and longer n-grams (as in
+        Trigram), not to the unigram counts (as in Bigram).
+        '''
+        return self.trie.counts[level][i] + (self.k if level > 0 else 0)
+
+    def table_log_prob(self, multiplicity: list) -> float:
+        '''
+        This method sums up the log probabilities (weighted by their count) of the cells of the count
+        table (history x token of interest) over a set of tokens, given as the number of tokens of the
+        set counted as every token id (tokens not in the vocabulary are counted as <UNK>). A cell is
+        counted once per token of the set it stands for. Only the seen histories are visited: every
+        other history has a count of 0 (or k with smoothing, so a probability of 1), and the cells of
+        the unseen tokens of interest are added at once for every history.
+        '''
+        trie, size, k = self.trie, sum(multiplicity), self.k
+        history_level = self.order - 2
+        # Number of times every n-gram up to the histories stands for a cell
+        weights = [multiplicity[token] for token in trie.tokens[0]]
+        for level in range(history_level):
+            children = trie.children[level]
+            weights = [
+                weights[i] * multiplicity[trie.tokens[level + 1][j]]
+                for i in range(len(weights)) for j in range(children[i], children[i + 1])
+            ]
+
+        tokens, counts = trie.tokens[-1], trie.counts[-1]
+        children = trie.children[history_level]
+        log_prob_sum = 0
+        for i, weight in enumerate(weights):
+            if weight == 0:
+                continue
+            given_count = self.history_count(history_level, i)
+            seen_columns = 0
+            row_sum = 0
+            for j in range(children[i], children[i + 1]):
+                columns = multiplicity[tokens[j]]
+                if columns:
+                    row_sum += columns * log_prob_term(counts[j] + k, given_count)
+                    seen_columns += columns
+            if k:
+                row_sum += (size - seen_columns) * log_prob_term(k, given_count)
+            log_prob_sum += weight * row_sum
+        return log_prob_sum
+
+    def multiplicity(self, tokens) -> list:
+        '''
+        This method returns how many tokens of a set are counted as every token id (see
+        table_log_prob()).
+        '''
+        multiplicity = [0] * len(self.vocabulary)
+        for token in tokens:
+            multiplicity[self.ids.get(token, self.unk)] += 1
+        return multiplicity
+
+    def unigram_perplexity(self, token_counts: Counter = None) -> float:
+        '''
+        This method calculates and return the perplexity of a unigram model (see main.Unigram) on
+        the training set, or on a dev set given the count of every token (token_counts). The dev set
+        has its own OOV handling, then the tokens not seen in the training set are <UNK>.
+        '''
+        k = self.k
+        total = self.unigram_total + k * len(self.vocabulary)
+        training_counts = {self.vocabulary[token]: count for token, count in zip(self.trie.tokens[0], self.trie.counts[0])}
+        if token_counts is None:
+            counts = training_counts
+        else:
+            counts = Counter()
+            for token, count in token_counts.items():
+                counts["<UNK>" if count <= self.threshold or token not in training_counts else token] += count
+        log_prob_sum = sum(-math.log((training_counts[token] + k) / total) * count for token, count in counts.items())
+        return math.exp(log_prob_sum / sum(counts.values()))
+
+    def table_perplexity(self, token_counts: Counter = None) -> float:
+        '''
+        This method calculates and return the perplexity of the model on the training set, or on a
+        dev set given the count of every token (token_counts).
+        The perplexity sums up the training counts of the cells of the table over the vocabulary of
+        the training set, or of the dev set (see Bigram.perplexity()), divided by the total count of
+        the training n-grams (with k for every cell of that table if smoothing).
+        '''
+        if self.order == 1:
+            return self.unigram_perplexity(token_counts)
+
+        if token_counts is None:
+            tokens = self.vocabulary
+        else:
+            tokens = kept_tokens(token_counts, self.threshold) | {"<s>", "</s>"}
+        total_count = self.trie.total(self.order) + self.k * len(tokens) ** self.order
+        log_prob_sum = self.table_log_prob(self.multiplicity(tokens))
+        return math.exp((-1 / total_count) * log_prob_sum)
+
+    def perplexity(self, dataset: str = "training") -> float:
+        '''
+        This method calculates and return the perplexity of the model or dev set,
+        indicated in the parameter dataset (see table_perplexity()).
+        '''
+        if dataset == "training":
+            return self.table_perplexity()
+        token_counts = Counter()
+        for tokens in corpus.read_utterances(dataset):
+            token_counts.update(tokens)
+        return self.table_perplexity(token_counts)
+
+    '''
+    Scoring
+    '''
+    def log_prob(self, history, token: int) -> float:
+        '''
+        This method returns the log probability of a token id given the ids of the order - 1 tokens
+        before it: (count of the n-gram) / (count of the history), with k added to every cell of
+        the table (history x vocabulary) if smoothing. It is -inf if the probability is 0.
+        '''
+        trie = self.trie
+        k = len(history)
+        if k == 0:
+            count, given_count = trie.count((token,)), self.unigram_total
+        else:
+            count, given_count = 0, 0
+            i = trie.find(history)
+            if i >= 0:
+                given_count = trie.counts[k - 1][i]
+                start, end = trie.children[k - 1][i], trie.children[k - 1][i + 1]
+                j = bisect.bisect_left(trie.tokens[k], token, start, end)
+                if j < end and trie.tokens[k][j] == token:
+                    count = trie.counts[k][j]
+        if self.k:
+            count += self.k
+            given_count += self.k * len(self.vocabulary)
+        if count == 0:
+            return -math.inf
+        return math.log(count / given_count)
+
+    '''
+    Online updates
+    '''
+    def update(self, utterances):
+        '''
+        This method adds the utterances of a dataset (a path, see corpus.read_utterances(), or an
+        iterable of lists of tokens) to a model trained with updatable=True, without reading the
+        training set again. The model is the one trained on the training set and all the added
+        utterances.
+        '''
+        self.apply(NgramCounts.from_dataset(utterances, self.order), 1)
+
+    def remove(self, utterances):
+        '''
+        This method removes utterances (see update()), which must have been in the training set or
+        added, from the model. The model is left unchanged if they were not.
+        '''
+        self.apply(NgramCounts.from_dataset(utterances, self.order), -1)
+
+    def apply(self, changes: NgramCounts, sign: int):
+        '''
+        This method adds (sign 1) or removes (sign -1) counts of n-grams. While the vocabulary stays
+        the same, the count trie is merged with the encoded changes. When a token passes the OOV
+        threshold either way, the vocabulary gets a new version (see vocabulary_changes) and every
+        raw count is encoded again with the new token ids.
+        '''
+        if getattr(self, "raw_counts", None) is None:
+            raise ValueError("Only a model trained with updatable=True keeps the counts needed to update it")
+        raw_counts = self.raw_counts.updated(changes, sign)
+
+        vocabulary = self.training_vocabulary(raw_counts.token_counts())
+        if vocabulary == self.vocabulary:
+            self.trie = self.trie.updated(self.encode(changes.levels, sign), self.vocabulary)
+        else:
+            old_tokens, new_tokens = set(self.vocabulary), set(vocabulary)
+            self.vocabulary_version += 1
+            self.vocabulary_changes.append({
+                "version": self.vocabulary_version,
+                "added": sorted(new_tokens - old_tokens),
+                "removed": sorted(old_tokens - new_tokens),
+            })
+            self.set_vocabulary(vocabulary)
+            self.trie = CountTrie.build(raw_counts.encoded(self.ids, self.unk))
+        self.raw_counts = raw_counts
+        self.unigram_total = self.trie.total(1)
+        # The counts are no longer those of the model file (if any)
+        self.path = None
+        self.model_file = None
+
+    '''
+    Model files
+    '''
+    def save(self, path: str):
+        '''
+        This method writes the model to a model file (see the module docstring).
+        '''
+        def padding(size):
+            return b"\0" * (-size % 8)
+
+        vocabulary = "\n".join(self.vocabulary).encode("utf-8")
+        sizes = array.array("Q", (len(tokens) for tokens in self.trie.tokens))
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, BYTEORDER, self.order, self.k, self.threshold,
+                             len(vocabulary))
+        with open(path, "wb") as file:
+            for section in [header + sizes.tobytes(), vocabulary]:
+                file.write(section + padding(len(section)))
+            for k in range(self.order):
+                tokens = self.trie.tokens[k].tobytes()
+                file.write(tokens + padding(len(tokens)))
+                file.write(self.trie.counts[k].tobytes())
+                if k < self.order - 1:
+                    file.write(self.trie.children[k].tobytes())
+
+    @classmethod
+    def open(cls, path: str):
+        '''
+        This method opens a model file written by save(). The arrays of the count trie are
+        zero-copy views into the mapped file.
+        '''
+        with open(path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        if len(view) < HEADER.size:
+            raise ValueError("Not a model file: " + path)
+        magic, version, byteorder, order, smoothing, threshold, vocabulary_size = HEADER.unpack_from(view)
+        if magic != MAGIC or version != FORMAT_VERSION or byteorder != BYTEORDER:
+            raise ValueError("Not a model file of version " + str(FORMAT_VERSION) + ": " + path)
+
+        def section(position, size):
+            return view[position: position + size], position + size + (-size % 8)
+
+        sizes, position = section(HEADER.size, 8 * order)
+        sizes = sizes.cast("Q")
+        vocabulary, position = section(position, vocabulary_size)
+        tokens, counts, children = list(), list(), list()
+        for k in range(order):
+            level, position = section(position, 4 * sizes[k])
+            tokens.append(level.cast("I"))
+            level, position = section(position, 8 * sizes[k])
+            counts.append(level.cast("Q"))
+            if k < order - 1:
+                level, position = section(position, 8 * (sizes[k] + 1))
+                children.append(level.cast("Q"))
+
+        model = cls.__new__(cls)
+        model.path = path
+        model.order = order
+        # Laplace smoothing is add-1
+        model.smoothing = True if smoothing == 1 else smoothing
+        model.oov_threshold = threshold
+        model.set_boundaries()
+        model.set_vocabulary(vocabulary.tobytes().decode("utf-8").split("\n"))
+        model.trie = CountTrie(tokens, counts, children)
+        model.unigram_total = model.trie.total(1)
+        return model
+
+    def __copy__(self):
+        # A copy shares the arrays (and the temporary model file, if any) instead of reopening the file
+        copied = self.__class__.__new__(self.__class__)
+        copied.__dict__.update(self.__dict__)
+        return copied
+
+    def __reduce__(self):
+        # An opened model is reopened (and shared) by worker processes instead of being copied
+        if getattr(self, "path", None) is not None:
+            return (NgramModel.open, (self.path,))
+        return object.__reduce__(self)
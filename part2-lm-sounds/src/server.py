@@ -0,0 +1,390 @@
+'''
+This module serves a trained model (a model file of ngram.py or an ARPA file,
+see arpa.py) on localhost HTTP or on a Unix socket, so that other programs can
+score utterances without training or loading the model for every job:
+    python3 src/main.py serve models/trigram.lm --port 8765
+    python3 src/main.py serve models/trigram.lm --socket /tmp/ngram.sock
+
+POST /score with a JSON body {"utterances": ["h E l o", ["h", "E", "l", "o"]]}
+(an utterance is a line of tokens separated by spaces, or a list of tokens)
+returns the log probability, the number of tokens predicted and the
+perplexity of every utterance and of all of them (see LanguageModel.score()):
+    {"results": [{"log_prob": ..., "tokens": ..., "perplexity": ...}, ...],
+     "utterances": ..., "tokens": ..., "log_prob": ..., "perplexity": ...}
+GET /stats returns the counters of the server (requests, utterances, tokens,
+batches, throughput and latency) and GET /health returns {"status": "ok"}.
+
+The model is loaded once. Every request is handled by its own thread, which
+puts the utterances in a queue and waits: one scoring thread takes the waiting
+requests in batches (up to max_batch utterances, waiting at most batch_delay
+seconds for more), scores the distinct utterances of a batch once and gives
+every request its results. ScoringClient sends requests to a server from
+Python (over TCP or the Unix socket).
+'''
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os, json, math, time, queue, socket, argparse, threading, socketserver, http.client
+import corpus
+import ngram
+
+# Most utterances scored in one batch
+MAX_BATCH = 256
+# Longest wait for more requests before a batch is scored (seconds)
+BATCH_DELAY = 0.002
+# Number of recent requests of the latency counters
+LATENCY_WINDOW = 10000
+# Largest request body (bytes)
+MAX_BODY = 64 * 1024 * 1024
+
+def load_model(path: str) -> ngram.LanguageModel:
+    '''
+    This function opens a model file (see NgramModel.open()) or reads an ARPA file.
+    '''
+    import arpa
+    if arpa.is_arpa(path):
+        return arpa.read_arpa(path)
+    return ngram.NgramModel.open(path)
+
+def finite(value: float):
+    '''
+    This function returns value, or None if it is not finite (JSON has no infinity).
+    '''
+    return value if math.isfinite(value) else None
+
+def perplexity(log_prob: float, tokens: int) -> float:
+    '''
+    This function returns the perplexity of a log probability over a number of tokens.
+    '''
+    return math.exp(-log_prob / tokens) if tokens else math.nan
+
+class ServerStats:
+    '''
+    This class counts the requests, utterances, tokens and batches of a server, with the latency of
+    the last LATENCY_WINDOW requests (from the request being read to the response being ready).
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.utterances = 0
+        self.tokens = 0
+        self.batches = 0
+        self.batched_utterances = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def add_request(self, utterances: int, tokens: int, latency: float):
+        with self.lock:
+            self.requests += 1
+            self.utterances += utterances
+            self.tokens += tokens
+            self.latencies.append(latency)
+
+    def add_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def add_batch(self, utterances: int):
+        with self.lock:
+            self.batches += 1
+            self.batched_utterances += utterances
+
+    def snapshot(self) -> dict:
+        '''
+        This method returns the counters, the throughput since the server started and the mean and
+        percentiles of the latency (milliseconds).
+        '''
+        with self.lock:
+            uptime = time.time() - self.started
+            latencies = sorted(self.latencies)
+            counters = {
+                "uptime": uptime,
+                "requests": self.requests,
+                "errors": self.errors,
+                "utterances": self.utterances,
+                "tokens": self.tokens,
+                "batches": self.batches,
+                "mean_batch_utterances": self.batched_utterances / self.batches if self.batches else 0,
+                "requests_per_second": self.requests / uptime,
+                "utterances_per_second": self.utterances / uptime,
+                "tokens_per_second": self.tokens / uptime,
+            }
+
+        def percentile(fraction):
+            return 1000 * latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+        counters["latency_ms"] = {
+            "mean": 1000 * sum(latencies) / len(latencies),
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": 1000 * latencies[-1],
+        } if latencies else None
+        return counters
+
+class ScoringRequest:
+    '''
+    This class is a request waiting in the queue of a BatchScorer: its utterances (lists of tokens),
+    and their scores or the error once done is set.
+    '''
+    def __init__(self, utterances: list):
+        self.utterances = utterances
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+class BatchScorer:
+    '''
+    This class scores the utterances of the requests of many threads with one model, in batches (see
+    the module docstring).
+    '''
+    def __init__(self, model: ngram.LanguageModel, stats: ServerStats, max_batch=MAX_BATCH, batch_delay=BATCH_DELAY):
+        self.model = model
+        self.stats = stats
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="scorer", daemon=True)
+        self.thread.start()
+
+    def score(self, utterances: list) -> list:
+        '''
+        This method returns the (log probability, number of tokens predicted) of every utterance,
+        once the batch of the request is scored.
+        '''
+        request = ScoringRequest(utterances)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def next_batch(self) -> list:
+        '''
+        This method waits for a request, then takes the requests that arrive within batch_delay
+        seconds, up to max_batch utterances.
+        '''
+        batch = [self.queue.get()]
+        size = len(batch[0].utterances)
+        deadline = time.monotonic() + self.batch_delay
+        while size < self.max_batch:
+            try:
+                request = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.utterances)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            # The same utterance (such as a common word) is only scored once per batch
+            scores = dict()
+            try:
+                for request in batch:
+                    for tokens in request.utterances:
+                        key = tuple(tokens)
+                        if key not in scores:
+                            scores[key] = self.model.score_utterance(tokens)
+                for request in batch:
+                    request.results = [scores[tuple(tokens)] for tokens in request.utterances]
+            except Exception as error:
+                for request in batch:
+                    request.error = error
+            self.stats.add_batch(sum(len(request.utterances) for request in batch))
+            for request in batch:
+                request.done.set()
+
+def parse_utterances(body: bytes) -> list:
+    '''
+    This function returns the utterances (lists of tokens) of the JSON body of a /score request.
+    '''
+    data = json.loads(body.decode("utf-8"))
+    utterances = data.get("utterances") if isinstance(data, dict) else None
+    if not isinstance(utterances, list):
+        raise ValueError('The body must be {"utterances": [...]}')
+    parsed = list()
+    for utterance in utterances:
+        if isinstance(utterance, str):
+            parsed.append(corpus.tokenize(utterance))
+        elif isinstance(utterance, list) and all(isinstance(token, str) for token in utterance):
+            parsed.append(utterance)
+        else:
+            raise ValueError("An utterance is a string or a list of strings: " + repr(utterance)[:100])
+    return parsed
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    '''
+    This class handles the requests of a scoring server (server.scorer and server.stats).
+    '''
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status: int, data: dict):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.server.stats.snapshot())
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": "Unknown path " + self.path})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        length = int(self.headers.get("Content-Length", 0))
+        if self.path != "/score":
+            self.rfile.read(length)
+            return self.send_json(404, {"error": "Unknown path " + self.path})
+        if length > MAX_BODY:
+            self.close_connection = True
+            return self.send_json(413, {"error": "The body is larger than " + str(MAX_BODY) + " bytes"})
+        try:
+            utterances = parse_utterances(self.rfile.read(length))
+        except ValueError as error:
+            self.server.stats.add_error()
+            return self.send_json(400, {"error": str(error)})
+
+        try:
+            scores = self.server.scorer.score(utterances)
+        except Exception as error:
+            self.server.stats.add_error()
+            return self.send_json(500, {"error": str(error)})
+        log_prob_sum = sum(log_prob for log_prob, _ in scores)
+        token_sum = sum(tokens for _, tokens in scores)
+        response = {
+            "results": [
+                {"log_prob": finite(log_prob), "tokens": tokens, "perplexity": finite(perplexity(log_prob, tokens))}
+                for log_prob, tokens in scores
+            ],
+            "utterances": len(scores),
+            "tokens": token_sum,
+            "log_prob": finite(log_prob_sum),
+            "perplexity": finite(perplexity(log_prob_sum, token_sum)),
+        }
+        self.server.stats.add_request(len(scores), token_sum, time.perf_counter() - start)
+        self.send_json(200, response)
+
+    def address_string(self):
+        # The clients of a Unix socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    '''
+    This class is an HTTP server on a Unix socket, with a thread per connection.
+    '''
+    daemon_threads = True
+
+    def server_bind(self):
+        # A socket file left by a server that was stopped is replaced
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+
+def make_server(model: ngram.LanguageModel, host="127.0.0.1", port=8765, socket_path=None, max_batch=MAX_BATCH,
+                batch_delay=BATCH_DELAY, verbose=False):
+    '''
+    This function returns a scoring server of a model on host:port, or on a Unix socket if
+    socket_path is given (port 0 picks a free port, see server.server_address).
+    '''
+    if socket_path is not None:
+        server = UnixHTTPServer(socket_path, ScoringHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ScoringHandler)
+    server.stats = ServerStats()
+    server.scorer = BatchScorer(model, server.stats, max_batch, batch_delay)
+    server.verbose = verbose
+    return server
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    '''
+    This class is an HTTP connection over a Unix socket.
+    '''
+    def __init__(self, socket_path: str, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class ScoringClient:
+    '''
+    This class sends requests to a scoring server on host:port, or on a Unix socket if socket_path
+    is given, over one kept-alive connection (a client per thread).
+    '''
+    def __init__(self, host="127.0.0.1", port=8765, socket_path=None, timeout=60):
+        if socket_path is not None:
+            self.connection = UnixHTTPConnection(socket_path, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method: str, path: str, data=None) -> dict:
+        body = json.dumps(data).encode("utf-8") if data is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        result = json.loads(response.read().decode("utf-8"))
+        if response.status != 200:
+            raise RuntimeError(str(response.status) + ": " + result.get("error", ""))
+        return result
+
+    def score(self, utterances: list) -> dict:
+        '''
+        This method returns the scores of utterances (strings or lists of tokens), see the module
+        docstring.
+        '''
+        return self.request("POST", "/score", {"utterances": list(utterances)})
+
+    def stats(self) -> dict:
+        return self.request("GET", "/stats")
+
+    def close(self):
+        self.connection.close()
+
+def parse_arguments(arguments=None):
+    '''
+    This function reads in the command line arguments of the serve mode.
+    '''
+    parser = argparse.ArgumentParser(prog="main.py serve", description="Serve a trained model for scoring utterances")
+    parser.add_argument("model", help="path to a model file (see main.py train) or an ARPA file")
+    parser.add_argument("--host", default="127.0.0.1", help="address of the HTTP server (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="port of the HTTP server (default: 8765)")
+    parser.add_argument("--socket", default=None, help="path of a Unix socket to serve on instead of HTTP")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH,
+                        help=f"most utterances scored in one batch (default: {MAX_BATCH})")
+    parser.add_argument("--batch-delay", type=float, default=BATCH_DELAY,
+                        help=f"longest wait for more requests before scoring a batch, in seconds (default: {BATCH_DELAY})")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    return parser.parse_args(arguments)
+
+def main(arguments=None):
+    '''
+    Loads a model and serves it until interrupted.
+    '''
+    args = parse_arguments(arguments)
+    start = time.time()
+    model = load_model(args.model)
+    server = make_server(model, args.host, args.port, args.socket, args.max_batch, args.batch_delay, args.verbose)
+    address = args.socket if args.socket is not None else "http://%s:%d" % server.server_address[:2]
+    print(f"Order {model.order} model {args.model} loaded in {time.time() - start:.2f}s, serving on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
@@ -1,4 +1,5 @@
-import random
+import random, sys
+import corpus
 
 def roll_dice(probability=0.8):
     '''
@@ -7,16 +8,23 @@ def roll_dice(probability=0.8):
     '''
     return random.random() < probability
 
-def split_data():
+def split_data(source="data/all_transformed_lines.txt", training_path=None, dev_path=None):
     '''
-    This function reads in data from data/all_transformed_lines.txt, split
-    them into training set and dev set with the given probability, and write
-    them into data/training.txt and data/dev.txt.
+    This function reads in data from data/all_transformed_lines.txt (or any
+    source read by corpus.read_lines(), such as the clean/ directory of
+    part1), split them into training set and dev set with the given
+    probability, and write them into data/training.txt and data/dev.txt (or
+    training_path and dev_path).
+    If source is a binary corpus (see corpus.py), the utterances are split
+    without parsing any text and written as the binary corpora data/training
+    and data/dev (or training_path and dev_path) instead.
     '''
+    if corpus.is_binary_corpus(source):
+        return split_binary_corpus(source, training_path or "data/training", dev_path or "data/dev")
+
     # Read in file
-    with open("data/all_transformed_lines.txt", "r") as file:
-        data = file.readlines()
-    
+    data = list(corpus.read_lines(source))
+
     # Split into training and dev sets
     training = list()
     dev = list()
@@ -25,22 +33,50 @@ def split_data():
             training.append(line)
         else:
             dev.append(line)
-    
+
     # Write them into respective files
-    with open("data/training.txt", "w") as file:
+    with open(training_path or "data/training.txt", "w", encoding="utf-8") as file:
         for line in training:
             file.write(line)
 
-    with open("data/dev.txt", "w") as file:
+    with open(dev_path or "data/dev.txt", "w", encoding="utf-8") as file:
         for line in dev:
-            file.write(line)    
+            file.write(line)
+
+    print_statistics(len(data), len(training), len(dev))
+
+def split_binary_corpus(source, training_path="data/training", dev_path="data/dev"):
+    '''
+    This function splits the utterances of a binary corpus the same way as
+    split_data() and writes them into the binary corpora training_path and
+    dev_path.
+    '''
+    data = corpus.BinaryCorpus(source)
+    training = list()
+    dev = list()
+    for i in range(len(data)):
+        if roll_dice():
+            training.append(data.ids(i))
+        else:
+            dev.append(data.ids(i))
 
-    # Print statistics
-    print("Total number of lines: " + str(len(data)))
-    print("Number of training lines: " + str(len(training)))
-    print("Number of dev lines: " + str(len(dev)))
-    print("Percentage of training lines: " + str(round(100 * len(training) / len(data), 2)) + "%")
-    print("Percentage of dev lines: " + str(round(100 * len(dev) / len(data), 2)) + "%")
+    # The phone ids are kept as they are, so all sets share the vocabulary
+    corpus.write_corpus(training_path, training, data.vocab)
+    corpus.write_corpus(dev_path, dev, data.vocab)
+
+    print_statistics(len(data), len(training), len(dev))
+
+def print_statistics(total, training, dev):
+    '''
+    This function prints the number of lines in each set.
+    '''
+    print("Total number of lines: " + str(total))
+    print("Number of training lines: " + str(training))
+    print("Number of dev lines: " + str(dev))
+    print("Percentage of training lines: " + str(round(100 * training / total, 2)) + "%")
+    print("Percentage of dev lines: " + str(round(100 * dev / total, 2)) + "%")
 
 if __name__ == "__main__":
-    split_data()
\ No newline at end of file
+    # Optional arguments are the path to the source (text file, directory or binary corpus), then
+    # the paths to the training and dev sets
+    split_data(*sys.argv[1:4])
@@ -0,0 +1,257 @@
+'''
+This module is a NumPy backend of the Unigram, Bigram and Trigram classes of
+main.py, for small vocabularies such as the ~72 phones (python3 src/main.py
+bigram data/training.txt data/dev.txt --numpy).
+
+Each dataset is read and integer-encoded once (see encode()). The n-grams are
+counted with numpy.bincount over combined indices (given * size + interest)
+into dense tables, and the perplexities are computed from a table of log
+probabilities gathered over the vocabulary, with the same definitions as the
+classes of main.py (so the perplexities are the same to 1e-9).
+NumPy is only needed by this module.
+'''
+import numpy as np
+import corpus
+import ngram
+
+# Largest dense count table (cells), the phone trigrams have ~400k
+MAX_TABLE_CELLS = 10 ** 8
+
+class EncodedCorpus:
+    '''
+    This class holds a dataset as integers: vocab is the list of distinct
+    tokens, tokens the ids (positions in vocab) of all tokens of all
+    utterances back to back, and offsets the start of every utterance in
+    tokens (with the end of the last one).
+    '''
+    def __init__(self, vocab: list, tokens: np.ndarray, offsets: np.ndarray):
+        self.vocab = vocab
+        self.tokens = tokens
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def counts(self) -> np.ndarray:
+        '''
+        This method returns the count of every token of vocab.
+        '''
+        return np.bincount(self.tokens, minlength=len(self.vocab))
+
+def encode(dataset: str) -> EncodedCorpus:
+    '''
+    This function reads a dataset (see corpus.read_utterances()) once and
+    returns it integer-encoded. A binary corpus is already encoded, so its
+    arrays are used as they are.
+    '''
+    if corpus.is_binary_corpus(dataset):
+        binary = corpus.BinaryCorpus(dataset)
+        tokens = np.frombuffer(binary.tokens, dtype=np.uint8 if binary.tokens.format == "B" else np.uint16)
+        offsets = np.frombuffer(binary.offsets, dtype=np.uint64).astype(np.int64)
+        return EncodedCorpus(list(binary.vocab), tokens.astype(np.int64), offsets)
+
+    ids = dict()
+    tokens = list()
+    offsets = [0]
+    for utterance in corpus.read_utterances(dataset):
+        for token in utterance:
+            token_id = ids.get(token)
+            if token_id is None:
+                token_id = ids[token] = len(ids)
+            tokens.append(token_id)
+        offsets.append(len(tokens))
+    return EncodedCorpus(list(ids), np.array(tokens, dtype=np.int64), np.array(offsets, dtype=np.int64))
+
+class Vocabulary:
+    '''
+    This class is the OOV handling of main.oov_process() on an encoded
+    dataset: the tokens seen more than threshold times are kept, the others
+    are changed to <UNK>. The kept tokens, <UNK>, <s> and </s> are the rows
+    and columns of the count tables (in this order), and index maps every id
+    of the encoded dataset to its row.
+    '''
+    def __init__(self, encoded: EncodedCorpus, threshold=None):
+        if threshold is None:
+            threshold = ngram.OOV_THRESHHOLD
+        counts = encoded.counts()
+        kept = [i for i, count in enumerate(counts) if count > threshold]
+        self.tokens = [encoded.vocab[i] for i in kept if encoded.vocab[i] != "<UNK>"] + ["<UNK>", "<s>", "</s>"]
+        self.ids = {token: i for i, token in enumerate(self.tokens)}
+        self.unk, self.start, self.end = self.ids["<UNK>"], self.ids["<s>"], self.ids["</s>"]
+        self.index = np.array([self.ids.get(token, self.unk) if counts[i] > threshold else self.unk
+                               for i, token in enumerate(encoded.vocab)], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def lookup(self, tokens) -> np.ndarray:
+        '''
+        This method returns the rows of tokens, -1 for the tokens that are
+        not in the vocabulary.
+        '''
+        return np.array([self.ids.get(token, -1) for token in tokens], dtype=np.int64)
+
+def with_boundaries(encoded: EncodedCorpus, vocabulary: Vocabulary, starts: int) -> (np.ndarray, np.ndarray):
+    '''
+    This function returns the rows of all tokens of the encoded dataset, with
+    starts begin-of-utterance tokens and one end-of-utterance token around
+    every utterance, and the offsets of the utterances in it.
+    '''
+    utterances = len(encoded)
+    lengths = np.diff(encoded.offsets)
+    offsets = encoded.offsets + np.arange(utterances + 1) * (starts + 1)
+    sequence = np.empty(offsets[-1], dtype=np.int64)
+    utterance_of_token = np.repeat(np.arange(utterances), lengths)
+    sequence[np.arange(len(encoded.tokens)) + utterance_of_token * (starts + 1) + starts] = vocabulary.index[encoded.tokens]
+    for k in range(starts):
+        sequence[offsets[:-1] + k] = vocabulary.start
+    sequence[offsets[1:] - 1] = vocabulary.end
+    return sequence, offsets
+
+def count_ngrams(sequence: np.ndarray, offsets: np.ndarray, order: int, size: int) -> np.ndarray:
+    '''
+    This function counts the n-grams of the given order within the
+    utterances of sequence (see with_boundaries()) into a dense table of
+    shape (size,) * order.
+    '''
+    if size ** order > MAX_TABLE_CELLS:
+        raise ValueError("The vocabulary is too large for dense count tables: " + str(size) + " tokens")
+    valid = np.ones(len(sequence) - order + 1, dtype=bool)
+    for k in range(1, order):
+        # n-grams starting in the last order - 1 tokens of an utterance would cross into the next one
+        ends = offsets[1:] - k
+        valid[ends[ends < len(valid)]] = False
+    combined = np.zeros(len(valid), dtype=np.int64)
+    for k in range(order):
+        combined = combined * size + sequence[k: k + len(valid)]
+    return np.bincount(combined[valid], minlength=size ** order).reshape((size,) * order)
+
+def weighted_log_prob(counts: np.ndarray, given_counts: np.ndarray) -> float:
+    '''
+    This function returns the sum of log(count / given count) * count over
+    the cells where neither count is 0 (given_counts is broadcast).
+    '''
+    counts = counts.astype(np.float64)
+    given_counts = np.broadcast_to(given_counts, counts.shape).astype(np.float64)
+    mask = (counts != 0) & (given_counts != 0)
+    log_probs = np.zeros(counts.shape)
+    log_probs[mask] = np.log(counts[mask] / given_counts[mask])
+    return float(np.sum(log_probs * counts))
+
+def dev_vocabulary(dataset: str, threshold) -> list:
+    '''
+    This function returns the rows and columns of the tables built from a
+    dev set (as in main.py): its tokens seen more than threshold times,
+    <UNK>, <s> and </s>.
+    '''
+    return Vocabulary(encode(dataset), threshold).tokens
+
+class Unigram:
+    '''
+    This class trains a unigram with the given training set (see main.Unigram).
+    '''
+    def __init__(self, training_set: str, oov_threshold=None):
+        self.oov_threshold = oov_threshold
+        encoded = encode(training_set)
+        self.vocabulary = Vocabulary(encoded, oov_threshold)
+        self.counts = np.bincount(self.vocabulary.index[encoded.tokens], minlength=len(self.vocabulary))
+        self.total = int(self.counts.sum())
+        self.log_probs = np.full(len(self.vocabulary), -np.inf)
+        seen = self.counts > 0
+        self.log_probs[seen] = np.log(self.counts[seen] / self.total)
+
+    def perplexity(self, dataset: str = "training") -> float:
+        '''
+        This method calculates and return the perplexity of the model or dev set,
+        indicated in the parameter dataset.
+        '''
+        if dataset == "training":
+            return float(np.exp(-np.sum(self.log_probs[self.counts > 0] * self.counts[self.counts > 0]) / self.total))
+
+        # The dev set has its own OOV handling, then tokens not seen in training are <UNK>
+        encoded = encode(dataset)
+        dev = Vocabulary(encoded, self.oov_threshold)
+        dev_counts = np.bincount(dev.index[encoded.tokens], minlength=len(dev))
+        rows = self.vocabulary.lookup(dev.tokens)
+        rows[(rows < 0) | (self.counts[np.maximum(rows, 0)] == 0)] = self.vocabulary.unk
+        return float(np.exp(-np.sum(self.log_probs[rows] * dev_counts, where=dev_counts > 0) / dev_counts.sum()))
+
+class Bigram:
+    '''
+    This class trains a bigram with the given training set (see main.Bigram).
+    '''
+    def __init__(self, training_set: str, smoothing=False, oov_threshold=None):
+        self.smoothing = smoothing
+        self.oov_threshold = oov_threshold
+        encoded = encode(training_set)
+        self.vocabulary = Vocabulary(encoded, oov_threshold)
+        sequence, offsets = with_boundaries(encoded, self.vocabulary, 1)
+        size = len(self.vocabulary)
+        self.counts = count_ngrams(sequence, offsets, 2, size)
+        self.unigram = np.bincount(sequence, minlength=size)
+        self.model = self.counts + 1 if smoothing else self.counts
+        self.total_count = int(self.model.sum())
+
+    def table_log_prob(self, tokens: list) -> float:
+        '''
+        This method sums up the log probabilities (weighted by their count) of
+        the cells of the count table with a given token and a token of interest
+        in tokens, where tokens not in the vocabulary are treated as <UNK>.
+        '''
+        rows = self.vocabulary.lookup(tokens)
+        rows[rows < 0] = self.vocabulary.unk
+        return weighted_log_prob(self.model[np.ix_(rows, rows)], self.unigram[rows][:, None])
+
+    def perplexity(self, dataset: str = "training") -> float:
+        '''
+        This method calculates and return the perplexity of the model or dev set,
+        indicated in the parameter dataset (see main.Bigram.perplexity()).
+        '''
+        if dataset == "training":
+            return float(np.exp(-self.table_log_prob(self.vocabulary.tokens) / self.total_count))
+
+        tokens = dev_vocabulary(dataset, self.oov_threshold)
+        dev_count = int(self.counts.sum()) + (len(tokens) ** 2 if self.smoothing else 0)
+        return float(np.exp(-self.table_log_prob(tokens) / dev_count))
+
+class Trigram:
+    '''
+    This class trains a trigram with the given training set (see main.Trigram).
+    '''
+    def __init__(self, training_set: str, smoothing=False, oov_threshold=None):
+        self.smoothing = smoothing
+        self.oov_threshold = oov_threshold
+        encoded = encode(training_set)
+        self.vocabulary = Vocabulary(encoded, oov_threshold)
+        sequence, offsets = with_boundaries(encoded, self.vocabulary, 2)
+        size = len(self.vocabulary)
+        self.bigram_counts = count_ngrams(sequence, offsets, 2, size)
+        self.trigram_counts = count_ngrams(sequence, offsets, 3, size)
+        self.unigram = np.bincount(sequence, minlength=size)
+        self.bigram_model = self.bigram_counts + 1 if smoothing else self.bigram_counts
+        self.trigram_model = self.trigram_counts + 1 if smoothing else self.trigram_counts
+        self.trigram_total_count = int(self.trigram_model.sum())
+
+    def table_log_prob(self, tokens: list) -> float:
+        '''
+        This method sums up the log probabilities (weighted by their count) of
+        the cells of the trigram count table with all three tokens in tokens.
+        Tokens that are not in the vocabulary have no counts, so their cells
+        add nothing.
+        '''
+        rows = self.vocabulary.lookup(tokens)
+        rows = rows[rows >= 0]
+        return weighted_log_prob(self.trigram_model[np.ix_(rows, rows, rows)],
+                                 self.bigram_model[np.ix_(rows, rows)][:, :, None])
+
+    def perplexity(self, dataset: str = "training") -> float:
+        '''
+        This method calculates and return the perplexity of the model or dev set,
+        indicated in the parameter dataset (see main.Trigram.perplexity()).
+        '''
+        if dataset == "training":
+            return float(np.exp(-self.table_log_prob(self.vocabulary.tokens) / self.trigram_total_count))
+
+        tokens = dev_vocabulary(dataset, self.oov_threshold)
+        dev_count = int(self.trigram_counts.sum()) + (len(tokens) ** 3 if self.smoothing else 0)
+        return float(np.exp(-self.table_log_prob(tokens) / dev_count))